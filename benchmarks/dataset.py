@@ -0,0 +1,87 @@
+import logging
+import random
+import shutil
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import soursop.db.connection as connection
+import soursop.db.network_repository as network_repository
+import soursop.db.process_repository as process_repository
+from soursop import util
+from soursop.beans import NetworkUsage, ProcessUsage
+from soursop.db.migrations import SCHEMA_VERSION
+
+HOURS_PER_MONTH = 730
+INTERFACES = ("eth0", "wlan0")
+
+
+def use_database(path: Path) -> None:
+    """Point the repositories, the writer and the CLI handlers at another database file."""
+    connection.DB_PATH = path
+
+
+def hour_entries(rng: random.Random, hour_start: datetime, processes: int) -> tuple[list, list]:
+    date_str, hour, bucket = hour_start.strftime(util.DB_DATE_FORMAT), hour_start.hour, util.hour_bucket(hour_start)
+    network_entries = [NetworkUsage(network=name, date_str=date_str, hour=hour, bucket=bucket,
+                                    incoming_bytes=rng.randint(0, 2 ** 30), outgoing_bytes=rng.randint(0, 2 ** 28))
+                       for name in INTERFACES]
+    # a process keeps its pid for a day, so the rows churn pids like a real machine does
+    process_entries = [ProcessUsage(pid=1000 + index * 100 + hour_start.toordinal() % 100, name=f"process-{index}",
+                                    path=f"/usr/bin/process-{index}", bucket=bucket, date_str=date_str, hour=hour,
+                                    network=INTERFACES[index % len(INTERFACES)],
+                                    incoming_bytes=rng.randint(0, 2 ** 26), outgoing_bytes=rng.randint(0, 2 ** 24),
+                                    packet_count=rng.randint(1, 50000))
+                       for index in range(processes) if rng.random() < 0.7]
+    return network_entries, process_entries
+
+
+def _generate(path: Path, months: int, processes: int) -> None:
+    use_database(path)
+    connection.init_db()
+    rng = random.Random(months)
+    end = datetime.now().replace(minute=0, second=0, microsecond=0)  # the current hour is left to the flushes
+    hour_start = end - timedelta(hours=months * HOURS_PER_MONTH)
+    conn = connection.open_writer_connection()
+    try:
+        while hour_start < end:
+            network_entries, process_entries = [], []
+            for _ in range(24):  # one transaction per day of rows
+                if hour_start >= end:
+                    break
+                hour_network, hour_process = hour_entries(rng, hour_start, processes)
+                network_entries += hour_network
+                process_entries += hour_process
+                hour_start += timedelta(hours=1)
+            with conn:
+                network_repository.update(conn, network_entries)
+                process_repository.add_usages(conn, process_entries)
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    finally:
+        conn.close()
+
+
+def get_database(data_dir: Path, months: int, processes: int) -> Path:
+    """
+    Database with months of hourly network and process rows up to the current hour, generated once and cached
+    in data_dir. Rows are added through the repositories, so the rollup triggers fill the day, week and month
+    tables. A cached database from an older day is still used, its rows just end a bit before today.
+    """
+    path = data_dir / f"usage-{months}m-{processes}p-v{SCHEMA_VERSION}.db"
+    if not path.exists():
+        data_dir.mkdir(parents=True, exist_ok=True)
+        partial = path.with_suffix(".partial")
+        for leftover in data_dir.glob(f"{partial.name}*"):
+            leftover.unlink()
+        started = time.monotonic()
+        _generate(partial, months, processes)
+        partial.rename(path)
+        logging.info(f"Generated {path} in {time.monotonic() - started:.0f} s")
+    return path
+
+
+def copy_database(source: Path, target_dir: Path) -> Path:
+    """Working copy for the benchmarks that write, so the cached database stays the same between runs."""
+    target = target_dir / source.name
+    shutil.copyfile(source, target)
+    return target
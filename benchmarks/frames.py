@@ -0,0 +1,130 @@
+import random
+import socket
+import struct
+from dataclasses import dataclass
+from pathlib import Path
+
+from soursop.beans import ProcessInfo
+
+_PCAP_MAGIC = {b"\xd4\xc3\xb2\xa1": "<", b"\xa1\xb2\xc3\xd4": ">",
+               b"\x4d\x3c\xb2\xa1": "<", b"\xa1\xb2\x3c\x4d": ">"}  # microsecond and nanosecond variants
+# link type -> bytes in front of the IP header
+_LINK_HEADER_LENGTHS = {1: 14, 101: 0, 113: 16, 276: 20}
+_ETHERNET_VLAN = 0x8100
+
+
+@dataclass
+class Traffic:
+    """Frames starting at the IP header, like SOCK_DGRAM reads, with the addresses and owners of their flows."""
+    frames: list[bytes]
+    local_ips: frozenset[str]
+    connection_pids: dict[tuple[int, str, int, str, int], int]
+    processes: dict[int, ProcessInfo]
+
+
+def _ipv4_packet(protocol: int, src_ip: str, dst_ip: str, src_port: int, dst_port: int, payload: int) -> bytes:
+    l4_length = (20 if protocol == socket.IPPROTO_TCP else 8) + payload
+    header = struct.pack("!BBHHHBBH4s4s", 0x45, 0, 20 + l4_length, 0, 0x4000, 64, protocol, 0,
+                         socket.inet_aton(src_ip), socket.inet_aton(dst_ip))
+    return header + struct.pack("!HH", src_port, dst_port) + bytes(l4_length - 4)
+
+
+def _ipv6_packet(protocol: int, src_ip: str, dst_ip: str, src_port: int, dst_port: int, payload: int) -> bytes:
+    l4_length = (20 if protocol == socket.IPPROTO_TCP else 8) + payload
+    header = struct.pack("!IHBB16s16s", 6 << 28, l4_length, protocol, 64,
+                         socket.inet_pton(socket.AF_INET6, src_ip), socket.inet_pton(socket.AF_INET6, dst_ip))
+    return header + struct.pack("!HH", src_port, dst_port) + bytes(l4_length - 4)
+
+
+def generate_traffic(packets: int, flows: int = 512, processes: int = 64, seed: int = 1) -> Traffic:
+    """
+    Synthetic mix of IPv4/IPv6 TCP/UDP flows, owned by a set of processes. Packet sizes follow a bulk transfer
+    pattern: mostly full sized data packets, some small acknowledgements. A tenth of the packets belongs to
+    other hosts and is ignored by the tracker.
+    """
+    rng = random.Random(seed)
+    local_ipv4, local_ipv6 = "192.0.2.10", "2001:db8::10"
+    infos = {pid: ProcessInfo(pid=pid, name=f"process-{pid % 16}", path=f"/usr/bin/process-{pid % 16}",
+                              timestamp=0.0, start_time=pid)
+             for pid in range(1000, 1000 + processes)}
+    pids = list(infos)
+
+    flow_list = []
+    connection_pids = {}
+    for index in range(flows):
+        protocol = socket.IPPROTO_TCP if rng.random() < 0.8 else socket.IPPROTO_UDP
+        ipv6 = rng.random() < 0.3
+        local_ip = local_ipv6 if ipv6 else local_ipv4
+        remote_ip = f"2001:db8:1::{index + 1:x}" if ipv6 else f"198.51.100.{index % 250 + 1}"
+        local_port, remote_port = 32768 + index, rng.choice((443, 80, 53, 8080))
+        connection_pids[(protocol, local_ip, local_port, remote_ip, remote_port)] = rng.choice(pids)
+        flow_list.append((protocol, ipv6, local_ip, local_port, remote_ip, remote_port))
+
+    frames = []
+    for _ in range(packets):
+        protocol, ipv6, local_ip, local_port, remote_ip, remote_port = rng.choice(flow_list)
+        build = _ipv6_packet if ipv6 else _ipv4_packet
+        payload = 1400 if rng.random() < 0.7 else rng.randint(0, 200)
+        if rng.random() < 0.1:  # traffic of another host on the same segment
+            frames.append(build(protocol, remote_ip, "2001:db8::99" if ipv6 else "192.0.2.99",
+                                remote_port, local_port, payload))
+        elif rng.random() < 0.6:
+            frames.append(build(protocol, remote_ip, local_ip, remote_port, local_port, payload))
+        else:
+            frames.append(build(protocol, local_ip, remote_ip, local_port, remote_port, payload))
+    return Traffic(frames, frozenset((local_ipv4, local_ipv6)), connection_pids, infos)
+
+
+def _strip_link_header(data: bytes, link_type: int) -> bytes | None:
+    offset = _LINK_HEADER_LENGTHS.get(link_type)
+    if offset is None:
+        return None
+    if link_type == 1 and len(data) >= 18 and struct.unpack_from("!H", data, 12)[0] == _ETHERNET_VLAN:
+        offset += 4
+    return data[offset:]
+
+
+def read_pcap(path: Path) -> list[bytes]:
+    """IP packets of a classic pcap capture (Ethernet, raw IP or Linux cooked), for replaying recorded traffic."""
+    data = path.read_bytes()
+    order = _PCAP_MAGIC.get(data[:4])
+    if order is None:
+        raise ValueError(f"{path} is not a pcap file (pcapng is not supported)")
+    link_type = struct.unpack_from(f"{order}I", data, 20)[0]
+    record = struct.Struct(f"{order}IIII")
+    frames = []
+    offset = 24
+    while offset + record.size <= len(data):
+        _, _, captured, _ = record.unpack_from(data, offset)
+        offset += record.size
+        frame = _strip_link_header(data[offset:offset + captured], link_type)
+        if frame:
+            frames.append(frame)
+        offset += captured
+    return frames
+
+
+def traffic_from_pcap(path: Path, local_ips: frozenset[str]) -> Traffic:
+    """
+    Recorded frames with made up owners: every connection of the local addresses is given to one of a few
+    processes, so the whole attribution path runs.
+    """
+    from soursop.daemon.packet_parser import parse_ip_packet
+
+    frames = read_pcap(path)
+    infos = {pid: ProcessInfo(pid=pid, name=f"process-{pid}", path=f"/usr/bin/process-{pid}",
+                              timestamp=0.0, start_time=pid) for pid in range(1000, 1016)}
+    connection_pids = {}
+    for frame in frames:
+        parsed = parse_ip_packet(memoryview(frame), 0, len(frame), len(frame))
+        if not parsed:
+            continue
+        protocol, src_port, dst_port, src_ip, dst_ip, _ = parsed
+        if src_ip in local_ips:
+            connection = (protocol, src_ip, src_port, dst_ip, dst_port)
+        elif dst_ip in local_ips:
+            connection = (protocol, dst_ip, dst_port, src_ip, src_port)
+        else:
+            continue
+        connection_pids.setdefault(connection, 1000 + len(connection_pids) % len(infos))
+    return Traffic(frames, local_ips, connection_pids, infos)
@@ -0,0 +1,127 @@
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import sqlite3
+import sys
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from benchmarks import suites
+
+DEFAULT_BASELINE = Path(__file__).parent / "baseline.json"
+DEFAULT_DATA_DIR = Path(tempfile.gettempdir()) / "soursop-benchmarks"
+
+
+def describe_machine() -> dict[str, str]:
+    """What the results depend on besides the code, stored with a baseline."""
+    cpu = platform.processor()
+    try:
+        with open("/proc/cpuinfo") as cpuinfo:
+            cpu = next((line.split(":", 1)[1].strip() for line in cpuinfo if line.startswith("model name")), cpu)
+    except OSError:
+        pass
+    return {"cpu": cpu, "cpus": str(os.cpu_count()), "system": platform.platform(),
+            "python": platform.python_version(), "sqlite": sqlite3.sqlite_version}
+
+
+def run_isolated(function, *args) -> dict[str, float]:
+    """Run one suite in a fresh interpreter, so the stubs and the peak RSS belong to that suite alone."""
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as executor:
+        return executor.submit(function, *args).result()
+
+
+def run_suites(args) -> dict[str, float]:
+    results = {}
+    if "capture" in args.suites:
+        logging.info(f"capture: {args.packets} packets, {args.rounds} rounds")
+        results.update(run_isolated(suites.run_capture, args.packets, args.rounds, args.pcap))
+    for months in args.months:
+        if "flush" in args.suites:
+            logging.info(f"flush: {months} months of rows, {args.ticks} ticks")
+            results.update(run_isolated(suites.run_flush, months, args.processes, str(args.data_dir),
+                                        args.ticks, args.packets_per_tick))
+        if "query" in args.suites:
+            logging.info(f"query: {months} months of rows, {args.rounds} rounds")
+            results.update(run_isolated(suites.run_query, months, args.processes, str(args.data_dir), args.rounds))
+    return results
+
+
+def is_regression(name: str, value: float, baseline: float, threshold: float) -> bool:
+    """Rates have to stay above the baseline, times and memory below it, both within the threshold."""
+    if name.endswith("_per_s"):
+        return value < baseline * (1 - threshold)
+    return value > baseline * (1 + threshold)
+
+
+def print_report(results: dict[str, float], baseline: dict[str, float], threshold: float) -> int:
+    """Print every metric next to its baseline, returns the number of regressions."""
+    regressions = 0
+    print(f"{'METRIC':<45} {'VALUE':>12} {'BASELINE':>12} {'CHANGE':>8}")
+    for name, value in results.items():
+        previous = baseline.get(name)
+        if not previous:
+            print(f"{name:<45} {value:>12.2f} {'-':>12} {'':>8}")
+            continue
+        flag = ""
+        if is_regression(name, value, previous, threshold):
+            flag = "  REGRESSION"
+            regressions += 1
+        print(f"{name:<45} {value:>12.2f} {previous:>12.2f} {(value / previous - 1) * 100:>+7.1f}%{flag}")
+    return regressions
+
+
+def init_arg_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.run",
+                                     description="Benchmarks of the capture, flush and query paths")
+    parser.add_argument("--suite", dest="suites", nargs="+", choices=("capture", "flush", "query"),
+                        default=["capture", "flush", "query"], help="Suites to run")
+    parser.add_argument("--months", nargs="+", type=int, default=[1, 12, 60],
+                        help="Sizes of the generated databases in months of hourly rows")
+    parser.add_argument("--processes", type=int, default=20, help="Processes with usage in every generated hour")
+    parser.add_argument("--packets", type=int, default=200000, help="Synthetic packets per capture round")
+    parser.add_argument("--pcap", help="Replay the IP packets of a pcap file instead of synthetic ones, "
+                                       "the local addresses are taken from SOURSOP_BENCH_LOCAL_IPS")
+    parser.add_argument("--rounds", type=int, default=3, help="Repetitions of the capture rounds and queries")
+    parser.add_argument("--ticks", type=int, default=200, help="Writer ticks per flush benchmark")
+    parser.add_argument("--packets-per-tick", dest="packets_per_tick", type=int, default=5000,
+                        help="Packets accounted between two writer ticks")
+    parser.add_argument("--data-dir", dest="data_dir", type=Path, default=DEFAULT_DATA_DIR,
+                        help="Where the generated databases are cached")
+    parser.add_argument("--baseline", type=Path, default=DEFAULT_BASELINE, help="Stored results to compare with")
+    parser.add_argument("--save-baseline", dest="save_baseline", action="store_true",
+                        help="Store the results as the new baseline")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="Relative change against the baseline reported as a regression")
+    return parser
+
+
+def main() -> int:
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+    args = init_arg_parser().parse_args()
+    results = run_suites(args)
+
+    stored = {"machine": {}, "results": {}}
+    if args.baseline.exists():
+        stored = json.loads(args.baseline.read_text())
+    machine = describe_machine()
+    if stored["results"] and stored["machine"] != machine:
+        logging.warning(f"The baseline was recorded on another machine ({stored['machine']}), "
+                        f"differences beyond the threshold may not be regressions of the code")
+    regressions = print_report(results, stored["results"], args.threshold)
+
+    if args.save_baseline:
+        # results of suites that did not run are kept, but only when they come from the same machine
+        previous = stored["results"] if stored["machine"] == machine else {}
+        baseline = {"machine": machine, "results": {**previous, **results}}
+        args.baseline.write_text(json.dumps(baseline, indent=2, sort_keys=True) + "\n")
+        logging.info(f"Saved the results to {args.baseline}")
+        return 0
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
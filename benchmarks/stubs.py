@@ -0,0 +1,26 @@
+import sys
+import types
+
+from soursop.beans import ProcessInfo
+
+
+def install(local_ips: frozenset[str], connection_pids: dict[tuple[int, str, int, str, int], int],
+            processes: dict[int, ProcessInfo]) -> None:
+    """
+    Replace utility_monitor and process_cache before process_tracker is imported, so the capture path runs
+    without root, psutil or a network: the addresses, the connection table and the process metadata come from
+    the generated traffic instead of /proc and netlink.
+    """
+    if "soursop.daemon.process_tracker" in sys.modules:
+        raise RuntimeError("The stubs must be installed before soursop.daemon.process_tracker is imported")
+
+    utility_monitor = types.ModuleType("soursop.daemon.utility_monitor")
+    utility_monitor.get_wifi_ips = lambda: local_ips
+    utility_monitor.get_connection_pid = connection_pids.get
+    utility_monitor.resolve_connection = lambda *connection: connection_pids.get(connection)
+    sys.modules["soursop.daemon.utility_monitor"] = utility_monitor
+
+    process_cache = types.ModuleType("soursop.daemon.process_cache")
+    process_cache.get_process_info = processes.get
+    process_cache.get_stats = dict
+    sys.modules["soursop.daemon.process_cache"] = process_cache
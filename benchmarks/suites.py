@@ -0,0 +1,131 @@
+import contextlib
+import os
+import random
+import resource
+import statistics
+import tempfile
+import time
+from argparse import Namespace
+from datetime import date, datetime, timedelta
+from pathlib import Path
+
+from benchmarks import dataset, frames, stubs
+from soursop.beans import Level
+
+
+def _percentile(samples: list[float], percent: int) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, round(percent / 100 * (len(ordered) - 1)))]
+
+
+def _peak_rss_mb() -> float:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # KiB on Linux
+
+
+def _load_traffic(packets: int, pcap: str | None) -> frames.Traffic:
+    if pcap:
+        return frames.traffic_from_pcap(Path(pcap), frozenset(os.environ.get("SOURSOP_BENCH_LOCAL_IPS", "").split()))
+    return frames.generate_traffic(packets)
+
+
+def run_capture(packets: int, rounds: int, pcap: str | None = None) -> dict[str, float]:
+    """Packets per second through the parser and the attribution of process_tracker, best of the rounds."""
+    traffic = _load_traffic(packets, pcap)
+    stubs.install(traffic.local_ips, traffic.connection_pids, traffic.processes)
+    from soursop.daemon import process_tracker
+    from soursop.daemon.packet_parser import parse_ip_packet
+
+    views = [(memoryview(frame), len(frame)) for frame in traffic.frames]
+    account_packet = process_tracker.account_packet
+    best = 0.0
+    for _ in range(rounds):
+        started = time.perf_counter()
+        for view, length in views:
+            connection = parse_ip_packet(view, 0, length, length)
+            if connection:
+                account_packet(*connection)
+        best = max(best, len(views) / (time.perf_counter() - started))
+        process_tracker.drain_and_handle_entries()  # keep the accumulator at one tick worth of entries
+    return {"capture.packets_per_s": best, "capture.peak_rss_mb": _peak_rss_mb()}
+
+
+def run_flush(months: int, processes: int, data_dir: str, ticks: int, packets_per_tick: int) -> dict[str, float]:
+    """
+    Latency of the writer ticks against a copy of a generated database: handle_entries hands the drained
+    accumulator to the writer, flush runs the network and process upserts in one transaction.
+    """
+    source = dataset.get_database(Path(data_dir), months, processes)
+    traffic = frames.generate_traffic(packets_per_tick * 4)
+    stubs.install(traffic.local_ips, traffic.connection_pids, traffic.processes)
+    from soursop.daemon import process_tracker
+    from soursop.daemon.packet_parser import parse_ip_packet
+    import soursop.db.writer as writer
+
+    connections = [c for c in (parse_ip_packet(memoryview(f), 0, len(f), len(f)) for f in traffic.frames) if c]
+    now = datetime.now().replace(minute=0, second=0, microsecond=0)
+    rng = random.Random(0)
+    handle_times, flush_times = [], []
+    with tempfile.TemporaryDirectory() as work_dir:
+        dataset.use_database(dataset.copy_database(source, Path(work_dir)))
+        try:
+            for tick in range(ticks):
+                start = tick * packets_per_tick % len(connections)
+                for connection in connections[start:start + packets_per_tick]:
+                    process_tracker.account_packet(*connection)
+                writer.submit_network_usages(dataset.hour_entries(rng, now, processes=0)[0])
+
+                started = time.perf_counter()
+                process_tracker.drain_and_handle_entries()
+                handled = time.perf_counter()
+                writer.flush()
+                flushed = time.perf_counter()
+                handle_times.append((handled - started) * 1000)
+                flush_times.append((flushed - handled) * 1000)
+        finally:
+            writer.close()
+
+    prefix = f"flush.{months}m"
+    results = {}
+    for name, samples in (("handle_entries", handle_times), ("upsert", flush_times)):
+        for percent in (50, 95, 99):
+            results[f"{prefix}.{name}.p{percent}_ms"] = _percentile(samples, percent)
+    results[f"{prefix}.peak_rss_mb"] = _peak_rss_mb()
+    return results
+
+
+def _query_args(level: Level, from_date: date, to_date: date) -> Namespace:
+    return Namespace(level=level, from_date=from_date, to_date=to_date, day=None, week=None, month=None,
+                     name=None, network=None, columnar=False)
+
+
+def run_query(months: int, processes: int, data_dir: str, rounds: int) -> dict[str, float]:
+    """Median time of the network and process CLI handlers over the whole database, at every level."""
+    from soursop.cli.network_controller import handle_network_request
+    from soursop.cli.process_controller import handle_process_request
+    from soursop import config
+
+    config.QUERY_SOCKET_PATH = ""  # time the database reads, not a daemon that may run on this machine
+    dataset.use_database(dataset.get_database(Path(data_dir), months, processes))
+    to_date = date.today()
+    from_date = to_date - timedelta(hours=months * dataset.HOURS_PER_MONTH)
+    handlers = [("network", handle_network_request, False), ("process", handle_process_request, False)]
+    try:
+        import pandas  # noqa: F401 the columnar handler is only timed where it can run
+        handlers.append(("process_columnar", handle_process_request, True))
+    except ImportError:
+        pass
+
+    results = {}
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        for name, handler, columnar in handlers:
+            for level in Level:
+                args = _query_args(level, from_date, to_date)
+                args.columnar = columnar
+                samples = []
+                for _ in range(rounds):
+                    started = time.perf_counter()
+                    handler(args)
+                    samples.append((time.perf_counter() - started) * 1000)
+                results[f"query.{months}m.{name}.{level.value}_ms"] = statistics.median(samples)
+    results[f"query.{months}m.peak_rss_mb"] = _peak_rss_mb()
+    return results
@@ -15,6 +15,10 @@ class ProcessUsage:
     incoming_bytes: Optional[int] = 0
     outgoing_bytes: Optional[int] = 0
     packet_count: Optional[int] = 0
+    bucket: Optional[int] = 0
+    # highest 1-in-N sample rate the counters were scaled by, and the variance of the scaled byte estimate
+    sample_rate: Optional[int] = 1
+    byte_variance: Optional[float] = 0.0
 
 
 @dataclass
@@ -23,6 +27,7 @@ class ProcessInfo:
     name: str
     path: str
     timestamp: float
+    start_time: Optional[int] = 0
 
 
 @dataclass
@@ -33,6 +38,7 @@ class NetworkUsage:
     hour: Optional[int] = 0
     incoming_bytes: Optional[int] = 0
     outgoing_bytes: Optional[int] = 0
+    bucket: Optional[int] = 0
 
 
 @dataclass
@@ -43,6 +49,8 @@ class NetworkInterface:
     saved_outgoing: Optional[int] = 0
     baseline_incoming: Optional[int] = 0
     baseline_outgoing: Optional[int] = 0
+    written_incoming: Optional[int] = 0
+    written_outgoing: Optional[int] = 0
 
 
 class Level(Enum):
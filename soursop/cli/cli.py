@@ -2,6 +2,8 @@ import argparse
 
 from soursop.cli.network_controller import register_network_controller
 from soursop.cli.process_controller import register_process_controller
+from soursop.cli.stats_controller import register_stats_controller
+from soursop.cli.vacuum_controller import register_vacuum_controller
 
 
 def init_arg_parser():
@@ -10,6 +12,8 @@ def init_arg_parser():
 
     register_network_controller(subparsers)
     register_process_controller(subparsers)
+    register_stats_controller(subparsers)
+    register_vacuum_controller(subparsers)
 
     args = parser.parse_args()
     args.func(args)
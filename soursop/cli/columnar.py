@@ -0,0 +1,59 @@
+import sys
+
+import numpy as np
+import pandas as pd
+
+from soursop import util
+from soursop.beans import Level
+
+_UNITS = np.array([" B", " KB", " MB", " GB"])
+_PERIOD_FORMATS = {Level.HOUR: "%d %b %Y %H:00", Level.DAY: util.CONSOLE_DATE_FORMAT, Level.MONTH: "%B %Y"}
+
+
+def format_bytes(values: pd.Series) -> pd.Series:
+    """Vectorized convert_bytes_to_human_readable."""
+    counts = values.to_numpy(dtype=np.int64)
+    unit = np.select([counts < 1024, counts < 1024 ** 2, counts < 1024 ** 3], [0, 1, 2], 3)
+    scaled = np.char.mod("%.2f", counts / np.power(1024.0, unit))
+    text = np.where(unit == 0, counts.astype(str), scaled)
+    return pd.Series(np.char.add(text, _UNITS[unit]), index=values.index)
+
+
+def format_periods(periods: pd.Series, level: Level) -> pd.Series:
+    """Labels of util.derive_time_range, every distinct period is formatted only once."""
+    codes, uniques = pd.factorize(periods)
+    uniques = pd.Series(uniques)
+    if level == Level.WEEK:
+        iso = uniques.dt.isocalendar()
+        labels = "Week " + iso["week"].astype(str).str.zfill(2) + " " + iso["year"].astype(str)
+    else:
+        labels = uniques.dt.strftime(_PERIOD_FORMATS[level])
+    return pd.Series(labels.to_numpy()[codes], index=periods.index)
+
+
+def format_error_bounds(frame: pd.DataFrame) -> pd.Series:
+    """Vectorized util.format_error_bound."""
+    total = (frame["incoming_bytes"] + frame["outgoing_bytes"]).to_numpy(dtype=np.float64)
+    variance = frame["byte_variance"].to_numpy(dtype=np.float64)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        percent = np.minimum(99, np.rint(util.ERROR_BOUND_Z * np.sqrt(variance) / total * 100))
+    text = np.char.add(np.char.add("±", np.nan_to_num(percent).astype(np.int64).astype(str)), "%")
+    return pd.Series(np.where((variance > 0) & (total > 0), text, ""), index=frame.index)
+
+
+def print_process_frame(frame: pd.DataFrame, level: Level):
+    """Columnar print_grouped_result of the process controller, every column is formatted at once."""
+    if frame.empty:
+        print("No data available.")
+        return
+
+    sampled = bool((frame["byte_variance"] > 0).any())
+    error_header = "±95%" if sampled else ""
+    print(f"{util.BOLD_START}{'PERIOD':<20} {'SEND':>15} {'RECEIVED':>15} {error_header:>5} NAME (ADDRESS) "
+          f"{util.BOLD_END}")
+    errors = format_error_bounds(frame).str.rjust(5) if sampled else " " * 5
+    lines = (format_periods(frame["period"], level).str.ljust(20) + " "
+             + format_bytes(frame["outgoing_bytes"]).str.rjust(15) + " "
+             + format_bytes(frame["incoming_bytes"]).str.rjust(15) + " " + errors + " "
+             + frame["name"].astype(str) + " (" + frame["path"].astype(str) + ")")
+    sys.stdout.write("\n".join(lines) + "\n")
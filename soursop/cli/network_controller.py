@@ -2,39 +2,22 @@ from datetime import date
 from typing import Optional
 
 import soursop.db.network_repository as repository
-from soursop import util
+from soursop import query_api, util
+from soursop.cli import query_client
 from soursop.beans import Level, NetworkUsage
 
 
-def cumulate_by_time_level(entries: list[NetworkUsage], level: Level) -> list[NetworkUsage]:
-    groups: dict[tuple[str, str], NetworkUsage] = {}
-    for entry in entries:
-        time_range_str = util.derive_time_range(entry.date_str, entry.hour, level)
-        key = (entry.network, time_range_str)
-        if key in groups:
-            group = groups[key]
-            group.incoming_bytes = int((group.incoming_bytes or 0) + (entry.incoming_bytes or 0))
-            group.outgoing_bytes = int((group.outgoing_bytes or 0) + (entry.outgoing_bytes or 0))
-        else:
-            groups[key] = NetworkUsage(
-                date_str=time_range_str,
-                network=entry.network,
-                incoming_bytes=int(entry.incoming_bytes or 0),
-                outgoing_bytes=int(entry.outgoing_bytes or 0),
-            )
-    return list(groups.values())
-
-
-def print_grouped_result(entries: list[NetworkUsage]):
-    sorted_list = sorted(entries, key=lambda x: x.date_str)  # sorting does not work, check this
-    if not sorted_list:
+def print_grouped_result(entries: list[NetworkUsage], level: Level):
+    """Print the aggregated rows, they already come in chronological order."""
+    if not entries:
         print("No data available.")
     else:
         print(f"{util.BOLD_START}{'PERIOD':<20} {'SEND':>15} {'RECEIVED':>15} {'NETWORK':>15} {util.BOLD_END}")
-        for entry in sorted_list:
+        for entry in entries:
+            period = util.derive_time_range(entry.date_str, entry.hour, level)
             sent = util.convert_bytes_to_human_readable(entry.outgoing_bytes)
             received = util.convert_bytes_to_human_readable(entry.incoming_bytes)
-            print(f"{entry.date_str:<20} {sent:>15} {received:>15} {entry.network:>15}")
+            print(f"{period:<20} {sent:>15} {received:>15} {entry.network:>15}")
 
 
 def handle_network_request(args):
@@ -42,10 +25,17 @@ def handle_network_request(args):
     from_date, to_date = util.derive_date_period(args)
     network = args.network if args.network else None
     log_command(level, from_date, to_date, network)
-
-    entries = repository.search(from_date, to_date, network)
-    grouped = cumulate_by_time_level(entries, level or Level.HOUR)
-    print_grouped_result(grouped)
+    report_start = repository.get_report_start(level, from_date, to_date)
+    if report_start is not None:
+        print(f"Day totals before [{report_start}] were deleted by the daily retention, partial months of the range "
+              f"only count the usage from then on. Whole months keep their full totals.\n")
+
+    rows = query_client.query("network", level, from_date, to_date, network)
+    if rows is not None:
+        entries = [query_api.network_entry(row) for row in rows]
+    else:
+        entries = repository.aggregate(level, from_date, to_date, network)
+    print_grouped_result(entries, level)
 
 
 def log_command(level: Level, from_date: date, to_date: date, network: Optional[str]):
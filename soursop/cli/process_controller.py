@@ -2,41 +2,29 @@ from datetime import date
 from typing import Optional
 
 import soursop.db.process_repository as repository
-from soursop import util
+from soursop import query_api, util
+from soursop.cli import query_client
 from soursop.beans import ProcessUsage, Level
 
 
-def cumulate_by_time_level(entries: list[ProcessUsage], level: Level) -> list[ProcessUsage]:
-    groups: dict[tuple[str, str, str], ProcessUsage] = {}
-    for entry in entries:
-        time_range_str = util.derive_time_range(entry.date_str, entry.hour, level)
-        key = (entry.name, entry.path, time_range_str)
-        if key in groups:
-            group = groups[key]
-            group.incoming_bytes = int((group.incoming_bytes or 0) + (entry.incoming_bytes or 0))
-            group.outgoing_bytes = int((group.outgoing_bytes or 0) + (entry.outgoing_bytes or 0))
-        else:
-            groups[key] = ProcessUsage(
-                hour=0, pid=0,
-                name=entry.name,
-                path=entry.path or "",
-                date_str=time_range_str,
-                incoming_bytes=int(entry.incoming_bytes or 0),
-                outgoing_bytes=int(entry.outgoing_bytes or 0),
-            )
-    return list(groups.values())
-
-
-def print_grouped_result(entries: list[ProcessUsage]):
-    sorted_list = sorted(entries, key=lambda x: (x.date_str, x.name, x.path))  # sorting does not work, check this
-    if not sorted_list:
+def print_grouped_result(entries: list[ProcessUsage], level: Level):
+    """
+    Print the aggregated rows, they already come in chronological order. Totals estimated from sampled packets
+    show their 95% error bound next to the byte counts.
+    """
+    if not entries:
         print("No data available.")
     else:
-        print(f"{util.BOLD_START}{'PERIOD':<20} {'SEND':>15} {'RECEIVED':>15} {'':>5} NAME (ADDRESS) {util.BOLD_END}")
-        for entry in sorted_list:
+        sampled = any(entry.byte_variance for entry in entries)
+        error_header = "±95%" if sampled else ""
+        print(f"{util.BOLD_START}{'PERIOD':<20} {'SEND':>15} {'RECEIVED':>15} {error_header:>5} NAME (ADDRESS) "
+              f"{util.BOLD_END}")
+        for entry in entries:
+            period = util.derive_time_range(entry.date_str, entry.hour, level)
             sent = util.convert_bytes_to_human_readable(entry.outgoing_bytes)
             received = util.convert_bytes_to_human_readable(entry.incoming_bytes)
-            print(f"{entry.date_str:<20} {sent:>15} {received:>15} {'':>5} {entry.name} ({entry.path})")
+            error = util.format_error_bound(entry.incoming_bytes, entry.outgoing_bytes, entry.byte_variance)
+            print(f"{period:<20} {sent:>15} {received:>15} {error:>5} {entry.name} ({entry.path})")
 
 
 def log_command(level: Level, from_date: date, to_date: date, name: Optional[str]):
@@ -52,10 +40,26 @@ def handle_process_request(args):
     from_date, to_date = util.derive_date_period(args)
     name = args.name if args.name else None
     log_command(level, from_date, to_date, name)
+    report_start = repository.get_report_start(level, from_date, to_date)
+    if report_start is not None:
+        print(f"Day totals before [{report_start}] were deleted by the daily retention, partial months of the range "
+              f"only count the usage from then on. Whole months keep their full totals.\n")
+
+    if args.columnar:
+        try:
+            from soursop.cli.columnar import print_process_frame
+        except ImportError:
+            print("The columnar mode needs numpy and pandas, falling back to the default mode.\n")
+        else:
+            print_process_frame(repository.aggregate_frame(level, from_date, to_date, name), level)
+            return
 
-    entries = repository.search(from_date, to_date, name)
-    grouped = cumulate_by_time_level(entries, level or Level.HOUR)
-    print_grouped_result(grouped)
+    rows = query_client.query("process", level, from_date, to_date, name)
+    if rows is not None:
+        entries = [query_api.process_entry(row) for row in rows]
+    else:
+        entries = repository.aggregate(level, from_date, to_date, name)
+    print_grouped_result(entries, level)
 
 
 def register_process_controller(subparsers):
@@ -65,6 +69,8 @@ def register_process_controller(subparsers):
                                 required=False, help="Aggregation level: hour/h, day/d, week/w or month/m")
 
     process_parser.add_argument("-n", "--name", dest="name", type=str, required=False, help="Process name")
+    process_parser.add_argument("-c", "--columnar", dest="columnar", action="store_true",
+                                help="Aggregate with numpy/pandas, faster for large result sets")
 
     process_parser.add_argument("-f", "--from", dest="from_date", type=util.parse_date,
                                 required=False, help="Start date YYYY-MM-DD")
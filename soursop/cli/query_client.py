@@ -0,0 +1,31 @@
+import json
+import socket
+from datetime import date
+from typing import Optional
+
+from soursop import config, query_api
+from soursop.beans import Level
+
+_TIMEOUT = 60  # seconds, a query over years of hourly rows takes a while
+
+
+def query(command: str, level: Level, from_date: date, to_date: date,
+          filter_value: Optional[str]) -> Optional[list[list]]:
+    """
+    Rows of a network or process query answered by the daemon, including the usage it has not written yet.
+    None when the daemon does not answer, the caller then reads the database itself.
+    """
+    if not config.QUERY_SOCKET_PATH:
+        return None
+    chunks = []
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(_TIMEOUT)
+            sock.connect(config.QUERY_SOCKET_PATH)
+            sock.sendall(query_api.encode_request(command, level, from_date, to_date, filter_value))
+            while chunk := sock.recv(1 << 16):
+                chunks.append(chunk)
+        response = json.loads(b"".join(chunks))
+    except (OSError, ValueError):
+        return None
+    return response.get("rows")
@@ -0,0 +1,81 @@
+import time
+from datetime import datetime
+from pathlib import Path
+
+from soursop import config, metrics, util
+
+_QUANTILES = (0.5, 0.95, 0.99)
+
+
+def format_value(name: str, value: float) -> str:
+    if name.endswith("_bytes") or name.endswith("_bytes_total"):
+        return util.convert_bytes_to_human_readable(value)
+    if name.endswith("_seconds") and not name.endswith("time_seconds"):
+        return f"{value:.3f} s"
+    if isinstance(value, float) and not value.is_integer():
+        return f"{value:.2f}"
+    return f"{int(value):,}"
+
+
+def format_histogram(histogram: dict) -> str:
+    count = sum(histogram["counts"])
+    if not count:
+        return "no samples"
+    quantiles = "  ".join(f"p{round(q * 100)} {metrics.quantile(histogram, q) * 1000:.2f} ms" for q in _QUANTILES)
+    return f"{count:,} samples  mean {histogram['sum'] / count * 1000:.2f} ms  {quantiles}"
+
+
+def hit_ratios(values: dict) -> dict[str, float]:
+    """Hit ratio of every cache that counts hits and misses."""
+    ratios = {}
+    for name, hits in values.items():
+        if name.endswith("_hits_total"):
+            prefix = name[:-len("_hits_total")]
+            lookups = hits + values.get(f"{prefix}_misses_total", 0)
+            if lookups:
+                ratios[f"{prefix}_hit_ratio"] = hits / lookups
+    return ratios
+
+
+def print_stats(stats: dict):
+    """Print the metrics grouped by stage, latency histograms as their sample count, mean and percentiles."""
+    values = stats["metrics"]
+    started = datetime.fromtimestamp(values["daemon_start_time_seconds"]).strftime("%Y-%m-%d %H:%M:%S")
+    print(f"Daemon stats written {time.time() - stats['time']:.0f} s ago, daemon started at {started}\n")
+
+    rows = dict(values, **hit_ratios(values))
+    stage = None
+    for name in sorted(rows):
+        if name == "daemon_start_time_seconds":
+            continue
+        name_stage, _, metric = name.partition("_")
+        if name_stage != stage:
+            stage = name_stage
+            print(f"{util.BOLD_START}{stage.upper()}{util.BOLD_END}")
+        value = rows[name]
+        if isinstance(value, dict):
+            print(f"  {metric:<36} {format_histogram(value)}")
+        elif name.endswith("_ratio"):
+            print(f"  {metric:<36} {value * 100:.1f}%")
+        else:
+            print(f"  {metric:<36} {format_value(name, value)}")
+
+
+def handle_stats_request(args):
+    path = Path(config.STATS_PATH) if config.STATS_PATH else None
+    stats = metrics.read_stats(path) if path else None
+    if stats is None:
+        print(f"No daemon stats available at {config.STATS_PATH or '(SOURSOP_STATS_PATH is empty)'}. "
+              f"Is the daemon running?")
+        return
+    if args.prometheus:
+        print(metrics.format_prometheus(stats), end="")
+    else:
+        print_stats(stats)
+
+
+def register_stats_controller(subparsers):
+    stats_parser = subparsers.add_parser("stats", help="Packet, cache and database writer metrics of the daemon")
+    stats_parser.add_argument("-p", "--prometheus", dest="prometheus", action="store_true",
+                              help="Print the metrics in the Prometheus text format")
+    stats_parser.set_defaults(func=handle_stats_request)
@@ -0,0 +1,23 @@
+import sqlite3
+
+from soursop.db import retention
+from soursop.db.connection import get_connection
+
+
+def handle_vacuum_request(args):
+    try:
+        with get_connection() as conn:
+            switched = retention.rebuild_for_incremental_vacuum(conn)
+    except sqlite3.Error as e:
+        print(f"Could not rebuild the database: {e}. Is the daemon stopped, and are you root?")
+        return
+    if switched:
+        print("Database rebuilt, retention now gives the space of deleted rows back to the file system.")
+    else:
+        print("Incremental vacuum is enabled already, nothing to do.")
+
+
+def register_vacuum_controller(subparsers):
+    vacuum_parser = subparsers.add_parser("vacuum", help="One-off rebuild of a database created by an older version, "
+                                                         "so retention can shrink the file")
+    vacuum_parser.set_defaults(func=handle_vacuum_request)
@@ -0,0 +1,60 @@
+import os
+
+
+def _env_str(name: str, default: str) -> str:
+    return os.environ.get(name, default).strip().lower()
+
+
+def _env_int(name: str, default: int) -> int:
+    value = os.environ.get(name)
+    try:
+        return int(value) if value else default
+    except ValueError:
+        return default
+
+
+# packet capture backend of the process tracker
+#   ring:   TPACKET_V3 memory mapped ring on an AF_PACKET socket, whole blocks of packets per wakeup
+#   socket: AF_PACKET socket with the raw header parser (default)
+#   scapy:  scapy sniff with full packet dissection (slow, but works wherever scapy works)
+CAPTURE_MODE = _env_str("SOURSOP_CAPTURE_MODE", "socket")
+
+# number of capture worker processes sharing a PACKET_FANOUT group, 0 or 1 captures on a single daemon thread
+CAPTURE_WORKERS = _env_int("SOURSOP_CAPTURE_WORKERS", 0)
+
+# packet sampling in front of the attribution, the counters of the kept packets are scaled by the rate
+#   off:   every packet is attributed (default)
+#   count: every N-th packet is attributed
+#   flow:  the packets of every N-th flow by hash are attributed, flows are kept or skipped as a whole
+SAMPLING_MODE = _env_str("SOURSOP_SAMPLING_MODE", "off")
+# starting and lowest N, raised up to MAX_SAMPLE_RATE while the attributed packets per second or the CPU use
+# (percent of one core) of the daemon are over their budget
+SAMPLE_RATE = max(1, _env_int("SOURSOP_SAMPLE_RATE", 1))
+MAX_SAMPLE_RATE = max(SAMPLE_RATE, _env_int("SOURSOP_MAX_SAMPLE_RATE", 1024))
+SAMPLING_PACKET_BUDGET = max(1, _env_int("SOURSOP_SAMPLING_PACKET_BUDGET", 20_000))
+SAMPLING_CPU_BUDGET = max(1, _env_int("SOURSOP_SAMPLING_CPU_BUDGET", 25))
+
+# memory mapped journal of the usage not written to the database yet, replayed on startup, empty disables it.
+# /run is a tmpfs, so the journal survives crashes and restarts of the daemon, but not a reboot
+JOURNAL_PATH = os.environ.get("SOURSOP_JOURNAL_PATH", "/run/soursop/usage.journal").strip()
+
+# daemon metrics (packet, cache and writer counters, latency histograms) rewritten every STATS_INTERVAL seconds
+# for `soursop stats`, empty disables them
+STATS_PATH = os.environ.get("SOURSOP_STATS_PATH", "/run/soursop/stats.json").strip()
+# Unix socket the CLI queries the daemon on, so its reports include the usage not written to the database yet,
+# empty disables it and the CLI reads the database directly
+QUERY_SOCKET_PATH = os.environ.get("SOURSOP_QUERY_SOCKET_PATH", "/run/soursop/query.sock").strip()
+
+# hourly usage rows older than this many days are deleted, their totals stay in the day, week and month rollups
+HOURLY_RETENTION_DAYS = _env_int("SOURSOP_HOURLY_RETENTION_DAYS", 90)
+# day and week rollups older than this many days are deleted as well, month rollups are always kept, 0 keeps all
+DAILY_RETENTION_DAYS = _env_int("SOURSOP_DAILY_RETENTION_DAYS", 0)
+
+# intervals of the periodic daemon jobs in seconds, an interval that divides an hour ticks on the hour
+FLUSH_INTERVAL = max(1, _env_int("SOURSOP_FLUSH_INTERVAL", 15))
+NETWORK_INTERVAL = max(1, _env_int("SOURSOP_NETWORK_INTERVAL", 15))
+CONNECTION_INTERVAL = max(1, _env_int("SOURSOP_CONNECTION_INTERVAL", 15))
+WIFI_INTERVAL = max(1, _env_int("SOURSOP_WIFI_INTERVAL", 60))
+RETENTION_INTERVAL = max(1, _env_int("SOURSOP_RETENTION_INTERVAL", 3600))
+SAMPLING_INTERVAL = max(1, _env_int("SOURSOP_SAMPLING_INTERVAL", 10))
+STATS_INTERVAL = max(1, _env_int("SOURSOP_STATS_INTERVAL", 15))
@@ -0,0 +1,211 @@
+import ctypes
+import ipaddress
+import logging
+import socket
+import struct
+from threading import Lock
+from typing import Callable, Iterable
+
+from soursop import util
+
+SO_ATTACH_FILTER = 26
+
+# classic BPF opcodes
+_BPF_LD_W_ABS = 0x20
+_BPF_LD_H_ABS = 0x28
+_BPF_LD_B_ABS = 0x30
+_BPF_RSH_K = 0x74
+_BPF_JA = 0x05
+_BPF_JEQ_K = 0x15
+_BPF_RET_K = 0x06
+_SKF_AD_IFINDEX = 0xFFFFF000 + 8  # SKF_AD_OFF + SKF_AD_IFINDEX, the interface the packet was seen on
+
+_ACCEPT_HEADERS = util.CAPTURE_SNAPLEN  # the kernel copies only the headers of an accepted packet
+_ACCEPT_WHOLE = 0x40000
+_DROP = 0
+# placeholders of a jump to the accept tail of a version, which keeps offloaded super-frames whole: their IP length
+# field is zero, so the parser needs the real length of the copy
+_ACCEPT_IPV4 = "accept_ipv4"
+_ACCEPT_IPV6 = "accept_ipv6"
+# offset of the IPv4 total length and IPv6 payload length fields
+_LENGTH_OFFSETS = {_ACCEPT_IPV4: 2, _ACCEPT_IPV6: 4}
+_MAX_ADDRESSES = 32  # keeps the conditional jumps of the program within their 8 bit offsets
+
+# code, jump if true, jump if false, constant
+_INSTRUCTION = struct.Struct("=HBBI")
+# sock_fprog: instruction count and a pointer to the instructions
+_FPROG = struct.Struct("HL")
+
+# capture sockets of this process, their filter is swapped whenever the monitored addresses change
+_LOCK = Lock()
+_ADDRESSES: frozenset[str] = frozenset()
+_PROGRAM: bytes = b""
+_SOCKETS: list[socket.socket] = []
+_LISTENERS: list[Callable[[frozenset[str]], None]] = []
+
+
+def _instruction(code: int, k: int = 0, jt: int = 0, jf: int = 0) -> bytes:
+    return _INSTRUCTION.pack(code, jt, jf, k)
+
+
+def _link(program: list[bytes | str]) -> bytes:
+    """Append the accept tails, and replace the placeholders by jumps to them."""
+    tails = {}
+    program = list(program)
+    for label, length_offset in _LENGTH_OFFSETS.items():
+        tails[label] = len(program)
+        program += [
+            _instruction(_BPF_LD_H_ABS, length_offset),
+            _instruction(_BPF_JEQ_K, 0, jf=1),
+            _instruction(_BPF_RET_K, _ACCEPT_WHOLE),
+            _instruction(_BPF_RET_K, _ACCEPT_HEADERS),
+        ]
+    return b"".join(_instruction(_BPF_JA, tails[item] - index - 1) if isinstance(item, str) else item
+                    for index, item in enumerate(program))
+
+
+def _match_ipv4(offset: int, addresses: list[bytes]) -> list[bytes | str]:
+    program = [_instruction(_BPF_LD_W_ABS, offset)]
+    for address in addresses:
+        program.append(_instruction(_BPF_JEQ_K, struct.unpack("!I", address)[0], jf=1))
+        program.append(_ACCEPT_IPV4)
+    return program
+
+
+def _match_ipv6(offset: int, addresses: list[bytes]) -> list[bytes | str]:
+    program = []
+    for address in addresses:
+        words = struct.unpack("!4I", address)
+        for index, word in enumerate(words):
+            # a mismatching word skips the rest of this address, up to and including its accept
+            program.append(_instruction(_BPF_LD_W_ABS, offset + index * 4))
+            program.append(_instruction(_BPF_JEQ_K, word, jf=(3 - index) * 2 + 1))
+        program.append(_ACCEPT_IPV6)
+    return program
+
+
+def compile_filter(addresses: Iterable[str], loopback_index: int | None = None) -> bytes:
+    """
+    Classic BPF program for an AF_PACKET SOCK_DGRAM socket, whose packets start at the IP header: accept the
+    IPv4 TCP/UDP packets and the IPv6 packets from or to one of the addresses, drop everything else, including
+    anything seen on the loopback interface. IPv6 packets are matched on addresses only, as extension headers
+    may come before the transport header. Accepted packets are cut after CAPTURE_SNAPLEN bytes.
+    """
+    ipv4, ipv6 = [], []
+    for address in sorted(addresses):
+        ip = ipaddress.ip_address(address)
+        if ip.is_loopback:
+            continue
+        (ipv4 if ip.version == 4 else ipv6).append(ip.packed)
+
+    if len(ipv4) + len(ipv6) > _MAX_ADDRESSES:
+        logging.warning("Too many monitored addresses for the capture filter, filtering on protocols only")
+        return compile_protocol_filter(loopback_index)
+
+    ipv4_block = [
+        _instruction(_BPF_LD_B_ABS, 9),
+        _instruction(_BPF_JEQ_K, socket.IPPROTO_TCP, jt=1),
+        _instruction(_BPF_JEQ_K, socket.IPPROTO_UDP, jf=len(ipv4) * 4 + 2),
+        *_match_ipv4(12, ipv4),
+        *_match_ipv4(16, ipv4),
+    ] if ipv4 else []
+    ipv6_block = [*_match_ipv6(8, ipv6), *_match_ipv6(24, ipv6)]
+
+    program = _dispatch_versions(loopback_index, len(ipv4_block) + 1)
+    program += ipv4_block + [_instruction(_BPF_RET_K, _DROP)] + ipv6_block + [_instruction(_BPF_RET_K, _DROP)]
+    return _link(program)
+
+
+def compile_protocol_filter(loopback_index: int | None = None) -> bytes:
+    """The same program without addresses: every TCP/UDP packet that is not on the loopback interface."""
+    ipv4_block = [
+        _instruction(_BPF_LD_B_ABS, 9),
+        _instruction(_BPF_JEQ_K, socket.IPPROTO_TCP, jt=1),
+        _instruction(_BPF_JEQ_K, socket.IPPROTO_UDP, jf=1),
+        _ACCEPT_IPV4,
+        _instruction(_BPF_RET_K, _DROP),
+    ]
+    program = _dispatch_versions(loopback_index, len(ipv4_block))
+    return _link(program + ipv4_block + [_ACCEPT_IPV6])
+
+
+def _dispatch_versions(loopback_index: int | None, ipv4_length: int) -> list[bytes]:
+    """Drop loopback packets, continue with the next instruction for IPv4 and skip ipv4_length for IPv6."""
+    program = []
+    if loopback_index is not None:
+        program += [
+            _instruction(_BPF_LD_W_ABS, _SKF_AD_IFINDEX),
+            _instruction(_BPF_JEQ_K, loopback_index, jf=1),
+            _instruction(_BPF_RET_K, _DROP),
+        ]
+    program += [
+        _instruction(_BPF_LD_B_ABS, 0),
+        _instruction(_BPF_RSH_K, 4),
+        _instruction(_BPF_JEQ_K, 6, jf=1),
+        _instruction(_BPF_JA, 2 + ipv4_length),  # unlike conditional jumps, ja is not limited to 255 instructions
+        _instruction(_BPF_JEQ_K, 4, jt=1),
+        _instruction(_BPF_RET_K, _DROP),
+    ]
+    return program
+
+
+def get_loopback_index() -> int | None:
+    try:
+        return socket.if_nametoindex("lo")
+    except OSError:
+        return None
+
+
+def attach_filter(sock: socket.socket, program: bytes) -> None:
+    """Install the program on the socket, the kernel replaces a previous filter in one step."""
+    instructions = ctypes.create_string_buffer(program, len(program))
+    sock.setsockopt(socket.SOL_SOCKET, SO_ATTACH_FILTER,
+                    _FPROG.pack(len(program) // _INSTRUCTION.size, ctypes.addressof(instructions)))
+
+
+def set_addresses(addresses: Iterable[str]) -> None:
+    """Recompile the filter for a new set of monitored addresses and swap it on every capture socket."""
+    global _ADDRESSES, _PROGRAM
+    addresses = frozenset(addresses)
+    with _LOCK:
+        if addresses == _ADDRESSES and _PROGRAM:
+            return
+        _ADDRESSES = addresses
+        _PROGRAM = compile_filter(addresses, get_loopback_index())
+        for sock in _SOCKETS:
+            attach_filter(sock, _PROGRAM)
+        listeners = list(_LISTENERS)
+    for listener in listeners:
+        listener(addresses)
+    logging.info(f"Capture filter updated for {len(addresses)} addresses")
+
+
+def get_addresses() -> frozenset[str]:
+    return _ADDRESSES
+
+
+def add_listener(listener: Callable[[frozenset[str]], None]) -> None:
+    """Called with the new addresses after every update, e.g. to forward them to the capture workers."""
+    with _LOCK:
+        _LISTENERS.append(listener)
+
+
+def remove_listener(listener: Callable[[frozenset[str]], None]) -> None:
+    with _LOCK:
+        _LISTENERS.remove(listener)
+
+
+def register_socket(sock: socket.socket) -> None:
+    """Filter a new capture socket with the current program, and keep it filtered until it is unregistered."""
+    global _PROGRAM
+    with _LOCK:
+        if not _PROGRAM:
+            _PROGRAM = compile_filter(_ADDRESSES, get_loopback_index())
+        attach_filter(sock, _PROGRAM)
+        _SOCKETS.append(sock)
+
+
+def unregister_socket(sock: socket.socket) -> None:
+    with _LOCK:
+        if sock in _SOCKETS:
+            _SOCKETS.remove(sock)
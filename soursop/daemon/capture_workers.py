@@ -0,0 +1,138 @@
+import logging
+import multiprocessing
+import os
+import queue
+import signal
+import time
+from threading import Lock, Thread
+from typing import Callable
+
+from soursop import util
+from soursop.daemon import capture_filter, packet_capture, packet_ring
+
+_MERGE_INTERVAL = 1  # seconds between two delta batches sent by a worker
+
+
+class FlowAccumulator:
+    """Private per-worker counters of (protocol, src_port, dst_port, src_ip, dst_ip) -> [bytes, packets]."""
+
+    def __init__(self) -> None:
+        self._flows: dict[tuple[int, int, int, str, str], list[int]] = {}
+        self._lock = Lock()
+
+    def add(self, protocol: int, src_port: int, dst_port: int, src_ip: str, dst_ip: str, length: int) -> None:
+        key = (protocol, src_port, dst_port, src_ip, dst_ip)
+        with self._lock:
+            counters = self._flows.get(key)
+            if counters is None:
+                self._flows[key] = [length, 1]
+            else:
+                counters[0] += length
+                counters[1] += 1
+
+    def drain(self) -> dict[tuple[int, int, int, str, str], list[int]]:
+        with self._lock:
+            flows = self._flows
+            self._flows = {}
+        return flows
+
+
+def send_deltas(accumulator: FlowAccumulator, output_queue, address_queue, stop_event) -> None:
+    while not stop_event.wait(_MERGE_INTERVAL):
+        flows = accumulator.drain()
+        if flows:
+            output_queue.put(flows)
+        try:
+            capture_filter.set_addresses(address_queue.get_nowait())
+        except queue.Empty:
+            pass
+    util.RUNNING_FLAG = False  # stops the capture loop of this worker
+
+
+def run_worker(worker_id: int, fanout_group: int, capture_mode: str, addresses: frozenset[str],
+               output_queue, address_queue, stop_event) -> None:
+    """Entry point of a worker process: capture one share of the fanout group and ship per-flow deltas."""
+    # the parent coordinates the shutdown through stop_event, so the final deltas are not lost
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    logging.basicConfig(level=logging.INFO, format=f"%(asctime)s [%(levelname)s] [worker {worker_id}] %(message)s")
+
+    capture_filter.set_addresses(addresses)
+    accumulator = FlowAccumulator()
+    sender = Thread(target=send_deltas, args=(accumulator, output_queue, address_queue, stop_event), daemon=True)
+    sender.start()
+    try:
+        if capture_mode == "ring":
+            packet_ring.capture_packets(accumulator.add, fanout_group)
+        else:
+            packet_capture.capture_packets(accumulator.add, fanout_group)
+    except Exception as e:
+        logging.error(f"Capture worker failed: {e}")
+    finally:
+        stop_event.set()  # a failing worker stops the whole group, the parent will restart it
+        sender.join()
+        output_queue.put(accumulator.drain())
+
+
+def merge_deltas(flows: dict[tuple[int, int, int, str, str], list[int]],
+                 handler: Callable[[int, int, int, str, str, int, int], None]) -> None:
+    for (protocol, src_port, dst_port, src_ip, dst_ip), (length, packet_count) in flows.items():
+        handler(protocol, src_port, dst_port, src_ip, dst_ip, length, packet_count)
+
+
+def capture_with_workers(handler: Callable[[int, int, int, str, str, int, int], None], worker_count: int,
+                         capture_mode: str) -> None:
+    """
+    Spread the capture over worker_count processes in one PACKET_FANOUT group, and merge their per-flow deltas
+    into the handler on this thread until the daemon stops.
+    """
+    context = multiprocessing.get_context("spawn")
+    output_queue = context.Queue()
+    stop_event = context.Event()
+    fanout_group = os.getpid() & 0xFFFF
+    # every worker filters its own socket, address changes are forwarded to them
+    address_queues = [context.Queue() for _ in range(worker_count)]
+
+    def forward_addresses(addresses: frozenset[str]) -> None:
+        for address_queue in address_queues:
+            address_queue.put(addresses)
+
+    capture_filter.add_listener(forward_addresses)
+    workers = [
+        context.Process(target=run_worker, name=f"soursop-capture-{i}",
+                        args=(i, fanout_group, capture_mode, capture_filter.get_addresses(), output_queue,
+                              address_queues[i], stop_event), daemon=True)
+        for i in range(worker_count)
+    ]
+    for worker in workers:
+        worker.start()
+    logging.info(f"Started {worker_count} capture workers in fanout group {fanout_group}")
+
+    try:
+        while util.RUNNING_FLAG and not stop_event.is_set():
+            try:
+                merge_deltas(output_queue.get(timeout=1), handler)
+            except queue.Empty:
+                pass
+    finally:
+        # keep reading while the workers exit, a worker only exits once its queued deltas are written
+        stop_event.set()
+        deadline = time.monotonic() + util.FIVE_SECONDS
+        while any(worker.is_alive() for worker in workers) and time.monotonic() < deadline:
+            try:
+                merge_deltas(output_queue.get(timeout=0.2), handler)
+            except queue.Empty:
+                pass
+        while True:
+            try:
+                merge_deltas(output_queue.get_nowait(), handler)
+            except queue.Empty:
+                break
+        for worker in workers:
+            if worker.is_alive():
+                worker.terminate()
+        capture_filter.remove_listener(forward_addresses)
+        logging.info("Stopped capture workers")
+
+    if util.RUNNING_FLAG:
+        raise RuntimeError("Capture workers stopped unexpectedly")
@@ -0,0 +1,202 @@
+import logging
+import os
+import socket
+import struct
+import time
+from threading import Lock
+
+from soursop import util
+
+_PROC_NET_TABLES = (
+    ("/proc/net/tcp", socket.AF_INET, socket.IPPROTO_TCP),
+    ("/proc/net/tcp6", socket.AF_INET6, socket.IPPROTO_TCP),
+    ("/proc/net/udp", socket.AF_INET, socket.IPPROTO_UDP),
+    ("/proc/net/udp6", socket.AF_INET6, socket.IPPROTO_UDP),
+)
+_SOCKET_LINK_PREFIX = "socket:["
+_IPV4_MAPPED_PREFIX = "::ffff:"
+_OWNER_WALK_INTERVAL = 10.0  # seconds between full walks for sockets whose owner lookup found nothing
+_OWNER_MISS_TTL = 30.0  # seconds a socket whose owner lookup found nothing is not looked up again
+
+
+def parse_address(hex_address: str, family: int) -> tuple[str, int]:
+    """Decode a /proc/net address like '0100007F:0035', every 32 bit word of the IP is printed in host order."""
+    hex_ip, hex_port = hex_address.split(":")
+    words = struct.unpack(f"!{len(hex_ip) // 8}I", bytes.fromhex(hex_ip))
+    packed_ip = struct.pack(f"={len(words)}I", *words)
+    ip = socket.inet_ntop(family, packed_ip)
+    if ip.startswith(_IPV4_MAPPED_PREFIX) and "." in ip:
+        ip = ip[len(_IPV4_MAPPED_PREFIX):]  # dual stack socket talking IPv4, packets carry the plain IPv4 address
+    return ip, int(hex_port, 16)
+
+
+def read_socket_table(path: str, family: int, protocol: int) -> dict[int, tuple[int, str, int, str, int]]:
+    """Return inode -> (protocol, local_ip, local_port, remote_ip, remote_port) for every socket of the table."""
+    sockets = {}
+    try:
+        with open(path) as table:
+            next(table)  # header line
+            for line in table:
+                fields = line.split()
+                inode = int(fields[9])
+                if inode == 0:
+                    continue  # TIME_WAIT and other sockets without an owner
+                local_ip, local_port = parse_address(fields[1], family)
+                remote_ip, remote_port = parse_address(fields[2], family)
+                sockets[inode] = (protocol, local_ip, local_port, remote_ip, remote_port)
+    except FileNotFoundError:
+        pass  # e.g. IPv6 disabled
+    return sockets
+
+
+def read_socket_fd(path: str) -> int | None:
+    """Inode of the socket an fd link like /proc/<pid>/fd/<fd> points to, None for other files and closed fds."""
+    try:
+        link = os.readlink(path)
+    except OSError:
+        return None
+    if not link.startswith(_SOCKET_LINK_PREFIX):
+        return None
+    return int(link[len(_SOCKET_LINK_PREFIX):-1])
+
+
+def read_socket_fds(pid: int) -> dict[str, int]:
+    """Return fd -> socket inode for every socket fd of a process."""
+    fds = {}
+    try:
+        with os.scandir(f"/proc/{pid}/fd") as entries:
+            for entry in entries:
+                inode = read_socket_fd(entry.path)
+                if inode is not None:
+                    fds[entry.name] = inode
+    except (FileNotFoundError, PermissionError, ProcessLookupError):
+        pass
+    return fds
+
+
+def read_fd_signature(pid: int) -> tuple[int, int] | None:
+    """Cheap change marker of a process fd table, recent kernels report the open fd count as the size."""
+    try:
+        stat = os.stat(f"/proc/{pid}/fd")
+        return stat.st_size, stat.st_mtime_ns
+    except OSError:
+        return None
+
+
+class ConnectionIndex:
+    """
+    Socket to pid index built from /proc. The socket tuples are re-read from /proc/net on every refresh,
+    but only the fd directories of new or changed processes are walked to map socket inodes to pids.
+    A process counts as changed when its fd count or mtime moved, or when one of its known socket fds
+    points to another socket now: a socket closed and reopened at the same fd keeps the count. Sockets that a full
+    walk found no owner for, like those of the kernel, are remembered, so they do not trigger the next full walk.
+    """
+
+    def __init__(self) -> None:
+        self._inode_pids: dict[int, int] = {}
+        self._fd_signatures: dict[int, tuple[int, int]] = {}
+        # pid -> fd -> inode of the socket fds found by the last walk of the process
+        self._socket_fds: dict[int, dict[str, int]] = {}
+        # sockets without an owner after the last full walk, and inode -> until when a failed owner lookup is kept
+        self._orphan_inodes: set[int] = set()
+        self._owner_misses: dict[int, float] = {}
+        self._next_full_scan = 0.0
+        self._next_owner_walk = 0.0
+        self._lock = Lock()  # refreshes and on-demand owner lookups come from different threads
+        self.last_refresh_time = 0.0
+        self.last_refresh_duration = 0.0
+        self.last_scanned_pids = 0
+
+    def _scan_pid(self, pid: int) -> None:
+        fds = self._socket_fds[pid] = read_socket_fds(pid)
+        for inode in fds.values():
+            self._inode_pids[inode] = pid
+
+    def _socket_fds_changed(self, pid: int) -> bool:
+        """Whether a known socket fd of the process was closed or reused, a readlink per socket fd only."""
+        fd_path = f"/proc/{pid}/fd/"
+        return any(read_socket_fd(fd_path + fd) != inode for fd, inode in self._socket_fds.get(pid, {}).items())
+
+    def _scan_changed_pids(self, pids: set[int]) -> set[int]:
+        scanned = set()
+        for pid in pids:
+            signature = read_fd_signature(pid)
+            if signature is None:
+                continue
+            if signature != self._fd_signatures.get(pid) or self._socket_fds_changed(pid):
+                self._fd_signatures[pid] = signature
+                self._scan_pid(pid)
+                scanned.add(pid)
+        return scanned
+
+    def find_owner(self, inode: int) -> int | None:
+        """
+        Resolve the owner of a single socket, walking only new or changed processes. A socket opened on an fd
+        that held another kind of file changes neither, so when that finds nothing every process is walked,
+        at most once per _OWNER_WALK_INTERVAL. A socket still without an owner is not looked up again for
+        _OWNER_MISS_TTL seconds.
+        """
+        with self._lock:
+            pid = self._inode_pids.get(inode)
+            now = time.monotonic()
+            if pid is not None or inode in self._orphan_inodes or self._owner_misses.get(inode, 0.0) > now:
+                return pid
+            pids = {int(name) for name in os.listdir("/proc") if name.isdigit()}
+            scanned = self._scan_changed_pids(pids)
+            pid = self._inode_pids.get(inode)
+            if pid is None and now >= self._next_owner_walk:
+                for other_pid in pids - scanned:
+                    self._scan_pid(other_pid)
+                self._next_owner_walk = now + _OWNER_WALK_INTERVAL
+                pid = self._inode_pids.get(inode)
+            if pid is None:
+                self._owner_misses[inode] = now + _OWNER_MISS_TTL
+            return pid
+
+    def refresh(self) -> list[tuple[tuple[int, str, int, str, int], int]]:
+        """Return (connection, pid) for every inet socket with a known owner."""
+        with self._lock:
+            return self._refresh()
+
+    def _refresh(self) -> list[tuple[tuple[int, str, int, str, int], int]]:
+        started = time.monotonic()
+        sockets = {}
+        for path, family, protocol in _PROC_NET_TABLES:
+            sockets.update(read_socket_table(path, family, protocol))
+
+        pids = {int(name) for name in os.listdir("/proc") if name.isdigit()}
+        self._fd_signatures = {pid: sig for pid, sig in self._fd_signatures.items() if pid in pids}
+        self._socket_fds = {pid: fds for pid, fds in self._socket_fds.items() if pid in pids}
+        self._inode_pids = {inode: pid for inode, pid in self._inode_pids.items()
+                            if inode in sockets and pid in pids}
+        self._orphan_inodes &= sockets.keys()
+        self._owner_misses = {inode: until for inode, until in self._owner_misses.items() if until > started}
+
+        scanned = self._scan_changed_pids(pids)
+
+        # older kernels do not report a changing fd count, fall back to an occasional full walk for new sockets
+        unresolved = any(inode not in self._inode_pids and inode not in self._orphan_inodes for inode in sockets)
+        if unresolved and started >= self._next_full_scan:
+            for pid in pids - scanned:
+                self._scan_pid(pid)
+                scanned.add(pid)
+            self._next_full_scan = started + util.ONE_MINUTE
+            self._orphan_inodes = {inode for inode in sockets if inode not in self._inode_pids}
+
+        self.last_refresh_time = time.time()
+        self.last_refresh_duration = time.monotonic() - started
+        self.last_scanned_pids = len(scanned)
+        logging.debug(f"Connection index refreshed in {self.last_refresh_duration * 1000:.1f} ms, "
+                      f"{len(sockets)} sockets, rescanned {len(scanned)} of {len(pids)} processes")
+
+        return [(connection, self._inode_pids[inode]) for inode, connection in sockets.items()
+                if inode in self._inode_pids]
+
+    def get_stats(self) -> dict[str, float]:
+        return {
+            "refresh_duration": self.last_refresh_duration,
+            "refresh_age": time.time() - self.last_refresh_time if self.last_refresh_time else -1.0,
+            "scanned_pids": self.last_scanned_pids,
+            "indexed_sockets": len(self._inode_pids),
+            "orphan_sockets": len(self._orphan_inodes),
+        }
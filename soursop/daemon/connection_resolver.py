@@ -0,0 +1,110 @@
+import logging
+import time
+from collections import deque
+from threading import Event, Lock
+from typing import Callable
+
+from soursop import util
+from soursop.metrics import Histogram
+
+# credit(pid, incoming_bytes, outgoing_bytes, packet_count, sample_rate)
+CreditFunction = Callable[[int, int, int, int, int], None]
+# resolve(protocol, local_ip, local_port, remote_ip, remote_port) -> pid
+ResolveFunction = Callable[[int, str, int, str, int], int | None]
+
+
+class ConnectionResolver:
+    """
+    Handles packets of connections the connection table does not know yet (opened after the last refresh).
+    Their bytes wait in a small bounded backlog while the connection is looked up on its own, rate limited,
+    and are credited to the owner once it is found. Backlog entries that cannot be resolved expire.
+    """
+
+    def __init__(self, resolve: ResolveFunction, credit: CreditFunction,
+                 max_pending: int = util.MAX_PENDING_CONNECTIONS,
+                 lookups_per_second: int = util.MAX_CONNECTION_LOOKUPS_PER_SECOND) -> None:
+        self._resolve = resolve
+        self._credit = credit
+        self._max_pending = max_pending
+        self._lookup_interval = 1.0 / lookups_per_second
+        # connection -> [incoming_bytes, outgoing_bytes, packet_count, first_seen, sample_rate]
+        self._pending: dict[tuple[int, str, int, str, int], list] = {}
+        self._queue: deque[tuple[int, str, int, str, int]] = deque()
+        self._retry_after: dict[tuple[int, str, int, str, int], float] = {}
+        self._lock = Lock()
+        self._wakeup = Event()
+        self.resolved = 0
+        self.unattributed_packets = 0
+        self.unattributed_bytes = 0
+        # time of the single connection lookups, only observed by the resolver thread
+        self.lookup_seconds = Histogram()
+
+    def get_stats(self) -> dict:
+        return {
+            "attribution_pending_connections": len(self._pending),
+            "attribution_resolved_connections_total": self.resolved,
+            "attribution_unattributed_packets_total": self.unattributed_packets,
+            "attribution_unattributed_bytes_total": self.unattributed_bytes,
+            "attribution_lookup_seconds": self.lookup_seconds,
+        }
+
+    def defer(self, connection: tuple[int, str, int, str, int],
+              incoming_bytes: int, outgoing_bytes: int, packet_count: int, sample_rate: int = 1) -> None:
+        with self._lock:
+            pending = self._pending.get(connection)
+            if pending is not None:
+                pending[0] += incoming_bytes
+                pending[1] += outgoing_bytes
+                pending[2] += packet_count
+                pending[4] = max(pending[4], sample_rate)
+                return
+            if len(self._pending) >= self._max_pending or connection in self._retry_after:
+                self.unattributed_packets += packet_count
+                self.unattributed_bytes += incoming_bytes + outgoing_bytes
+                return
+            self._pending[connection] = [incoming_bytes, outgoing_bytes, packet_count, time.monotonic(), sample_rate]
+            self._queue.append(connection)
+        self._wakeup.set()
+
+    def _expire(self, now: float) -> None:
+        with self._lock:
+            expired = [c for c, pending in self._pending.items() if now - pending[3] > util.PENDING_CONNECTION_TTL]
+            for connection in expired:
+                incoming, outgoing, packet_count, _, _ = self._pending.pop(connection)
+                self.unattributed_packets += packet_count
+                self.unattributed_bytes += incoming + outgoing
+            self._retry_after = {c: t for c, t in self._retry_after.items() if t > now}
+
+    def _resolve_next(self) -> None:
+        with self._lock:
+            connection = self._queue.popleft()
+        started = time.perf_counter()
+        try:
+            pid = self._resolve(*connection)
+        except OSError as e:
+            logging.debug(f"Connection lookup failed for {connection}: {e}")
+            pid = None
+        self.lookup_seconds.observe(time.perf_counter() - started)
+
+        if not pid:
+            # keep the backlog entry until it expires, but do not look this connection up again for a while
+            with self._lock:
+                self._retry_after[connection] = time.monotonic() + util.PENDING_CONNECTION_TTL
+            return
+
+        with self._lock:
+            pending = self._pending.pop(connection, None)
+        if pending:
+            self.resolved += 1
+            self._credit(pid, pending[0], pending[1], pending[2], pending[4])
+
+    def run(self) -> None:
+        logging.info("Started connection resolver thread...")
+        while util.RUNNING_FLAG:
+            self._wakeup.wait(1)
+            self._wakeup.clear()
+            while self._queue and util.RUNNING_FLAG:
+                self._resolve_next()
+                time.sleep(self._lookup_interval)
+            self._expire(time.monotonic())
+        logging.info("Stopped connection resolver thread")
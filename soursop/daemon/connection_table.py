@@ -0,0 +1,75 @@
+import time
+
+from soursop import util
+
+WILDCARD_IPS = {"0.0.0.0", "::"}
+
+
+def connection_keys(protocol: int, local_ip: str, local_port: int,
+                    remote_ip: str, remote_port: int) -> list[tuple]:
+    """Keys a socket is found under: the full 5-tuple when connected, its bound address otherwise."""
+    if remote_port:
+        return [(protocol, local_ip, local_port, remote_ip, remote_port)]
+    if local_ip in WILDCARD_IPS:
+        return [(protocol, None, local_port)]
+    return [(protocol, local_ip, local_port)]
+
+
+class ConnectionTable:
+    """
+    Connection -> pid table. Only the refresher thread calls update(), it builds a new dict and swaps it in,
+    so lookup() reads an immutable snapshot without taking any lock.
+    Sockets that disappear are kept for a TTL, so packets that trail a closed connection are still attributed.
+    Connections resolved on demand between two refreshes go to a small overlay dict until the next update().
+    """
+
+    def __init__(self, ttl: float = util.CONNECTION_TTL, max_entries: int = util.MAX_CONNECTIONS) -> None:
+        self._ttl = ttl
+        self._max_entries = max_entries
+        self._last_seen: dict[tuple, tuple[int, float]] = {}  # owned by the refresher thread
+        self._snapshot: dict[tuple, int] = {}
+        self._resolved: dict[tuple, int] = {}
+        self.evicted = 0
+
+    def update(self, connections: list[tuple[tuple[int, str, int, str, int], int]]) -> None:
+        now = time.monotonic()
+        last_seen = self._last_seen
+        resolved, self._resolved = self._resolved, {}
+        for key, pid in resolved.items():
+            last_seen[key] = (pid, now)
+        for connection, pid in connections:
+            for key in connection_keys(*connection):
+                last_seen[key] = (pid, now)
+
+        expired = [key for key, (_, seen) in last_seen.items() if now - seen > self._ttl]
+        for key in expired:
+            del last_seen[key]
+        evicted = len(expired)
+
+        if len(last_seen) > self._max_entries:
+            oldest = sorted(last_seen, key=lambda k: last_seen[k][1])[:len(last_seen) - self._max_entries]
+            for key in oldest:
+                del last_seen[key]
+            evicted += len(oldest)
+
+        self.evicted += evicted
+        self._snapshot = {key: pid for key, (pid, _) in last_seen.items()}
+
+    def add_resolved(self, connection: tuple[int, str, int, str, int], pid: int) -> None:
+        self._resolved[connection] = pid
+
+    def lookup(self, connection: tuple[int, str, int, str, int]) -> int | None:
+        """Find the owner of a (protocol, local_ip, local_port, remote_ip, remote_port) connection."""
+        snapshot = self._snapshot
+        pid = snapshot.get(connection)
+        if pid is None:
+            protocol, local_ip, local_port = connection[0], connection[1], connection[2]
+            pid = snapshot.get((protocol, local_ip, local_port))
+            if pid is None:
+                pid = snapshot.get((protocol, None, local_port))
+                if pid is None:
+                    pid = self._resolved.get(connection)
+        return pid
+
+    def __len__(self) -> int:
+        return len(self._snapshot)
@@ -1,12 +1,17 @@
+import asyncio
 import logging
-import signal
 from pathlib import Path
 
-from soursop import util
+import soursop.db.writer as writer
+from soursop import config, metrics
 from soursop.daemon.network_tracker import start_network_tracking
 from soursop.daemon.process_tracker import start_process_tracking
+from soursop.daemon.query_server import start_query_server
+from soursop.daemon.scheduler import Scheduler
 from soursop.daemon.utility_monitor import start_utility_monitor
+from soursop.db import retention
 from soursop.db.connection import init_db
+from soursop.usage_journal import UsageJournal
 
 
 def configure_logging():
@@ -24,22 +29,60 @@ def configure_logging():
     logging.info("Logging configuration successful.")
 
 
-def shutdown_handler(sig, frame):
-    util.RUNNING_FLAG = False
-    logging.info("Shutting down gracefully...")
+def open_journal() -> UsageJournal | None:
+    if not config.JOURNAL_PATH:
+        return None
+    journal = UsageJournal(Path(config.JOURNAL_PATH))
+    try:
+        writer.replay_journal(journal)
+    except OSError as e:
+        logging.error(f"Usage journal is not available ({e}), buffered usage is lost if the daemon stops abruptly")
+        journal.close()
+        return None
+    return journal
+
+
+def start_metrics(scheduler: Scheduler) -> None:
+    """Write the stats file periodically, and once more after the final database write."""
+    if not config.STATS_PATH:
+        return
+    stats_path = Path(config.STATS_PATH)
+    scheduler.add_job("stats", config.STATS_INTERVAL, lambda: metrics.write_stats(stats_path), blocking=True)
+    # registered first, so it runs last of the shutdown hooks
+    scheduler.add_shutdown_hook(lambda: metrics.write_stats(stats_path))
+
+
+def start_writer(scheduler: Scheduler) -> None:
+    writer.set_flush_wakeup(lambda: scheduler.wake("flush"))
+    # a commit waits for the disk, so the writer runs in the executor and never holds up the other jobs
+    scheduler.add_job("flush", config.FLUSH_INTERVAL, writer.flush, blocking=True)
+    metrics.register_source(writer.get_stats)
+    scheduler.add_shutdown_hook(writer.final_flush)
+
+
+def start_retention(scheduler: Scheduler) -> None:
+    if config.HOURLY_RETENTION_DAYS <= 0 and config.DAILY_RETENTION_DAYS <= 0:
+        logging.info("Retention policy disabled, keeping all usage data.")
+        return
+    # batched deletes can take a while, so retention runs in the executor and never holds up the other jobs
+    scheduler.add_job("retention", config.RETENTION_INTERVAL, retention.run_retention, blocking=True)
+    scheduler.add_shutdown_hook(retention.close)
 
 
 if __name__ == "__main__":
     configure_logging()
     logging.info("Starting Soursop 1.0 daemon...")
 
-    signal.signal(signal.SIGINT, shutdown_handler)
-    signal.signal(signal.SIGTERM, shutdown_handler)
-
     init_db()
-    start_utility_monitor()
+    journal = open_journal()
+    scheduler = Scheduler()
+    start_metrics(scheduler)
+    start_writer(scheduler)
+    start_retention(scheduler)
+    start_utility_monitor(scheduler)
 
-    start_process_tracking()
-    start_network_tracking()
+    start_process_tracking(scheduler, journal)
+    start_network_tracking(scheduler, journal)
+    start_query_server(scheduler)
 
-# need to write a cleaner scheduler for both calculators
+    asyncio.run(scheduler.run())
@@ -1,14 +1,32 @@
 import logging
 import os
 from datetime import date, datetime
-from threading import Thread
-from time import sleep
-
-import psutil
+from threading import Lock
 
 import soursop.db.network_repository as repository
-from soursop import util
+import soursop.db.writer as writer
+from soursop import config, util
 from soursop.beans import NetworkUsage, NetworkInterface
+from soursop.daemon import query_server
+from soursop.daemon.scheduler import Scheduler
+from soursop.usage_journal import UsageJournal
+
+_PROC_NET_DEV = "/proc/net/dev"
+_SYS_CLASS_NET = "/sys/class/net/"
+_COUNTER_32_BIT = 2 ** 32
+
+# interface name -> whether it is backed by a device, checked once per name
+_PHYSICAL_INTERFACES: dict[str, bool] = {}
+# tracked interfaces and the start of the hour their totals belong to, only changed by the scheduler loop
+_INTERFACES: dict[str, NetworkInterface] = {}
+_HOUR_START: datetime | None = None
+# final totals of finished hours that are not committed yet, journaled along with the current totals. The scheduler
+# loop adds to them, the writer thread forgets them from its flush and commit hooks, both under the lock
+_HOURS_LOCK = Lock()
+_UNCOMMITTED_HOURS: list[NetworkUsage] = []
+# how many of them were handed to the writer before its current flush started
+_HOURS_IN_FLUSH = 0
+_JOURNAL: UsageJournal | None = None
 
 
 def get_time_now() -> tuple[date, int]:
@@ -16,78 +34,151 @@ def get_time_now() -> tuple[date, int]:
     return date_now, date_now.hour
 
 
-def get_counters(interface: str) -> tuple[int, int]:
-    stats = psutil.net_io_counters(pernic=True)
-    if interface not in stats:
-        raise RuntimeError(f"Interface '{interface}' not found! Available: {list(stats.keys())}")
-    iface = stats[interface]
-    return iface.bytes_recv, iface.bytes_sent
-
-
-# move to a separate thread in future
-def get_physical_interfaces() -> list[str]:
-    net_path = "/sys/class/net/"
-    return [
-        iface for iface in os.listdir(net_path)
-        if os.path.exists(os.path.join(net_path, iface, "device"))
-    ]
-
-
-def create_network_interface_map(start_date: date,
-                                 start_hour: int,
-                                 interfaces: list[str]) -> dict[str, NetworkInterface]:
-    interface_map = {}
-    for name in interfaces:
-        baseline_incoming, baseline_outgoing = get_counters(name)
-        saved_incoming, saved_outgoing = repository.get_usage_bytes(start_date, start_hour, name)
-        interface_info = NetworkInterface(name=name,
-                                          saved_incoming=saved_incoming, saved_outgoing=saved_outgoing,
-                                          baseline_incoming=baseline_incoming, baseline_outgoing=baseline_outgoing)
-        interface_map[name] = interface_info
-    return interface_map
-
-
-def listen_and_save_usage():
-    interfaces = get_physical_interfaces()
-    start_date, start_hour = get_time_now()
-
-    interface_info_map = create_network_interface_map(start_date, start_hour, interfaces)
-
-    while util.RUNNING_FLAG:
-        now_date, now_hour = get_time_now()
-        now_date_str = now_date.strftime(util.DB_DATE_FORMAT)
-
-        for name, info in interface_info_map.items():
-            info.current_usage = NetworkUsage(network=name, date_str=now_date_str, hour=now_hour)
-            current_incoming, current_outgoing = get_counters(name)
-
-            if start_hour != now_hour:
-                info.saved_incoming, info.saved_outgoing = 0, 0
-                info.baseline_incoming, info.baseline_outgoing = current_incoming, current_outgoing
-                logging.info(f"New time period: {now_date_str}:{now_hour}, for network: {name}"
-                             f"resetting baseline counters to {current_incoming}/{current_outgoing} bytes.")
-
-            info.current_usage.incoming_bytes = info.saved_incoming + current_incoming - info.baseline_incoming
-            info.current_usage.outgoing_bytes = info.saved_outgoing + current_outgoing - info.baseline_outgoing
-
-        usages = [iface.current_usage for iface in interface_info_map.values()]
-        repository.update(usages)
-
-        start_hour = now_hour
-        sleep(util.FIFTEEN_SECONDS)
-
-
-def sniff_network():
-    logging.info("Started network sniffing thread....")
-    while util.RUNNING_FLAG:
-        try:
-            listen_and_save_usage()
-        except Exception as e:
-            logging.info(f"Error occurred while handling save_process_usages", e)
-            sleep(util.FIVE_SECONDS)
-    logging.info("Stopped network sniffing thread....")
-
-
-def start_network_tracking():
-    sniff_thread = Thread(target=sniff_network, daemon=False)
-    sniff_thread.start()
+def read_interface_counters() -> dict[str, tuple[int, int]]:
+    """(received, sent) bytes of every interface, from a single read of /proc/net/dev."""
+    counters = {}
+    with open(_PROC_NET_DEV) as dev:
+        for line in dev.readlines()[2:]:  # two header lines
+            name, _, fields = line.partition(":")
+            values = fields.split()
+            counters[name.strip()] = int(values[0]), int(values[8])
+    return counters
+
+
+def is_physical_interface(name: str) -> bool:
+    physical = _PHYSICAL_INTERFACES.get(name)
+    if physical is None:
+        physical = os.path.exists(os.path.join(_SYS_CLASS_NET, name, "device"))
+        _PHYSICAL_INTERFACES[name] = physical
+    return physical
+
+
+def counter_delta(previous: int, current: int) -> int:
+    """Bytes counted between two readings of an interface counter."""
+    if current >= previous:
+        return current - previous
+    if previous < _COUNTER_32_BIT and previous - current > _COUNTER_32_BIT // 2:
+        return current + _COUNTER_32_BIT - previous  # a 32 bit driver counter wrapped around
+    return current  # the counter restarted, e.g. the interface was re-created
+
+
+def create_network_interface(name: str, bucket: int, incoming: int, outgoing: int) -> NetworkInterface:
+    """Start tracking an interface, continuing the total of the current hour if it was saved before a restart."""
+    saved_incoming, saved_outgoing = repository.get_usage_bytes(bucket, name)
+    logging.info(f"Tracking network interface: {name}")
+    return NetworkInterface(name=name,
+                            saved_incoming=saved_incoming, saved_outgoing=saved_outgoing,
+                            baseline_incoming=incoming, baseline_outgoing=outgoing,
+                            written_incoming=saved_incoming, written_outgoing=saved_outgoing)
+
+
+def take_usages(interfaces: dict[str, NetworkInterface], hour_start: datetime,
+                threshold: int) -> list[NetworkUsage]:
+    """Usage rows of the interfaces whose total grew by at least threshold bytes since it was last written."""
+    usages = []
+    for name, info in interfaces.items():
+        unwritten = (info.saved_incoming - info.written_incoming) + (info.saved_outgoing - info.written_outgoing)
+        if unwritten > 0 and unwritten >= threshold:
+            usages.append(NetworkUsage(network=name, date_str=hour_start.strftime(util.DB_DATE_FORMAT),
+                                       hour=hour_start.hour, bucket=util.hour_bucket(hour_start),
+                                       incoming_bytes=info.saved_incoming, outgoing_bytes=info.saved_outgoing))
+            info.written_incoming, info.written_outgoing = info.saved_incoming, info.saved_outgoing
+    return usages
+
+
+def current_usages(interfaces: dict[str, NetworkInterface], hour_start: datetime) -> list[NetworkUsage]:
+    return [NetworkUsage(network=name, date_str=hour_start.strftime(util.DB_DATE_FORMAT), hour=hour_start.hour,
+                         bucket=util.hour_bucket(hour_start),
+                         incoming_bytes=info.saved_incoming, outgoing_bytes=info.saved_outgoing)
+            for name, info in interfaces.items() if info.saved_incoming or info.saved_outgoing]
+
+
+def mark_uncommitted_hours() -> None:
+    global _HOURS_IN_FLUSH
+    with _HOURS_LOCK:
+        _HOURS_IN_FLUSH = len(_UNCOMMITTED_HOURS)
+
+
+def forget_uncommitted_hours() -> None:
+    """Forget the finished hours the last flush wrote, hours finished while it ran wait for the next one."""
+    global _HOURS_IN_FLUSH
+    with _HOURS_LOCK:
+        del _UNCOMMITTED_HOURS[:_HOURS_IN_FLUSH]
+        _HOURS_IN_FLUSH = 0
+
+
+def journal_network_totals(current: list[NetworkUsage]) -> None:
+    """Replace the journaled totals with a complete snapshot: the finished hours not committed yet and current."""
+    if _JOURNAL is not None:
+        with _HOURS_LOCK:
+            _JOURNAL.set_network_totals(_UNCOMMITTED_HOURS + current)
+
+
+def get_live_usages() -> list[NetworkUsage]:
+    """
+    Latest totals of the hours the database may be behind on: the current hour, finished hours that are not
+    committed yet and the totals waiting for the writer. A total can show up more than once, the highest wins.
+    """
+    hour_start = _HOUR_START
+    with _HOURS_LOCK:
+        usages = writer.get_pending()[0] + list(_UNCOMMITTED_HOURS)
+    if hour_start is not None:
+        usages += current_usages(dict(_INTERFACES), hour_start)
+    return usages
+
+
+def track_network_usage() -> None:
+    """One tick of the network tracker: add the counter deltas to the hour totals and hand over what changed."""
+    global _HOUR_START
+    now_date, now_hour = get_time_now()
+    if _HOUR_START is None:
+        _HOUR_START = now_date
+    counters = {name: counter for name, counter in read_interface_counters().items() if is_physical_interface(name)}
+
+    # bytes counted since the previous tick belong to the hour of that tick
+    for name, (incoming, outgoing) in counters.items():
+        info = _INTERFACES.get(name)
+        if info is None:
+            _INTERFACES[name] = create_network_interface(name, util.hour_bucket(_HOUR_START), incoming, outgoing)
+            continue
+        info.saved_incoming += counter_delta(info.baseline_incoming, incoming)
+        info.saved_outgoing += counter_delta(info.baseline_outgoing, outgoing)
+        info.baseline_incoming, info.baseline_outgoing = incoming, outgoing
+
+    if now_date == _HOUR_START:
+        writer.submit_network_usages(take_usages(_INTERFACES, _HOUR_START, util.NETWORK_WRITE_THRESHOLD))
+        journal_network_totals(current_usages(_INTERFACES, _HOUR_START))
+        return
+
+    writer.submit_network_usages(take_usages(_INTERFACES, _HOUR_START, threshold=0))
+    with _HOURS_LOCK:
+        _UNCOMMITTED_HOURS.extend(current_usages(_INTERFACES, _HOUR_START))
+    logging.info(f"New time period: {now_date.strftime(util.DB_DATE_FORMAT)}:{now_hour}, "
+                 f"resetting the totals of {len(_INTERFACES)} network interfaces.")
+    for name in [name for name in _INTERFACES if name not in counters]:
+        logging.info(f"Stopped tracking removed network interface: {name}")
+        del _INTERFACES[name]
+    for info in _INTERFACES.values():
+        info.saved_incoming = info.saved_outgoing = 0
+        info.written_incoming = info.written_outgoing = 0
+    _HOUR_START = now_date
+    journal_network_totals([])
+
+
+def submit_remaining_usage() -> None:
+    """Count up to now and hand every total that did not reach the write threshold to the final database write."""
+    track_network_usage()
+    writer.submit_network_usages(take_usages(_INTERFACES, _HOUR_START, threshold=0))
+    logging.info("Stopped network tracking....")
+
+
+def start_network_tracking(scheduler: Scheduler, journal: UsageJournal | None = None):
+    global _JOURNAL
+    _JOURNAL = journal
+    # the finished hours are kept for the journal and the query server, with or without a journal
+    writer.register_flush_hook(mark_uncommitted_hours)
+    writer.register_commit_hook(forget_uncommitted_hours)
+    query_server.register_live_source("network", get_live_usages)
+    track_network_usage()  # takes the counter baselines right away, not only at the first tick
+    scheduler.add_job("network", config.NETWORK_INTERVAL, track_network_usage)
+    scheduler.add_shutdown_hook(submit_remaining_usage)
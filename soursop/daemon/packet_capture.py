@@ -0,0 +1,91 @@
+import logging
+import socket
+import struct
+import time
+from typing import Callable
+
+from soursop import util
+from soursop.daemon import capture_filter
+from soursop.daemon.packet_parser import parse_ip_packet
+
+ETH_P_ALL = 0x0003
+SOL_PACKET = 263
+PACKET_STATISTICS = 6
+PACKET_FANOUT = 18
+PACKET_FANOUT_HASH = 0
+PACKET_FANOUT_FLAG_DEFRAG = 0x8000
+
+_RECEIVE_TIMEOUT = struct.pack("ll", 1, 0)  # wake up every second to check the running flag
+# tp_packets and tp_drops, the start of tpacket_stats and of tpacket_stats_v3 of the ring
+_TPACKET_STATS = struct.Struct("=II")
+
+# kernel side counters of the capture sockets of this process, accumulated since the daemon started
+_KERNEL_PACKETS = 0
+_KERNEL_DROPS = 0
+
+
+def get_kernel_statistics() -> tuple[int, int]:
+    """Return (packets, drops) counted by the kernel for the capture sockets."""
+    return _KERNEL_PACKETS, _KERNEL_DROPS
+
+
+def update_kernel_statistics(sock: socket.socket) -> None:
+    """PACKET_STATISTICS resets the kernel counters on every read, so add them up here."""
+    global _KERNEL_PACKETS, _KERNEL_DROPS
+    packets, drops = _TPACKET_STATS.unpack(sock.getsockopt(SOL_PACKET, PACKET_STATISTICS, _TPACKET_STATS.size))
+    _KERNEL_PACKETS += packets
+    _KERNEL_DROPS += drops
+    if drops:
+        logging.warning(f"Capture socket dropped {drops} of {packets} packets in the last interval "
+                        f"({_KERNEL_DROPS} dropped in total)")
+
+
+def open_packet_socket() -> socket.socket:
+    """
+    Open an AF_PACKET socket on all interfaces. SOCK_DGRAM makes the kernel strip the link layer header,
+    so every read starts at the IP header regardless of the interface type.
+    """
+    sock = socket.socket(socket.AF_PACKET, socket.SOCK_DGRAM, socket.htons(ETH_P_ALL))
+    # SO_RCVTIMEO instead of settimeout(), which would add a poll() call in front of every read
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVTIMEO, _RECEIVE_TIMEOUT)
+    return sock
+
+
+def join_fanout_group(sock: socket.socket, group_id: int | None) -> None:
+    """
+    Let the kernel spread packets over every socket of the group by flow hash, so all packets of a flow
+    end up in the same socket. Fragments are reassembled first, so they hash like the rest of their flow.
+    """
+    if group_id is not None:
+        fanout = (group_id & 0xFFFF) | ((PACKET_FANOUT_HASH | PACKET_FANOUT_FLAG_DEFRAG) << 16)
+        sock.setsockopt(SOL_PACKET, PACKET_FANOUT, struct.pack("=I", fanout))  # does not fit a signed int
+
+
+def capture_packets(handler: Callable[[int, int, int, str, str, int], None], fanout_group: int | None = None) -> None:
+    """
+    Read packets until the daemon stops, and pass the (protocol, src_port, dst_port, src_ip, dst_ip, ip_length)
+    headers of every TCP/UDP packet to the handler. Only the first CAPTURE_SNAPLEN bytes of a packet are read,
+    MSG_TRUNC still reports its whole length.
+    """
+    buffer = bytearray(util.CAPTURE_SNAPLEN)
+    view = memoryview(buffer)
+    with open_packet_socket() as sock:
+        capture_filter.register_socket(sock)
+        join_fanout_group(sock, fanout_group)
+        next_statistics_time = time.monotonic() + util.ONE_MINUTE
+        try:
+            while util.RUNNING_FLAG:
+                try:
+                    length = sock.recv_into(buffer, 0, socket.MSG_TRUNC)
+                except (BlockingIOError, InterruptedError):
+                    continue
+                connection = parse_ip_packet(view, 0, min(length, util.CAPTURE_SNAPLEN), length)
+                if connection:
+                    handler(*connection)
+
+                if time.monotonic() >= next_statistics_time:
+                    update_kernel_statistics(sock)
+                    next_statistics_time += util.ONE_MINUTE
+        finally:
+            capture_filter.unregister_socket(sock)
+            update_kernel_statistics(sock)
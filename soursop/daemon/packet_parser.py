@@ -0,0 +1,69 @@
+import socket
+import struct
+
+IPPROTO_TCP = 6
+IPPROTO_UDP = 17
+
+_IPV6_HOP_BY_HOP = 0
+_IPV6_ROUTING = 43
+_IPV6_FRAGMENT = 44
+_IPV6_AUTH = 51
+_IPV6_DEST_OPTIONS = 60
+_IPV6_EXTENSION_HEADERS = {_IPV6_HOP_BY_HOP, _IPV6_ROUTING, _IPV6_FRAGMENT, _IPV6_AUTH, _IPV6_DEST_OPTIONS}
+
+_U16 = struct.Struct("!H")
+_PORTS = struct.Struct("!HH")
+
+
+def parse_ip_packet(buf: memoryview, offset: int, end: int, wire_length: int = 0) -> tuple | None:
+    """
+    Read the IP and TCP/UDP headers of the packet in buf[offset:end] without building any layer objects.
+    The capture may be truncated after the headers, the length comes from the IP header. Segmentation offload
+    super-frames over 64 KiB carry a zero length there, wire_length (the untruncated length) is used for them.
+    Returns (protocol, src_port, dst_port, src_ip, dst_ip, ip_length),
+    or None for anything that is not a TCP/UDP packet (or not the first fragment of one).
+    """
+    if end - offset < 20:
+        return None
+
+    version = buf[offset] >> 4
+    if version == 4:
+        header_length = (buf[offset] & 0x0F) * 4
+        if header_length < 20 or (_U16.unpack_from(buf, offset + 6)[0] & 0x1FFF):
+            return None  # broken header, or a non-first fragment which carries no ports
+        ip_length = _U16.unpack_from(buf, offset + 2)[0] or wire_length
+        protocol = buf[offset + 9]
+        src_ip = socket.inet_ntop(socket.AF_INET, buf[offset + 12:offset + 16])
+        dst_ip = socket.inet_ntop(socket.AF_INET, buf[offset + 16:offset + 20])
+        l4_offset = offset + header_length
+
+    elif version == 6:
+        if end - offset < 40:
+            return None
+        payload_length = _U16.unpack_from(buf, offset + 4)[0]
+        ip_length = payload_length + 40 if payload_length else wire_length  # zero for jumbograms as well
+        protocol = buf[offset + 6]
+        src_ip = socket.inet_ntop(socket.AF_INET6, buf[offset + 8:offset + 24])
+        dst_ip = socket.inet_ntop(socket.AF_INET6, buf[offset + 24:offset + 40])
+        l4_offset = offset + 40
+
+        while protocol in _IPV6_EXTENSION_HEADERS:
+            if l4_offset + 8 > end:
+                return None
+            next_header = buf[l4_offset]
+            if protocol == _IPV6_FRAGMENT:
+                if _U16.unpack_from(buf, l4_offset + 2)[0] & 0xFFF8:
+                    return None
+                l4_offset += 8
+            elif protocol == _IPV6_AUTH:
+                l4_offset += (buf[l4_offset + 1] + 2) * 4
+            else:
+                l4_offset += (buf[l4_offset + 1] + 1) * 8
+            protocol = next_header
+    else:
+        return None
+
+    if (protocol != IPPROTO_TCP and protocol != IPPROTO_UDP) or l4_offset + 4 > end:
+        return None
+    src_port, dst_port = _PORTS.unpack_from(buf, l4_offset)
+    return protocol, src_port, dst_port, src_ip, dst_ip, ip_length
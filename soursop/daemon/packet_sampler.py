@@ -0,0 +1,71 @@
+import logging
+import time
+
+
+class PacketSampler:
+    """
+    1-in-N sampling in front of the packet attribution. The counter mode keeps every N-th packet, the flow mode
+    keeps the packets of every flow whose hash falls on N, so a flow is either attributed as a whole or not at all.
+    Kept packets are scaled by N. adjust() doubles N while the attributed packet rate or the CPU use of the daemon
+    is over its budget, and halves it again once both are well below.
+    """
+
+    def __init__(self, mode: str, rate: int, max_rate: int, packet_budget: int, cpu_budget: int) -> None:
+        self.mode = mode
+        self.rate = rate
+        self._min_rate = rate
+        self._max_rate = max_rate
+        self._packet_budget = packet_budget
+        self._cpu_budget = cpu_budget
+        self._counter = 0
+        self.seen_packets = 0
+        self.sampled_packets = 0
+        self._last_sampled = 0
+        self._last_time = time.monotonic()
+        self._last_cpu = time.process_time()
+
+    def sample(self, connection: tuple[int, str, int, str, int], packet_count: int = 1) -> tuple[int, int]:
+        """
+        (kept packets, rate to scale them by) of packet_count packets of a connection, no kept packets when all of
+        them are skipped. The counter mode counts every packet of the per-flow deltas of the capture workers, so a
+        delta keeps as many packets as N-th packets fall into it. Only called from the capture thread.
+        """
+        self.seen_packets += packet_count
+        rate = self.rate
+        if rate == 1:
+            kept = packet_count
+        elif self.mode == "flow":
+            kept = 0 if hash(connection) % rate else packet_count
+        else:
+            self._counter += packet_count
+            kept, self._counter = divmod(self._counter, rate)
+        self.sampled_packets += kept
+        return kept, rate
+
+    def get_stats(self) -> dict:
+        return {
+            "attribution_sample_rate": self.rate,
+            "attribution_sampler_seen_packets_total": self.seen_packets,
+            "attribution_sampler_kept_packets_total": self.sampled_packets,
+        }
+
+    def adjust(self) -> None:
+        """Pick the rate for the next interval from the load of the last one."""
+        now, cpu = time.monotonic(), time.process_time()
+        elapsed = now - self._last_time
+        if elapsed <= 0:
+            return
+        packet_rate = (self.sampled_packets - self._last_sampled) / elapsed
+        cpu_percent = (cpu - self._last_cpu) / elapsed * 100
+        self._last_time, self._last_cpu = now, cpu
+        self._last_sampled = self.sampled_packets
+
+        rate = self.rate
+        if packet_rate > self._packet_budget or cpu_percent > self._cpu_budget:
+            rate = min(rate * 2, self._max_rate)
+        elif packet_rate * 2 < self._packet_budget and cpu_percent * 2 < self._cpu_budget:
+            rate = max(rate // 2, self._min_rate)
+        if rate != self.rate:
+            logging.info(f"Packet sample rate changed from 1 in {self.rate} to 1 in {rate} "
+                         f"({packet_rate:.0f} attributed packets/s, {cpu_percent:.0f}% CPU)")
+            self.rate = rate
@@ -1,29 +1,120 @@
-import logging
+import sys
 import time
+from collections import OrderedDict
+from threading import Lock
 
 import psutil
 
 from soursop.beans import ProcessInfo
-from soursop.util import TEN_SECONDS
+from soursop.metrics import Histogram
+from soursop.util import TEN_SECONDS, ONE_MINUTE, MAX_PROCESS_CACHE
 
-# map of pid and their corresponding process information
-_PROCESS_CACHE: dict[int, ProcessInfo] = {}
+_NEGATIVE_BACKOFF_MIN = TEN_SECONDS
+_NEGATIVE_BACKOFF_MAX = 10 * ONE_MINUTE
+
+# pid -> process information in least recently used order, (pid, start_time) identifies the process
+_PROCESS_CACHE: OrderedDict[int, ProcessInfo] = OrderedDict()
+# (pid, start_time) -> (retry_at, backoff) of processes psutil could not read
+_NEGATIVE_CACHE: dict[tuple[int, int], tuple[float, float]] = {}
+_CACHE_LOCK = Lock()
+_CACHE_STATS = {"hits": 0, "revalidations": 0, "misses": 0, "negative_hits": 0, "evictions": 0}
+# time psutil takes to read a process missing from the cache, observed under the cache lock
+_LOOKUP_SECONDS = Histogram()
+
+
+def get_cache_stats() -> dict[str, int]:
+    return dict(_CACHE_STATS, size=len(_PROCESS_CACHE), negative_size=len(_NEGATIVE_CACHE))
+
+
+def get_stats() -> dict:
+    stats = {f"cache_process_{name}_total": value for name, value in _CACHE_STATS.items()}
+    stats.update(cache_process_entries=len(_PROCESS_CACHE), cache_process_negative_entries=len(_NEGATIVE_CACHE),
+                 cache_process_lookup_seconds=_LOOKUP_SECONDS)
+    return stats
+
+
+def read_start_time(pid: int) -> int | None:
+    """Start time of the process in clock ticks since boot (field 22 of /proc/<pid>/stat), None if it is gone."""
+    try:
+        with open(f"/proc/{pid}/stat", "rb") as stat_file:
+            stat = stat_file.read()
+    except OSError:
+        return None
+    # the command name may contain spaces and brackets, so count the fields from the last ')'
+    return int(stat[stat.rindex(b")") + 2:].split()[19])
+
+
+def _remember_failure(key: tuple[int, int], now: float) -> None:
+    previous = _NEGATIVE_CACHE.get(key)
+    backoff = min(previous[1] * 2, _NEGATIVE_BACKOFF_MAX) if previous else _NEGATIVE_BACKOFF_MIN
+    if len(_NEGATIVE_CACHE) >= MAX_PROCESS_CACHE:
+        for stale in [k for k, (retry_at, _) in _NEGATIVE_CACHE.items() if retry_at <= now]:
+            del _NEGATIVE_CACHE[stale]
+        if len(_NEGATIVE_CACHE) >= MAX_PROCESS_CACHE:
+            _NEGATIVE_CACHE.clear()
+    _NEGATIVE_CACHE[key] = (now + backoff, backoff)
 
 
 def get_process_info(pid: int) -> ProcessInfo | None:
-    now = time.time()
-    if pid in _PROCESS_CACHE:
-        info = _PROCESS_CACHE[pid]
-        if now - info.timestamp < TEN_SECONDS:
+    """
+    Cached name and path of a process. The lock is only held to look up and update the caches, the /proc and psutil
+    reads of a miss run without it, so the capture thread, the resolver and the query server do not wait on each
+    other's file system reads. Two threads missing the same process both read it, the later one wins.
+    """
+    now = time.monotonic()
+    with _CACHE_LOCK:
+        info = _PROCESS_CACHE.get(pid)
+        if info and now - info.timestamp < TEN_SECONDS:
+            _PROCESS_CACHE.move_to_end(pid)
+            _CACHE_STATS["hits"] += 1
             return info
 
+    # name and exe only change with an exec, a matching start time means it is still the same process
+    start_time = read_start_time(pid)
+    key = (pid, start_time)
+    with _CACHE_LOCK:
+        if start_time is None:
+            _PROCESS_CACHE.pop(pid, None)
+            _CACHE_STATS["misses"] += 1
+            return None
+        info = _PROCESS_CACHE.get(pid)
+        if info and info.start_time == start_time:
+            info.timestamp = now
+            _PROCESS_CACHE.move_to_end(pid)
+            _CACHE_STATS["revalidations"] += 1
+            return info
+
+        negative = _NEGATIVE_CACHE.get(key)
+        if negative and now < negative[0]:
+            _CACHE_STATS["negative_hits"] += 1
+            return None
+        _CACHE_STATS["misses"] += 1
+
+    started = time.perf_counter()
     try:
         p = psutil.Process(pid)
         with p.oneshot():
-            name = p.name()
-            path = p.exe()
-        new_info = ProcessInfo(pid=pid, name=name, path=path, timestamp=now)
-        _PROCESS_CACHE[pid] = new_info
-        return new_info
-    except (psutil.NoSuchProcess, psutil.AccessDenied):
+            # interned, the usage entries of every hour and flush share the same strings
+            name = sys.intern(p.name())
+            path = sys.intern(p.exe())
+    except psutil.AccessDenied:
+        with _CACHE_LOCK:
+            _LOOKUP_SECONDS.observe(time.perf_counter() - started)
+            _remember_failure(key, now)
+        return None
+    except psutil.NoSuchProcess:
+        with _CACHE_LOCK:
+            _LOOKUP_SECONDS.observe(time.perf_counter() - started)
+            _PROCESS_CACHE.pop(pid, None)
         return None
+
+    new_info = ProcessInfo(pid=pid, name=name, path=path, timestamp=now, start_time=start_time)
+    with _CACHE_LOCK:
+        _LOOKUP_SECONDS.observe(time.perf_counter() - started)
+        _PROCESS_CACHE[pid] = new_info
+        _PROCESS_CACHE.move_to_end(pid)
+        _NEGATIVE_CACHE.pop(key, None)
+        while len(_PROCESS_CACHE) > MAX_PROCESS_CACHE:
+            _PROCESS_CACHE.popitem(last=False)
+            _CACHE_STATS["evictions"] += 1
+    return new_info
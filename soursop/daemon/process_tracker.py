@@ -1,173 +1,169 @@
 import logging
-from collections import defaultdict
-from datetime import datetime
-from threading import Thread
 from time import sleep
 
-from scapy.layers.inet import IP, TCP, UDP
-from scapy.layers.inet6 import IPv6
-from scapy.sendrecv import sniff
-
-import soursop.db.process_repository as repository
-from soursop import util
-from soursop.batch_deque import BatchDeque
-from soursop.beans import ProcessInfo, ProcessUsage
+import soursop.db.writer as writer
+from soursop import config, metrics, util
+from soursop.beans import ProcessUsage
+from soursop.daemon import capture_workers, packet_capture, packet_ring, process_cache, query_server
+from soursop.daemon.connection_resolver import ConnectionResolver
+from soursop.daemon.packet_sampler import PacketSampler
 from soursop.daemon.process_cache import get_process_info
-from soursop.daemon.utility_monitor import get_wifi_ips, get_connection_pid
+from soursop.daemon.scheduler import Scheduler
+from soursop.daemon.utility_monitor import get_wifi_ips, get_connection_pid, resolve_connection
+from soursop.usage_accumulator import UsageAccumulator
+from soursop.usage_journal import UsageJournal
 
-# thread safe queue to temporarily hold process_usage entries
-_USAGE_QUEUE = BatchDeque()
+# thread safe per-(pid, name, hour) counters, swapped out on every database writer tick
+_USAGE_ACCUMULATOR = UsageAccumulator(request_flush=writer.request_flush)
+_REPORTED_DROPPED_PACKETS = 0
+# packets handed to account_packet, of other hosts, and not found in the connection table, only the capture
+# thread adds to them. The packets found in the table follow from these, so a packet costs a single increment
+_CAPTURE_STATS = {"packets": 0, "foreign_packets": 0, "connection_misses": 0}
+# optional 1-in-N sampling of the packets, in front of the connection and process lookups
+_SAMPLER: PacketSampler | None = None
+if config.SAMPLING_MODE in ("count", "flow"):
+    _SAMPLER = PacketSampler(config.SAMPLING_MODE, config.SAMPLE_RATE, config.MAX_SAMPLE_RATE,
+                             config.SAMPLING_PACKET_BUDGET, config.SAMPLING_CPU_BUDGET)
 
 
-def get_packet_connection(packet) -> tuple | None:
-    try:
-        if IP in packet:
-            ip_packet = packet[IP]
-            src_ip, dst_ip = ip_packet.src, ip_packet.dst
-        elif IPv6 in packet:
-            ipv6_packet = packet[IPv6]
-            src_ip, dst_ip = ipv6_packet.src, ipv6_packet.dst
-        else:
-            return None
-
-        if TCP in packet:
-            tcp_packet = packet[TCP]
-            src_port, dst_port = tcp_packet.sport, tcp_packet.dport
-        elif UDP in packet:
-            udp_packet = packet[UDP]
-            src_port, dst_port = udp_packet.sport, udp_packet.dport
-        else:
-            return None
+def credit_usage(pid: int, incoming_bytes: int, outgoing_bytes: int, packet_count: int, sample_rate: int = 1) -> None:
+    process_info = get_process_info(pid)
+    if process_info:
+        _USAGE_ACCUMULATOR.add(process_info, incoming_bytes, outgoing_bytes, packet_count, sample_rate)
 
-        return src_port, dst_port, src_ip, dst_ip
-    except (AttributeError, IndexError):
-        return None
 
+# holds packets of connections opened after the last connection refresh until their owner is found
+_CONNECTION_RESOLVER = ConnectionResolver(resolve=resolve_connection, credit=credit_usage)
 
-def process_packet(packet) -> None:
+
+def account_packet(protocol: int, src_port: int, dst_port: int, src_ip: str, dst_ip: str,
+                   length: int, packet_count: int = 1) -> None:
     """
-    find destination and source ports of each packet to determine which connection this packet belongs
-    and update the CONNECTION_PID_MAP
+    use the addresses and ports of each packet to determine which connection this packet belongs
+    and add its length to the owning process counters. Capture workers pass whole per-flow deltas here.
     """
-    global _USAGE_QUEUE
+    _CAPTURE_STATS["packets"] += packet_count
     wifi_ip_set = get_wifi_ips()
-    packet_connection_info = get_packet_connection(packet)
-
-    if packet_connection_info:
-        src_port, dst_port, src_ip, dst_ip = packet_connection_info
-        packet_pid = get_connection_pid((src_port, dst_port))
-
-        if packet_pid:
-            process_info = get_process_info(packet_pid)
-            if process_info:
-                usage = get_process_usage(process_info)
-                if src_ip and src_ip in wifi_ip_set:
-                    usage.outgoing_bytes = len(packet)  # outgoing/upload
-                elif dst_ip and dst_ip in wifi_ip_set:
-                    usage.incoming_bytes = len(packet)  # incoming/download
-                else:
-                    return
-                _USAGE_QUEUE.put(usage)
-
+    if src_ip in wifi_ip_set:
+        incoming_bytes, outgoing_bytes = 0, length  # outgoing/upload
+        connection = (protocol, src_ip, src_port, dst_ip, dst_port)
+    elif dst_ip in wifi_ip_set:
+        incoming_bytes, outgoing_bytes = length, 0  # incoming/download
+        connection = (protocol, dst_ip, dst_port, src_ip, src_port)
+    else:
+        _CAPTURE_STATS["foreign_packets"] += packet_count
+        return
+
+    sample_rate = 1
+    if _SAMPLER is not None:
+        kept, sample_rate = _SAMPLER.sample(connection, packet_count)
+        if not kept:
+            return
+        # the kept packets of a per-flow delta carry their share of its bytes, and stand for sample_rate packets each
+        incoming_bytes = incoming_bytes * kept // packet_count * sample_rate
+        outgoing_bytes = outgoing_bytes * kept // packet_count * sample_rate
+        packet_count = kept * sample_rate
+
+    packet_pid = get_connection_pid(connection)
+    if packet_pid:
+        credit_usage(packet_pid, incoming_bytes, outgoing_bytes, packet_count, sample_rate)
+    else:
+        _CAPTURE_STATS["connection_misses"] += packet_count // sample_rate
+        _CONNECTION_RESOLVER.defer(connection, incoming_bytes, outgoing_bytes, packet_count, sample_rate)
+
+
+def run_capture() -> None:
+    if config.CAPTURE_WORKERS > 1:
+        if config.CAPTURE_MODE == "scapy":
+            logging.error("Capture workers need the socket or ring capture mode, capturing on a single thread")
+        else:
+            capture_workers.capture_with_workers(account_packet, config.CAPTURE_WORKERS, config.CAPTURE_MODE)
+            return
 
-def handle_proces_packet(packet) -> None:
-    try:
-        process_packet(packet)
-    except Exception as e:
-        logging.error(f"Error occurred while handling process_packet", e)
+    if config.CAPTURE_MODE == "ring":
+        try:
+            packet_ring.capture_packets(account_packet)
+            return
+        except OSError as e:
+            logging.error(f"Memory mapped packet capture is not available ({e}), falling back to the packet socket")
 
+    if config.CAPTURE_MODE != "scapy":
+        try:
+            packet_capture.capture_packets(account_packet)
+            return
+        except OSError as e:
+            logging.error(f"Raw packet capture is not available ({e}), falling back to scapy")
 
-def get_process_usage(process_info: ProcessInfo) -> ProcessUsage:
-    now = datetime.now()
-    date_str = now.strftime(util.DB_DATE_FORMAT)
-    return ProcessUsage(pid=process_info.pid, name=process_info.name, path=process_info.path,
-                        date_str=date_str, hour=now.hour, network=None, packet_count=1)
+    from soursop.daemon import scapy_capture  # imported lazily, scapy is only needed as a fallback
+    scapy_capture.capture_packets(account_packet)
 
 
 def sniff_packets() -> None:
     logging.info("started sniffing thread")
     while util.RUNNING_FLAG:
         try:
-            sniff(prn=process_packet, store=False, filter="(ip or ip6) and (tcp or udp)",
-                  stop_filter=lambda _: not util.RUNNING_FLAG)
+            run_capture()
         except Exception as e:
-            logging.error(f"Error occurred while sniffing", e)
+            logging.error(f"Error occurred while sniffing: {e}")
             sleep(util.FIVE_SECONDS)
     logging.info("Stopped sniffing thread")
 
 
-def group_by_pid_name(entries: list[ProcessUsage]) -> list[list[ProcessUsage]]:
-    groups = defaultdict(list)
-    for entry in entries:
-        key = f"{entry.pid}_{entry.name}"
-        groups[key].append(entry)
-    return list(groups.values())
-
-
-def cumulate_by_time(entries: list[ProcessUsage]) -> list[ProcessUsage]:
-    cumulated_map = {}
-    for entry in entries:
-        key = f"{entry.date_str}_{entry.hour}"
-        if key in cumulated_map:
-            existing = cumulated_map[key]
-            existing.incoming_bytes += entry.incoming_bytes
-            existing.outgoing_bytes += entry.outgoing_bytes
-            existing.packet_count += entry.packet_count
-        else:
-            cumulated_map[key] = entry
-    return list(cumulated_map.values())
-
-
-def merge_entries(old_entries: list[ProcessUsage],
-                  new_entries: list[ProcessUsage]) -> list[ProcessUsage]:
-    result = {f"{e.date_str}_{e.hour}": e for e in old_entries}
-    for new in new_entries:
-        key = f"{new.date_str}_{new.hour}"
-        if key in result:
-            old = result[key]
-            old.incoming_bytes += new.incoming_bytes
-            old.outgoing_bytes += new.outgoing_bytes
-            old.packet_count += new.packet_count
-        else:
-            result[key] = new
-    return list(result.values())
-
-
-def handle_entries(all_entries: list[ProcessUsage]) -> None:
-    pid_name_group_list = group_by_pid_name(all_entries)
-    for pid_name_group in pid_name_group_list:
-        if pid_name_group:
-            first_e = pid_name_group[0]
-            old_db_entries = repository.get_by_pid_name(first_e.pid, first_e.name)
-
-            time_cumulated_entries = cumulate_by_time(pid_name_group)
-            merged_entries = merge_entries(old_db_entries, time_cumulated_entries)
-            repository.update(merged_entries)
+def handle_entries(entries: list[ProcessUsage]) -> None:
+    # the accumulator already holds one entry per (pid, name, hour), only the deltas are written
+    writer.submit_process_usages(entries)
 
 
 def drain_and_handle_entries() -> None:
-    usage_entries = _USAGE_QUEUE.drain()
+    global _REPORTED_DROPPED_PACKETS
+    usage_entries = _USAGE_ACCUMULATOR.drain()
+    dropped_packets = _USAGE_ACCUMULATOR.dropped_packets
+    if dropped_packets != _REPORTED_DROPPED_PACKETS:
+        logging.warning(f"Usage accumulator was full, dropped {dropped_packets - _REPORTED_DROPPED_PACKETS} packets "
+                        f"since last flush ({_USAGE_ACCUMULATOR.dropped_bytes} bytes dropped in total)")
+        _REPORTED_DROPPED_PACKETS = dropped_packets
     handle_entries(usage_entries)
 
 
-def save_process_usages() -> None:
-    logging.info("Started usage saving thread....")
-    while util.RUNNING_FLAG:
-        try:
-            drain_and_handle_entries()
-            sleep(util.FIFTEEN_SECONDS)
-        except Exception as e:
-            logging.error(f"Error occurred while handling save_process_usages", e)
-    logging.info("Stopped usage saving thread.....")
-
-
-def start_process_tracking():
-    sniff_thread = Thread(target=sniff_packets, daemon=False)
-    sniff_thread.start()
-
-    save_usage_thread = Thread(target=save_process_usages, daemon=False)
-    save_usage_thread.start()
-
-# TODO list
-# make sure this shutdown gracefully, when daemon is shutting down
-# think about the usage frequency, may be calculation frequency is good enough, saving frequency can be slower
+def get_live_usages() -> list[ProcessUsage]:
+    """Usage deltas that are not in the database yet: the accumulator and the writes waiting for the writer."""
+    return _USAGE_ACCUMULATOR.peek() + writer.get_pending()[1]
+
+
+def get_stats() -> dict:
+    """Metrics of the capture and attribution stages, and of the connection table and process cache lookups."""
+    kernel_packets, kernel_drops = packet_capture.get_kernel_statistics()
+    looked_up = _CAPTURE_STATS["packets"] - _CAPTURE_STATS["foreign_packets"]
+    if _SAMPLER is not None:
+        looked_up = _SAMPLER.sampled_packets
+    stats = {
+        "capture_packets_total": _CAPTURE_STATS["packets"],
+        "capture_foreign_packets_total": _CAPTURE_STATS["foreign_packets"],
+        "capture_kernel_packets_total": kernel_packets,
+        "capture_kernel_drops_total": kernel_drops,
+        "cache_connection_hits_total": looked_up - _CAPTURE_STATS["connection_misses"],
+        "cache_connection_misses_total": _CAPTURE_STATS["connection_misses"],
+        **_CONNECTION_RESOLVER.get_stats(),
+        **_USAGE_ACCUMULATOR.get_stats(),
+        **process_cache.get_stats(),
+    }
+    if config.CAPTURE_MODE == "ring":
+        stats.update(packet_ring.get_stats())
+    if _SAMPLER is not None:
+        stats.update(_SAMPLER.get_stats())
+    return stats
+
+
+def start_process_tracking(scheduler: Scheduler, journal: UsageJournal | None = None):
+    if journal is not None:
+        _USAGE_ACCUMULATOR.attach_journal(journal)
+        writer.register_commit_hook(journal.release_sealed)
+    writer.register_flush_hook(drain_and_handle_entries)
+    metrics.register_source(get_stats)
+    query_server.register_live_source("process", get_live_usages)
+    # the capture blocks on the packet socket, so it runs as a service in the scheduler's executor
+    scheduler.add_service("capture", sniff_packets)
+    scheduler.add_service("connection_resolver", _CONNECTION_RESOLVER.run)
+    if _SAMPLER is not None:
+        logging.info(f"Sampling packets in {_SAMPLER.mode} mode, starting at 1 in {_SAMPLER.rate}")
+        scheduler.add_job("sampling", config.SAMPLING_INTERVAL, _SAMPLER.adjust)
@@ -0,0 +1,263 @@
+import logging
+import os
+import socket
+import sqlite3
+import time
+from collections import OrderedDict
+from datetime import date, datetime, timedelta
+from threading import Lock
+from typing import Callable, Optional
+
+import soursop.db.network_repository as network_repository
+import soursop.db.process_repository as process_repository
+import soursop.db.writer as writer
+from soursop import config, metrics, query_api, util
+from soursop.beans import Level, NetworkUsage, ProcessUsage
+from soursop.daemon.scheduler import Scheduler
+from soursop.db import retention
+from soursop.db.connection import get_read_connection
+
+_ACCEPT_TIMEOUT = 1  # wake up every second to check the running flag
+_CLIENT_TIMEOUT = 5
+_MAX_CACHED_RESULTS = 64
+
+# (command, level, from_date, to_date, filter) -> response rows of a range of closed periods, in least recently
+# used order. Nothing is written to dates before the oldest live usage any more, so only retention changes them;
+# it clears the cache and bumps the generation, so results read before that are not stored
+_CACHE: OrderedDict[tuple, list] = OrderedDict()
+_CACHE_LOCK = Lock()
+_CACHE_GENERATION = 0
+
+# requests, failed requests and requests answered from the cache, only the server thread changes them
+_QUERY_STATS = {"requests": 0, "errors": 0, "cache_hits": 0}
+_QUERY_SECONDS = metrics.Histogram()
+# read connection of the server thread
+_CONNECTION: sqlite3.Connection | None = None
+# command -> usage the daemon holds that is not in the database yet, registered by the trackers
+_LIVE_SOURCES: dict[str, Callable[[], list]] = {}
+
+
+def register_live_source(command: str, source: Callable[[], list]) -> None:
+    _LIVE_SOURCES[command] = source
+
+
+def clear_cache() -> None:
+    global _CACHE_GENERATION
+    with _CACHE_LOCK:
+        _CACHE.clear()
+        _CACHE_GENERATION += 1
+
+
+def get_stats() -> dict:
+    return {
+        "query_requests_total": _QUERY_STATS["requests"],
+        "query_errors_total": _QUERY_STATS["errors"],
+        "query_cache_hits_total": _QUERY_STATS["cache_hits"],
+        "query_cached_results": len(_CACHE),
+        "query_seconds": _QUERY_SECONDS,
+    }
+
+
+def period_key(date_str: str, hour: int, level: Level) -> tuple[str, int]:
+    """(date_str, hour) of the row of the level period holding an hour, as the aggregate queries return it."""
+    if level == Level.HOUR:
+        return date_str, hour
+    day = datetime.strptime(date_str, util.DB_DATE_FORMAT).date()
+    return util.period_start(day, level).strftime(util.DB_DATE_FORMAT), 0
+
+
+def _in_range(usage, from_date: date, to_date: date, value: str, filter_value: Optional[str]) -> bool:
+    """Same selection as the queries: the date range and a case insensitive substring like LIKE '%filter%'."""
+    if not from_date.isoformat() <= usage.date_str <= to_date.isoformat():
+        return False
+    return not filter_value or filter_value.lower() in value.lower()
+
+
+def merge_process_usages(entries: list[ProcessUsage], live: list[ProcessUsage], level: Level,
+                         from_date: date, to_date: date, name: Optional[str]) -> list[ProcessUsage]:
+    """Add the live usage deltas to the stored totals of their periods."""
+    merged = {(e.date_str, e.hour, e.name, e.path): e for e in entries}
+    for usage in live:
+        if not _in_range(usage, from_date, to_date, usage.name, name):
+            continue
+        date_str, hour = period_key(usage.date_str, usage.hour, level)
+        key = (date_str, hour, usage.name, usage.path or "")
+        entry = merged.get(key)
+        if entry is None:
+            entry = merged[key] = ProcessUsage(pid=0, name=usage.name, path=usage.path or "", date_str=date_str,
+                                               hour=hour, incoming_bytes=0, outgoing_bytes=0)
+        entry.incoming_bytes += usage.incoming_bytes
+        entry.outgoing_bytes += usage.outgoing_bytes
+        entry.sample_rate = max(entry.sample_rate or 1, usage.sample_rate or 1)
+        entry.byte_variance = (entry.byte_variance or 0.0) + (usage.byte_variance or 0.0)
+    return sorted(merged.values(), key=lambda e: (e.date_str, e.hour, e.name, e.path))
+
+
+def merge_network_usages(conn: sqlite3.Connection, entries: list[NetworkUsage], live: list[NetworkUsage],
+                         level: Level, from_date: date, to_date: date,
+                         network: Optional[str]) -> list[NetworkUsage]:
+    """
+    Network rows hold hour totals, so a live total replaces the stored total of its hour: the difference is added
+    to the period. The stored hour totals are read on conn, in the same snapshot as the entries.
+    """
+    latest: dict[tuple[int, str], NetworkUsage] = {}
+    for usage in live:
+        if not _in_range(usage, from_date, to_date, usage.network, network):
+            continue
+        key = (usage.bucket, usage.network)
+        previous = latest.get(key)
+        if previous is None or usage.incoming_bytes + usage.outgoing_bytes > \
+                previous.incoming_bytes + previous.outgoing_bytes:
+            latest[key] = usage
+
+    stored = network_repository.get_hour_totals(conn, {bucket for bucket, _ in latest})
+    merged = {(e.date_str, e.hour, e.network): e for e in entries}
+    for key, usage in latest.items():
+        stored_incoming, stored_outgoing = stored.get(key, (0, 0))
+        incoming = max(usage.incoming_bytes - stored_incoming, 0)
+        outgoing = max(usage.outgoing_bytes - stored_outgoing, 0)
+        if not incoming and not outgoing:
+            continue
+        date_str, hour = period_key(usage.date_str, usage.hour, level)
+        entry = merged.get((date_str, hour, usage.network))
+        if entry is None:
+            entry = merged[(date_str, hour, usage.network)] = NetworkUsage(
+                network=usage.network, date_str=date_str, hour=hour, incoming_bytes=0, outgoing_bytes=0)
+        entry.incoming_bytes += incoming
+        entry.outgoing_bytes += outgoing
+    return sorted(merged.values(), key=lambda e: (e.date_str, e.hour, e.network))
+
+
+def _query_rows(conn: sqlite3.Connection, command: str, level: Level, from_date: date, to_date: date,
+                filter_value: Optional[str], live: list) -> list[list]:
+    if command == "network":
+        entries = network_repository.aggregate(level, from_date, to_date, filter_value, conn)
+        entries = merge_network_usages(conn, entries, live, level, from_date, to_date, filter_value)
+        return [query_api.network_row(entry) for entry in entries]
+    entries = process_repository.aggregate(level, from_date, to_date, filter_value, conn)
+    entries = merge_process_usages(entries, live, level, from_date, to_date, filter_value)
+    return [query_api.process_row(entry) for entry in entries]
+
+
+def _closed_boundary(live: list, level: Level) -> date:
+    """Start of the oldest period that can still change: the one holding today or the oldest live usage."""
+    oldest = date.today()
+    for usage in live:
+        oldest = min(oldest, datetime.strptime(usage.date_str, util.DB_DATE_FORMAT).date())
+    return util.period_start(oldest, level)
+
+
+def _get_connection() -> sqlite3.Connection:
+    global _CONNECTION
+    if _CONNECTION is None:
+        _CONNECTION = get_read_connection()
+    return _CONNECTION
+
+
+def run_query(command: str, level: Level, from_date: date, to_date: date, filter_value: Optional[str]) -> list[list]:
+    """
+    Stored totals merged with the usage the daemon still holds. The read transaction starts while no flush can
+    run, so every byte is either in its snapshot or in the live usage taken next to it, never in both. The writer
+    only waits for that, not for the queries. Closed periods come from the cache when they were asked for before.
+    """
+    conn = _get_connection()
+    generation = _CACHE_GENERATION
+    live_usages = _LIVE_SOURCES.get(command, list)
+    with writer.hold_flushes():
+        conn.execute("BEGIN")
+        conn.execute("SELECT 1 FROM sqlite_master LIMIT 1").fetchall()  # the WAL snapshot starts at the first read
+        live = live_usages()
+    try:
+        boundary = _closed_boundary(live, level)
+        rows = []
+        if from_date < boundary:
+            closed_to = min(to_date, boundary - timedelta(days=1))
+            key = (command, level, from_date, closed_to, filter_value)
+            with _CACHE_LOCK:
+                cached = _CACHE.get(key)
+                if cached is not None:
+                    _CACHE.move_to_end(key)
+            if cached is None:
+                cached = _query_rows(conn, command, level, from_date, closed_to, filter_value, [])
+                with _CACHE_LOCK:
+                    if generation == _CACHE_GENERATION:
+                        _CACHE[key] = cached
+                        while len(_CACHE) > _MAX_CACHED_RESULTS:
+                            _CACHE.popitem(last=False)
+            else:
+                _QUERY_STATS["cache_hits"] += 1
+            rows += cached
+        if to_date >= boundary:
+            rows += _query_rows(conn, command, level, max(from_date, boundary), to_date, filter_value, live)
+    finally:
+        conn.rollback()
+    return rows
+
+
+def _read_request(client: socket.socket) -> bytes:
+    data = b""
+    while not data.endswith(b"\n"):
+        chunk = client.recv(query_api.MAX_REQUEST_SIZE)
+        if not chunk:
+            break
+        data += chunk
+        if len(data) > query_api.MAX_REQUEST_SIZE:
+            raise ValueError("request too large")
+    return data
+
+
+def handle_client(client: socket.socket) -> None:
+    started = time.perf_counter()
+    _QUERY_STATS["requests"] += 1
+    try:
+        response = {"rows": run_query(*query_api.decode_request(_read_request(client)))}
+    except (ValueError, KeyError, TypeError) as e:
+        _QUERY_STATS["errors"] += 1
+        response = {"error": f"Bad request: {e}"}
+    except sqlite3.Error as e:
+        _QUERY_STATS["errors"] += 1
+        logging.error(f"Query failed: {e}")
+        response = {"error": f"Query failed: {e}"}
+    client.sendall(query_api.encode_response(response))
+    _QUERY_SECONDS.observe(time.perf_counter() - started)
+
+
+def serve() -> None:
+    """Answer the queries of the CLI on a Unix socket, one at a time, until the daemon stops."""
+    global _CONNECTION
+    path = config.QUERY_SOCKET_PATH
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    if os.path.exists(path):
+        os.unlink(path)  # left behind by a daemon that did not stop cleanly
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as server:
+        server.bind(path)
+        os.chmod(path, 0o666)  # the CLI runs as any user, like the database file it may read instead
+        server.listen()
+        server.settimeout(_ACCEPT_TIMEOUT)
+        logging.info(f"Started query server on {path}")
+        try:
+            while util.RUNNING_FLAG:
+                try:
+                    client, _ = server.accept()
+                except socket.timeout:
+                    continue
+                with client:
+                    client.settimeout(_CLIENT_TIMEOUT)
+                    try:
+                        handle_client(client)
+                    except OSError as e:
+                        logging.debug(f"Query client went away: {e}")
+        finally:
+            os.unlink(path)
+            if _CONNECTION is not None:
+                _CONNECTION.close()
+                _CONNECTION = None
+    logging.info("Stopped query server")
+
+
+def start_query_server(scheduler: Scheduler) -> None:
+    if not config.QUERY_SOCKET_PATH:
+        return
+    retention.register_delete_hook(clear_cache)
+    metrics.register_source(get_stats)
+    scheduler.add_service("query_server", serve)
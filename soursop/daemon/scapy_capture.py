@@ -0,0 +1,52 @@
+from typing import Callable
+
+from scapy.layers.inet import IP, TCP, UDP
+from scapy.layers.inet6 import IPv6
+from scapy.sendrecv import sniff
+
+from soursop import util
+from soursop.daemon.packet_parser import IPPROTO_TCP, IPPROTO_UDP
+
+
+def get_packet_connection(packet) -> tuple | None:
+    try:
+        if IP in packet:
+            ip_packet = packet[IP]
+            src_ip, dst_ip = ip_packet.src, ip_packet.dst
+        elif IPv6 in packet:
+            ipv6_packet = packet[IPv6]
+            src_ip, dst_ip = ipv6_packet.src, ipv6_packet.dst
+        else:
+            return None
+
+        if TCP in packet:
+            tcp_packet = packet[TCP]
+            protocol, src_port, dst_port = IPPROTO_TCP, tcp_packet.sport, tcp_packet.dport
+        elif UDP in packet:
+            udp_packet = packet[UDP]
+            protocol, src_port, dst_port = IPPROTO_UDP, udp_packet.sport, udp_packet.dport
+        else:
+            return None
+
+        return protocol, src_port, dst_port, src_ip, dst_ip
+    except (AttributeError, IndexError):
+        return None
+
+
+def get_ip_length(packet) -> int:
+    """Length from the IP header like the raw captures, the captured length for offloaded super-frames."""
+    if IP in packet:
+        return packet[IP].len or len(packet[IP])
+    payload_length = packet[IPv6].plen
+    return payload_length + 40 if payload_length else len(packet[IPv6])
+
+
+def capture_packets(handler: Callable[[int, int, int, str, str, int], None]) -> None:
+    """Fallback capture that lets scapy dissect every packet, feeding the same handler as the raw socket capture."""
+    def process_packet(packet) -> None:
+        connection = get_packet_connection(packet)
+        if connection:
+            handler(*connection, get_ip_length(packet))
+
+    sniff(prn=process_packet, store=False, filter="(ip or ip6) and (tcp or udp)",
+          stop_filter=lambda _: not util.RUNNING_FLAG)
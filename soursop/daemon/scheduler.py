@@ -0,0 +1,104 @@
+import asyncio
+import logging
+import signal
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
+
+from soursop import util
+
+_SERVICE_STOP_TIMEOUT = 10
+
+
+class Scheduler:
+    """
+    Runs every periodic job of the daemon on one asyncio loop. Ticks are taken from the wall clock modulo the
+    interval, so an interval dividing an hour always ticks on the hour, while the waits run on the loop's
+    monotonic clock. Blocking jobs and long-running services (packet capture) run in the executor.
+    On SIGTERM or SIGINT the services and jobs are stopped and the shutdown hooks run in reverse order of
+    registration, so producers hand over their data before the final database write.
+    """
+
+    def __init__(self) -> None:
+        # name -> (interval, job, blocking)
+        self._jobs: dict[str, tuple[float, Callable[[], None], bool]] = {}
+        self._services: list[tuple[str, Callable[[], None]]] = []
+        self._shutdown_hooks: list[Callable[[], None]] = []
+        self._wakeups: dict[str, asyncio.Event] = {}
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._executor: ThreadPoolExecutor | None = None
+
+    def add_job(self, name: str, interval: float, job: Callable[[], None], blocking: bool = False) -> None:
+        self._jobs[name] = (interval, job, blocking)
+
+    def add_service(self, name: str, service: Callable[[], None]) -> None:
+        """A blocking function that runs until util.RUNNING_FLAG is cleared."""
+        self._services.append((name, service))
+
+    def add_shutdown_hook(self, hook: Callable[[], None]) -> None:
+        self._shutdown_hooks.append(hook)
+
+    def wake(self, name: str) -> None:
+        """Run a job ahead of its next tick, can be called from any thread."""
+        wakeup = self._wakeups.get(name)
+        if self._loop is not None and wakeup is not None and not wakeup.is_set():
+            self._loop.call_soon_threadsafe(wakeup.set)
+
+    async def _run_job(self, name: str, interval: float, job: Callable[[], None], blocking: bool) -> None:
+        wakeup = self._wakeups[name]
+        while util.RUNNING_FLAG:
+            try:
+                await asyncio.wait_for(wakeup.wait(), interval - time.time() % interval)
+            except asyncio.TimeoutError:
+                pass
+            wakeup.clear()
+            if not util.RUNNING_FLAG:
+                break
+            try:
+                if blocking:
+                    await self._loop.run_in_executor(self._executor, job)
+                else:
+                    job()
+            except Exception as e:
+                logging.error(f"Error occurred in scheduled job {name}: {e}")
+
+    def _run_service(self, name: str, service: Callable[[], None]) -> None:
+        try:
+            service()
+        except Exception as e:
+            logging.error(f"Service {name} stopped with an error: {e}")
+
+    async def run(self) -> None:
+        self._loop = asyncio.get_running_loop()
+        # one thread per service and per blocking job, so a long retention run does not hold up the writer
+        blocking_jobs = sum(1 for _, _, blocking in self._jobs.values() if blocking)
+        self._executor = ThreadPoolExecutor(max_workers=len(self._services) + max(1, blocking_jobs),
+                                            thread_name_prefix="soursop")
+        stop = asyncio.Event()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            self._loop.add_signal_handler(sig, stop.set)
+
+        services = [self._loop.run_in_executor(self._executor, self._run_service, name, service)
+                    for name, service in self._services]
+        self._wakeups = {name: asyncio.Event() for name in self._jobs}
+        jobs = [asyncio.create_task(self._run_job(name, *job)) for name, job in self._jobs.items()]
+        logging.info(f"Scheduler started {len(jobs)} jobs and {len(services)} services.")
+
+        await stop.wait()
+        logging.info("Shutting down gracefully...")
+        util.RUNNING_FLAG = False
+        for wakeup in self._wakeups.values():
+            wakeup.set()
+        await asyncio.gather(*jobs)
+        if services:
+            _, still_running = await asyncio.wait(services, timeout=_SERVICE_STOP_TIMEOUT)
+            if still_running:
+                logging.warning(f"{len(still_running)} services did not stop in time, shutting down without them")
+
+        for hook in reversed(self._shutdown_hooks):
+            try:
+                hook()
+            except Exception as e:
+                logging.error(f"Error occurred during shutdown: {e}")
+        self._executor.shutdown(wait=False)
+        logging.info("Shutdown complete.")
@@ -1,29 +1,63 @@
 import logging
 import socket
-from threading import Thread, Lock
-from time import sleep
+import time
 
 import psutil
 
-from soursop import util
+from soursop import config, metrics
+from soursop.daemon import capture_filter
+from soursop.daemon.connection_index import ConnectionIndex
+from soursop.daemon.connection_table import ConnectionTable
+from soursop.daemon.scheduler import Scheduler
+from soursop.daemon.sock_diag import SockDiag
 
-# list of ipv4 and ipv6 addresses of Wi-Fi adapter
-_WIFI_IPS: set[str] = set()
-_WIFI_IPS_LOCK = Lock()
+# ipv4 and ipv6 addresses of Wi-Fi adapter, an immutable set that is replaced as a whole
+_WIFI_IPS: frozenset[str] = frozenset()
 
-# dictionary to map each connection to its corresponding process ID (PID)
-_CONNECTION_PID_MAP: dict[tuple[int, int], int] = {}
-_CONNECTION_LOCK = Lock()
+# maps each connection to its corresponding process ID (PID), read without locks
+_CONNECTION_TABLE = ConnectionTable()
+_CONNECTION_INDEX = ConnectionIndex()
+_SOCK_DIAG: SockDiag | None = None
+# time of the connection table refreshes, only observed by the scheduler loop
+_REFRESH_SECONDS = metrics.Histogram()
 
 
-def get_wifi_ips() -> set[str]:
-    with _WIFI_IPS_LOCK:
-        return _WIFI_IPS.copy()
+def get_wifi_ips() -> frozenset[str]:
+    return _WIFI_IPS
 
 
-def get_connection_pid(connection: tuple[int, int]) -> int:
-    with _CONNECTION_LOCK:
-        return _CONNECTION_PID_MAP.get(connection)
+def get_connection_pid(connection: tuple[int, str, int, str, int]) -> int | None:
+    return _CONNECTION_TABLE.lookup(connection)
+
+
+def resolve_connection(protocol: int, local_ip: str, local_port: int, remote_ip: str, remote_port: int) -> int | None:
+    """Look up the owner of a single connection that is not in the table yet, and add it to the table."""
+    global _SOCK_DIAG
+    if _SOCK_DIAG is None:
+        _SOCK_DIAG = SockDiag()
+    inode = _SOCK_DIAG.find_socket_inode(protocol, local_ip, local_port, remote_ip, remote_port)
+    if not inode:
+        return None
+    pid = _CONNECTION_INDEX.find_owner(inode)
+    if pid:
+        _CONNECTION_TABLE.add_resolved((protocol, local_ip, local_port, remote_ip, remote_port), pid)
+    return pid
+
+
+def get_connection_index_stats() -> dict[str, float]:
+    return _CONNECTION_INDEX.get_stats()
+
+
+def get_stats() -> dict:
+    index_stats = _CONNECTION_INDEX.get_stats()
+    return {
+        "cache_connection_entries": len(_CONNECTION_TABLE),
+        "cache_connection_evictions_total": _CONNECTION_TABLE.evicted,
+        "cache_connection_indexed_sockets": index_stats["indexed_sockets"],
+        "cache_connection_refresh_age_seconds": index_stats["refresh_age"],
+        "cache_connection_refresh_seconds": _REFRESH_SECONDS,
+        "capture_local_addresses": len(_WIFI_IPS),
+    }
 
 
 def derive_wifi_ips() -> set[str]:
@@ -45,37 +79,32 @@ def derive_wifi_ips() -> set[str]:
 
 def update_wifi_address() -> None:
     global _WIFI_IPS
-    logging.info("Started wifi IP address updating thread...")
-    last_ips = set()
-    while util.RUNNING_FLAG:
-        new_wifi_ips = derive_wifi_ips()
-        if new_wifi_ips and new_wifi_ips != last_ips:
-            with _WIFI_IPS_LOCK:
-                _WIFI_IPS = new_wifi_ips
-                last_ips = new_wifi_ips
-            logging.info(f"Wifi address updated: {new_wifi_ips}")
-        sleep(util.ONE_MINUTE)
-
-
-def update_connections() -> None:  # is port-port connection is enough ??????
+    new_wifi_ips = derive_wifi_ips()
+    if new_wifi_ips and new_wifi_ips != _WIFI_IPS:
+        _WIFI_IPS = frozenset(new_wifi_ips)
+        logging.info(f"Wifi address updated: {new_wifi_ips}")
+        # the kernel drops packets of other addresses before they are copied to the capture
+        capture_filter.set_addresses(_WIFI_IPS)
+
+
+def update_connections() -> None:
     """
-    Keeps listening for connections IP on this machine, and add them to global CONNECTION_PID_MAP
-    (local_address.port, remove_address.port) -> pid
+    Re-reads the connections on this machine, and publishes them in the global connection table
+    (protocol, local_address, local_port, remote_address, remote_port) -> pid
     """
-    logging.info("Started connections updating thread...")
-    global _CONNECTION_PID_MAP
-    while util.RUNNING_FLAG:
-        for c in psutil.net_connections(kind='inet'):
-            if c.laddr and c.raddr and c.pid:
-                with _CONNECTION_LOCK:
-                    _CONNECTION_PID_MAP[(c.laddr.port, c.raddr.port)] = c.pid
-                    _CONNECTION_PID_MAP[(c.raddr.port, c.laddr.port)] = c.pid
-        sleep(util.FIFTEEN_SECONDS)
-
-
-def start_utility_monitor() -> None:
-    wifi_address_thread = Thread(target=update_wifi_address, daemon=True)
-    wifi_address_thread.start()
-
-    connection_thread = Thread(target=update_connections, daemon=True)
-    connection_thread.start()
+    started = time.perf_counter()
+    try:
+        _CONNECTION_TABLE.update(_CONNECTION_INDEX.refresh())
+    except OSError as e:
+        logging.error(f"Failed to refresh the connection index: {e}")
+    _REFRESH_SECONDS.observe(time.perf_counter() - started)
+
+
+def start_utility_monitor(scheduler: Scheduler) -> None:
+    # filled once up front, so the capture starts with known addresses and connections
+    update_wifi_address()
+    update_connections()
+    metrics.register_source(get_stats)
+    scheduler.add_job("wifi_address", config.WIFI_INTERVAL, update_wifi_address)
+    # a full scan walks the fds of every process in /proc, so it runs in the executor
+    scheduler.add_job("connections", config.CONNECTION_INTERVAL, update_connections, blocking=True)
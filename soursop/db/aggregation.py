@@ -0,0 +1,72 @@
+import sqlite3
+from datetime import date, timedelta
+from typing import Optional
+
+from soursop import util
+from soursop.beans import Level
+from soursop.db.migrations import ROLLUP_PERIODS
+
+# level -> first date of the period holding the local date {date}, the expressions the rollup triggers bucket with
+PERIOD_EXPRESSIONS = {Level(level): expression for level, expression in ROLLUP_PERIODS.items()}
+
+
+def build_rollup_query(table: str, key_columns: str, level: Level, from_date: date, to_date: date,
+                       filter_sql: Optional[str] = None, filter_params: tuple = (),
+                       extra_columns: tuple[tuple[str, str], ...] = ()) -> tuple[str, list]:
+    """
+    Rows (period start, hour 0, key columns, incoming_bytes, outgoing_bytes) with the totals of a day, week or
+    month level in chronological order, the same shape as the hourly aggregates. The whole periods of the range
+    are read from the rollup of the level, the partial ones at the edges from the day rollup. filter_sql is an
+    optional condition on the rollup rows, extra_columns are (column, aggregate function) pairs added at the end.
+    """
+    extra_select = "".join(f", {column}" for column, _ in extra_columns)
+    extra_aggregates = "".join(f", {function}({column}) AS {column}" for column, function in extra_columns)
+    parts = []
+    params = []
+    for rollup_level, start, end in util.split_by_rollup(from_date, to_date, level):
+        part = f"""
+            SELECT period, {key_columns}, incoming_bytes, outgoing_bytes{extra_select}
+            FROM {table}_{rollup_level.value} WHERE period BETWEEN ? AND ?
+        """
+        params += [start.isoformat(), end.isoformat()]
+        if filter_sql:
+            part += f" AND {filter_sql}"
+            params += filter_params
+        parts.append(part)
+
+    period = PERIOD_EXPRESSIONS[level].format(date="period")
+    sql = f"""
+        SELECT {period} AS period_start, 0 AS hour, {key_columns}, SUM(incoming_bytes) AS incoming_bytes,
+               SUM(outgoing_bytes) AS outgoing_bytes{extra_aggregates}
+        FROM ({" UNION ALL ".join(parts)})
+        GROUP BY period_start, {key_columns}
+        ORDER BY period_start, {key_columns}
+    """
+    return sql, params
+
+
+def get_retention_cut(conn: sqlite3.Connection, table: str, level: Level, from_date: date,
+                      to_date: date) -> Optional[date]:
+    """
+    Day rows older than the daily retention are deleted, while month rows are kept. A month report reads its partial
+    months at the edges from the day rows, so when the daily retention deleted some of those, its totals only start
+    at the oldest day row, which is returned then. None when every partial month is complete.
+    """
+    if level != Level.MONTH:
+        return None
+    oldest_day = conn.execute(f"SELECT MIN(period) FROM {table}_day").fetchone()[0]
+    if oldest_day is None:
+        return None
+    for rollup_level, start, _ in util.split_by_rollup(from_date, to_date, level):
+        if rollup_level != Level.DAY or start.isoformat() >= oldest_day:
+            continue
+        month_start = util.period_start(start, Level.MONTH)
+        month_end = util.next_period_start(start, Level.MONTH) - timedelta(days=1)
+        month_total, day_total = conn.execute(f"""
+            SELECT (SELECT COALESCE(SUM(incoming_bytes + outgoing_bytes), 0) FROM {table}_month WHERE period = ?),
+                   (SELECT COALESCE(SUM(incoming_bytes + outgoing_bytes), 0) FROM {table}_day
+                    WHERE period BETWEEN ? AND ?)
+        """, (month_start.isoformat(), month_start.isoformat(), month_end.isoformat())).fetchone()
+        if month_total != day_total:  # not just usage that started within the month
+            return date.fromisoformat(oldest_day)
+    return None
@@ -4,7 +4,12 @@ import sqlite3
 import sys
 from pathlib import Path
 
+from soursop.db import migrations
+
 DB_PATH = Path("/var/lib/soursop/soursop.db").expanduser()
+WRITER_CACHED_STATEMENTS = 64
+BUSY_TIMEOUT_MS = 5000
+READER_MMAP_SIZE = 256 * 1024 * 1024
 
 
 def create_db_file():
@@ -27,9 +32,43 @@ def get_connection():
     return sqlite3.connect(DB_PATH)
 
 
+def get_read_connection():
+    """
+    Read only connection for CLI queries. In WAL mode a reader without write access to the database directory
+    can only open the database while the daemon keeps the -wal/-shm files around, otherwise (daemon stopped,
+    everything checkpointed) the file is opened as immutable.
+    """
+    if not DB_PATH.exists():
+        logging.error(f"Error: Database file {DB_PATH} does not exist. "
+                      f"Has the daemon initialized the system?")
+        sys.exit(1)
+
+    try:
+        conn = sqlite3.connect(f"file:{DB_PATH}?mode=ro", uri=True)
+        conn.execute("SELECT 1 FROM sqlite_master LIMIT 1")
+    except sqlite3.OperationalError:
+        conn = sqlite3.connect(f"file:{DB_PATH}?immutable=1", uri=True)
+    conn.execute("PRAGMA query_only=ON")
+    conn.execute(f"PRAGMA mmap_size={READER_MMAP_SIZE}")  # range scans read the pages in place, without copies
+    return conn
+
+
+def open_writer_connection() -> sqlite3.Connection:
+    """
+    Long-lived connection of a daemon thread writing to the database, the usage writer or the retention thread.
+    Retention only writes in short batches, so a busy timeout is enough to let them take turns.
+    """
+    conn = sqlite3.connect(DB_PATH, check_same_thread=False, cached_statements=WRITER_CACHED_STATEMENTS)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")  # WAL stays consistent, a power loss can only lose the last commits
+    conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+    return conn
+
+
 def init_db():
     create_db_file()
     with get_connection() as conn:
+        conn.execute("PRAGMA journal_mode=WAL")  # persistent, CLI readers no longer block the daemon writer
         cur = conn.cursor()
         cur.execute("""
             CREATE TABLE IF NOT EXISTS network_usage (
@@ -55,6 +94,6 @@ def init_db():
                 packet_count INTEGER NOT NULL,
                 UNIQUE (date_str, hour, pid, name))
         """)
-        # include indexes as well, if needed
         conn.commit()
+        migrations.migrate(conn)
         logging.info("SQLite database initialization successful.")
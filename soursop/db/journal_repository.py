@@ -0,0 +1,15 @@
+import sqlite3
+
+
+def get_committed_sequence(conn: sqlite3.Connection, journal_id: int) -> int:
+    """Number of the last region of the journal whose usage is in the database, 0 for another journal."""
+    row = conn.execute("SELECT sequence FROM journal_commit WHERE id = 0 AND journal_id = ?", (journal_id,)).fetchone()
+    return row[0] if row else 0
+
+
+def mark_committed(conn: sqlite3.Connection, journal_id: int, sequence: int) -> None:
+    """Record the last committed region of the journal, the caller owns the transaction."""
+    conn.execute("""
+        INSERT INTO journal_commit (id, journal_id, sequence) VALUES (0, ?, ?)
+        ON CONFLICT (id) DO UPDATE SET journal_id = excluded.journal_id, sequence = excluded.sequence
+    """, (journal_id, sequence))
@@ -0,0 +1,361 @@
+import logging
+import sqlite3
+from typing import Callable
+
+_BATCH_SIZE = 5000
+_MAX_ID = 2 ** 63 - 1
+
+# local date and hour of a version 1 row -> epoch hour of the start of that local hour
+_BUCKET_FROM_DATE_HOUR = "CAST(strftime('%s', date_str || printf(' %02d:00:00', hour), 'utc') AS INTEGER) / 3600"
+
+# rollup level -> first date of the period holding a local date, weeks are ISO weeks starting on Monday
+ROLLUP_PERIODS = {
+    "day": "{date}",
+    "week": "date({date}, 'weekday 0', '-6 days')",
+    "month": "strftime('%Y-%m-01', {date})",
+}
+
+
+def get_schema_version(conn: sqlite3.Connection) -> int:
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def set_schema_version(conn: sqlite3.Connection, version: int) -> None:
+    conn.execute(f"PRAGMA user_version = {int(version)}")
+
+
+def copy_in_batches(conn: sqlite3.Connection, source: str, target: str, insert_select_sql: str) -> None:
+    """
+    Run insert_select_sql for consecutive id ranges of the source table, committing after every batch,
+    so readers are never locked out for long. Resumes from the highest id already copied to the target.
+    insert_select_sql gets the (exclusive lower, inclusive upper) id bounds as parameters.
+    """
+    last_id = conn.execute(f"SELECT COALESCE(MAX(id), 0) FROM {target}").fetchone()[0]
+    copied = 0
+    while True:
+        upper = conn.execute(f"SELECT id FROM {source} WHERE id > ? ORDER BY id LIMIT 1 OFFSET ?",
+                             (last_id, _BATCH_SIZE - 1)).fetchone()
+        upper_id = upper[0] if upper else _MAX_ID
+        conn.execute(insert_select_sql, (last_id, upper_id))
+        conn.commit()
+        copied += _BATCH_SIZE
+        if upper is None:
+            break
+        last_id = upper_id
+        if copied % (_BATCH_SIZE * 20) == 0:
+            logging.info(f"Migrating {source}: copied rows up to id {last_id}")
+
+
+def migrate_to_bucket_schema(conn: sqlite3.Connection) -> None:
+    """
+    Version 2: an integer epoch-hour bucket column keys both tables, with covering indexes for the CLI range
+    queries. SQLite cannot change a table's unique constraint, so the tables are rebuilt next to the old ones.
+    """
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS network_usage_v2 (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            bucket INTEGER NOT NULL,
+            date_str TEXT NOT NULL,
+            hour INTEGER NOT NULL,
+            network TEXT NOT NULL,
+            incoming_bytes INTEGER NOT NULL,
+            outgoing_bytes INTEGER NOT NULL,
+            UNIQUE (bucket, network))
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS process_usage_v2 (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            bucket INTEGER NOT NULL,
+            date_str TEXT NOT NULL,
+            hour INTEGER NOT NULL,
+            pid INTEGER NOT NULL,
+            name TEXT NOT NULL,
+            path TEXT NULL,
+            network TEXT NOT NULL,
+            incoming_bytes INTEGER NOT NULL,
+            outgoing_bytes INTEGER NOT NULL,
+            packet_count INTEGER NOT NULL,
+            UNIQUE (bucket, pid, name))
+    """)
+
+    # a DST change can map two local hours onto one bucket, those rows are added up
+    copy_in_batches(conn, "network_usage", "network_usage_v2", f"""
+        INSERT INTO network_usage_v2 (id, bucket, date_str, hour, network, incoming_bytes, outgoing_bytes)
+        SELECT id, {_BUCKET_FROM_DATE_HOUR}, date_str, hour, network, incoming_bytes, outgoing_bytes
+        FROM network_usage WHERE id > ? AND id <= ?
+        ON CONFLICT (bucket, network) DO UPDATE SET
+            incoming_bytes = incoming_bytes + excluded.incoming_bytes,
+            outgoing_bytes = outgoing_bytes + excluded.outgoing_bytes
+    """)
+    copy_in_batches(conn, "process_usage", "process_usage_v2", f"""
+        INSERT INTO process_usage_v2
+        (id, bucket, date_str, hour, pid, name, path, network, incoming_bytes, outgoing_bytes, packet_count)
+        SELECT id, {_BUCKET_FROM_DATE_HOUR}, date_str, hour, pid, name, path, network,
+               incoming_bytes, outgoing_bytes, packet_count
+        FROM process_usage WHERE id > ? AND id <= ?
+        ON CONFLICT (bucket, pid, name) DO UPDATE SET
+            incoming_bytes = incoming_bytes + excluded.incoming_bytes,
+            outgoing_bytes = outgoing_bytes + excluded.outgoing_bytes,
+            packet_count = packet_count + excluded.packet_count
+    """)
+
+    conn.execute("BEGIN IMMEDIATE")
+    conn.execute("DROP TABLE network_usage")
+    conn.execute("ALTER TABLE network_usage_v2 RENAME TO network_usage")
+    conn.execute("DROP TABLE process_usage")
+    conn.execute("ALTER TABLE process_usage_v2 RENAME TO process_usage")
+    # CLI range scans (bucket range, optional network/name filter) are answered from the index alone
+    conn.execute("""
+        CREATE INDEX idx_network_usage_range
+        ON network_usage (bucket, network, date_str, hour, incoming_bytes, outgoing_bytes)
+    """)
+    conn.execute("""
+        CREATE INDEX idx_process_usage_range
+        ON process_usage (bucket, name, path, date_str, hour, incoming_bytes, outgoing_bytes)
+    """)
+    conn.execute("CREATE INDEX idx_process_usage_name ON process_usage (name, bucket)")
+    set_schema_version(conn, 2)
+    conn.commit()
+
+
+def _rollup_upsert(table: str, level: str, key_columns: str, key_values: str, values: str,
+                   sampling: bool = False) -> str:
+    """values are incoming_bytes, outgoing_bytes and with sampling byte_variance and sample_rate."""
+    sums = ("incoming_bytes", "outgoing_bytes", "byte_variance") if sampling else ("incoming_bytes", "outgoing_bytes")
+    counters = ", ".join(f"{c} = {c} + excluded.{c}" for c in sums)
+    columns = ", ".join(sums)
+    if sampling:
+        counters += ", sample_rate = MAX(sample_rate, excluded.sample_rate)"
+        columns += ", sample_rate"
+    period = ROLLUP_PERIODS[level].format(date="NEW.date_str")
+    return f"""
+        INSERT INTO {table}_{level} (period, {key_columns}, {columns})
+        VALUES ({period}, {key_values}, {values})
+        ON CONFLICT (period, {key_columns}) DO UPDATE SET {counters};
+    """
+
+
+def migrate_to_rollup_tables(conn: sqlite3.Connection) -> None:
+    """
+    Version 3: day, week and month rollups of both usage tables. Triggers on the hourly tables apply every
+    change to the rollups, so they are updated in the same transaction as the hourly upsert. Deleting hourly
+    rows leaves the rollups untouched.
+    """
+    # hourly table -> (rollup key definitions, rollup key columns, key values of an hourly row {row})
+    rollup_keys = {
+        "network_usage": ("network TEXT NOT NULL", "network", "{row}network"),
+        "process_usage": ("name TEXT NOT NULL, path TEXT NOT NULL", "name, path",
+                          "{row}name, COALESCE({row}path, '')"),
+    }
+
+    conn.execute("BEGIN IMMEDIATE")
+    for table, (key_definitions, key_columns, key_values) in rollup_keys.items():
+        for level, period in ROLLUP_PERIODS.items():
+            conn.execute(f"""
+                CREATE TABLE {table}_{level} (
+                    period TEXT NOT NULL,
+                    {key_definitions},
+                    incoming_bytes INTEGER NOT NULL,
+                    outgoing_bytes INTEGER NOT NULL,
+                    PRIMARY KEY (period, {key_columns})) WITHOUT ROWID
+            """)
+            source_keys = key_values.format(row="")
+            conn.execute(f"""
+                INSERT INTO {table}_{level} (period, {key_columns}, incoming_bytes, outgoing_bytes)
+                SELECT {period.format(date="date_str")}, {source_keys}, SUM(incoming_bytes), SUM(outgoing_bytes)
+                FROM {table} GROUP BY 1, {source_keys}
+            """)
+
+        new_keys = key_values.format(row="NEW.")
+        inserts = "".join(_rollup_upsert(table, level, key_columns, new_keys,
+                                         "NEW.incoming_bytes, NEW.outgoing_bytes") for level in ROLLUP_PERIODS)
+        updates = "".join(_rollup_upsert(table, level, key_columns, new_keys,
+                                         "NEW.incoming_bytes - OLD.incoming_bytes, "
+                                         "NEW.outgoing_bytes - OLD.outgoing_bytes") for level in ROLLUP_PERIODS)
+        conn.execute(f"CREATE TRIGGER {table}_rollup_insert AFTER INSERT ON {table} BEGIN {inserts} END")
+        conn.execute(f"""
+            CREATE TRIGGER {table}_rollup_update AFTER UPDATE OF incoming_bytes, outgoing_bytes ON {table}
+            BEGIN {updates} END
+        """)
+    set_schema_version(conn, 3)
+    conn.commit()
+
+
+def enable_incremental_vacuum(conn: sqlite3.Connection) -> None:
+    """
+    Version 4: auto_vacuum=INCREMENTAL, so the retention thread can give the pages of deleted rows back in small
+    steps. Switching needs a full VACUUM, which only runs here for a database without usage yet. Rebuilding a large
+    one would hold up the daemon start for minutes and needs twice its disk space, that is left to a one-off
+    `soursop vacuum`.
+    """
+    empty = conn.execute("SELECT NOT EXISTS (SELECT 1 FROM network_usage) "
+                         "AND NOT EXISTS (SELECT 1 FROM process_usage)").fetchone()[0]
+    if empty:
+        conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        conn.commit()
+        conn.execute("VACUUM")
+    else:
+        logging.info("Run 'soursop vacuum' once while the daemon is stopped, so retention can give the space of "
+                     "deleted rows back to the file system.")
+    set_schema_version(conn, 4)
+    conn.commit()
+
+
+def migrate_to_process_identity(conn: sqlite3.Connection) -> None:
+    """
+    Version 5: process names and paths are stored once in process_identity, process usage rows and rollups
+    reference them by integer id. Name searches match the small identity table and join on the id.
+    """
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS process_identity (
+            id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            path TEXT NOT NULL,
+            UNIQUE (name, path))
+    """)
+    # month rollups hold every process ever seen, also those whose hourly rows are past the retention
+    conn.execute("""
+        INSERT OR IGNORE INTO process_identity (name, path)
+        SELECT name, path FROM process_usage_month
+        UNION SELECT name, COALESCE(path, '') FROM process_usage
+    """)
+    conn.commit()
+
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS process_usage_v5 (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            bucket INTEGER NOT NULL,
+            date_str TEXT NOT NULL,
+            hour INTEGER NOT NULL,
+            pid INTEGER NOT NULL,
+            identity_id INTEGER NOT NULL REFERENCES process_identity (id),
+            network TEXT NOT NULL,
+            incoming_bytes INTEGER NOT NULL,
+            outgoing_bytes INTEGER NOT NULL,
+            packet_count INTEGER NOT NULL,
+            UNIQUE (bucket, pid, identity_id))
+    """)
+    copy_in_batches(conn, "process_usage", "process_usage_v5", """
+        INSERT INTO process_usage_v5
+        (id, bucket, date_str, hour, pid, identity_id, network, incoming_bytes, outgoing_bytes, packet_count)
+        SELECT u.id, u.bucket, u.date_str, u.hour, u.pid, i.id, u.network,
+               u.incoming_bytes, u.outgoing_bytes, u.packet_count
+        FROM process_usage u JOIN process_identity i ON i.name = u.name AND i.path = COALESCE(u.path, '')
+        WHERE u.id > ? AND u.id <= ?
+    """)
+
+    conn.execute("BEGIN IMMEDIATE")
+    conn.execute("DROP TABLE process_usage")  # drops its rollup triggers as well
+    conn.execute("ALTER TABLE process_usage_v5 RENAME TO process_usage")
+    conn.execute("""
+        CREATE INDEX idx_process_usage_range
+        ON process_usage (bucket, identity_id, date_str, hour, incoming_bytes, outgoing_bytes)
+    """)
+    conn.execute("CREATE INDEX idx_process_usage_identity ON process_usage (identity_id, bucket)")
+
+    for level in ROLLUP_PERIODS:
+        conn.execute(f"""
+            CREATE TABLE process_usage_{level}_v5 (
+                period TEXT NOT NULL,
+                identity_id INTEGER NOT NULL,
+                incoming_bytes INTEGER NOT NULL,
+                outgoing_bytes INTEGER NOT NULL,
+                PRIMARY KEY (period, identity_id)) WITHOUT ROWID
+        """)
+        conn.execute(f"""
+            INSERT INTO process_usage_{level}_v5 (period, identity_id, incoming_bytes, outgoing_bytes)
+            SELECT r.period, i.id, r.incoming_bytes, r.outgoing_bytes
+            FROM process_usage_{level} r JOIN process_identity i ON i.name = r.name AND i.path = r.path
+        """)
+        conn.execute(f"DROP TABLE process_usage_{level}")
+        conn.execute(f"ALTER TABLE process_usage_{level}_v5 RENAME TO process_usage_{level}")
+        conn.execute(f"CREATE INDEX idx_process_usage_{level}_identity ON process_usage_{level} (identity_id, period)")
+
+    inserts = "".join(_rollup_upsert("process_usage", level, "identity_id", "NEW.identity_id",
+                                     "NEW.incoming_bytes, NEW.outgoing_bytes") for level in ROLLUP_PERIODS)
+    updates = "".join(_rollup_upsert("process_usage", level, "identity_id", "NEW.identity_id",
+                                     "NEW.incoming_bytes - OLD.incoming_bytes, "
+                                     "NEW.outgoing_bytes - OLD.outgoing_bytes") for level in ROLLUP_PERIODS)
+    conn.execute(f"CREATE TRIGGER process_usage_rollup_insert AFTER INSERT ON process_usage BEGIN {inserts} END")
+    conn.execute(f"""
+        CREATE TRIGGER process_usage_rollup_update AFTER UPDATE OF incoming_bytes, outgoing_bytes ON process_usage
+        BEGIN {updates} END
+    """)
+    set_schema_version(conn, 5)
+    conn.commit()
+
+
+def add_sampling_columns(conn: sqlite3.Connection) -> None:
+    """
+    Version 6: the sample rate and byte variance of sampled process usage, on the hourly rows and the rollups.
+    Rows counted without sampling keep rate 1 and variance 0. Rates combine by maximum and variances by sum,
+    so the CLI can derive error bounds on every level.
+    """
+    conn.execute("BEGIN IMMEDIATE")
+    for table in ["process_usage"] + [f"process_usage_{level}" for level in ROLLUP_PERIODS]:
+        conn.execute(f"ALTER TABLE {table} ADD COLUMN sample_rate INTEGER NOT NULL DEFAULT 1")
+        conn.execute(f"ALTER TABLE {table} ADD COLUMN byte_variance REAL NOT NULL DEFAULT 0")
+    conn.execute("DROP INDEX idx_process_usage_range")
+    conn.execute("""
+        CREATE INDEX idx_process_usage_range
+        ON process_usage (bucket, identity_id, date_str, hour, incoming_bytes, outgoing_bytes,
+                          sample_rate, byte_variance)
+    """)
+
+    conn.execute("DROP TRIGGER process_usage_rollup_insert")
+    conn.execute("DROP TRIGGER process_usage_rollup_update")
+    inserts = "".join(_rollup_upsert("process_usage", level, "identity_id", "NEW.identity_id",
+                                     "NEW.incoming_bytes, NEW.outgoing_bytes, NEW.byte_variance, NEW.sample_rate",
+                                     sampling=True) for level in ROLLUP_PERIODS)
+    updates = "".join(_rollup_upsert("process_usage", level, "identity_id", "NEW.identity_id",
+                                     "NEW.incoming_bytes - OLD.incoming_bytes, "
+                                     "NEW.outgoing_bytes - OLD.outgoing_bytes, "
+                                     "NEW.byte_variance - OLD.byte_variance, NEW.sample_rate",
+                                     sampling=True) for level in ROLLUP_PERIODS)
+    conn.execute(f"CREATE TRIGGER process_usage_rollup_insert AFTER INSERT ON process_usage BEGIN {inserts} END")
+    conn.execute(f"""
+        CREATE TRIGGER process_usage_rollup_update
+        AFTER UPDATE OF incoming_bytes, outgoing_bytes, byte_variance, sample_rate ON process_usage
+        BEGIN {updates} END
+    """)
+    set_schema_version(conn, 6)
+    conn.commit()
+
+
+def add_journal_commits(conn: sqlite3.Connection) -> None:
+    """
+    Version 7: the usage journal region the writer committed last, written in the transaction of its usage,
+    so a replay after a crash between the commit and the release of the region skips it.
+    """
+    conn.execute("BEGIN IMMEDIATE")
+    conn.execute("""
+        CREATE TABLE journal_commit (
+            id INTEGER PRIMARY KEY CHECK (id = 0),
+            journal_id INTEGER NOT NULL,
+            sequence INTEGER NOT NULL)
+    """)
+    set_schema_version(conn, 7)
+    conn.commit()
+
+
+# (version, migration) in order, each migration upgrades the schema from the previous version
+MIGRATIONS: list[tuple[int, Callable[[sqlite3.Connection], None]]] = [
+    (2, migrate_to_bucket_schema),
+    (3, migrate_to_rollup_tables),
+    (4, enable_incremental_vacuum),
+    (5, migrate_to_process_identity),
+    (6, add_sampling_columns),
+    (7, add_journal_commits),
+]
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+def migrate(conn: sqlite3.Connection) -> None:
+    """Upgrade a version 1 schema (the initial tables, user_version 0 or 1) to the latest version."""
+    version = max(get_schema_version(conn), 1)
+    for target_version, migration in MIGRATIONS:
+        if version < target_version:
+            logging.info(f"Migrating database schema from version {version} to {target_version}...")
+            migration(conn)
+            version = target_version
+    logging.info(f"Database schema is at version {version}.")
@@ -1,21 +1,21 @@
 import sqlite3
-from datetime import date
+from datetime import date, timedelta
 from typing import Optional
 
 from soursop import util
-from soursop.beans import NetworkUsage
-from soursop.db.connection import get_connection
+from soursop.beans import Level, NetworkUsage
+from soursop.db.aggregation import build_rollup_query, get_retention_cut
+from soursop.db.connection import get_connection, get_read_connection
 
 
-def get_usage_bytes(date_obj: date, hour: int, network: str) -> tuple[int, int]:
-    date_str = date_obj.strftime(util.DB_DATE_FORMAT)
+def get_usage_bytes(bucket: int, network: str) -> tuple[int, int]:
     with get_connection() as conn:
         conn.row_factory = sqlite3.Row
         cur = conn.cursor()
         cur.execute("""
-            SELECT incoming_bytes, outgoing_bytes FROM network_usage 
-            WHERE date_str = ? AND hour = ? AND network = ?
-        """, (date_str, hour, network))
+            SELECT incoming_bytes, outgoing_bytes FROM network_usage
+            WHERE bucket = ? AND network = ?
+        """, (bucket, network))
         result = cur.fetchone()
         if result is None:
             return 0, 0
@@ -25,38 +25,33 @@ def get_usage_bytes(date_obj: date, hour: int, network: str) -> tuple[int, int]:
             return incoming, outgoing
 
 
-def update(entries: list[NetworkUsage]) -> None:
-    params = [(e.date_str, e.hour, e.network, e.incoming_bytes, e.outgoing_bytes) for e in entries]
+def update(conn: sqlite3.Connection, entries: list[NetworkUsage]) -> None:
+    """Write the latest totals of each (bucket, network), the caller owns the transaction."""
+    params = [(e.bucket, e.date_str, e.hour, e.network, e.incoming_bytes, e.outgoing_bytes) for e in entries]
     query = """
-        INSERT INTO network_usage 
-        (date_str, hour, network, incoming_bytes, outgoing_bytes)
-        VALUES (?, ?, ?, ?, ?)
-        ON CONFLICT(date_str, hour, network) DO UPDATE SET
+        INSERT INTO network_usage
+        (bucket, date_str, hour, network, incoming_bytes, outgoing_bytes)
+        VALUES (?, ?, ?, ?, ?, ?)
+        ON CONFLICT(bucket, network) DO UPDATE SET
             incoming_bytes=excluded.incoming_bytes,
             outgoing_bytes=excluded.outgoing_bytes
     """
-    if not params:
-        return
-    with get_connection() as conn:
-        cur = conn.cursor()
-        cur.executemany(query, params)
-        conn.commit()
+    if params:
+        conn.executemany(query, params)
 
 
 def search(from_date: date, to_date: date, network: Optional[str]) -> list[NetworkUsage]:
-    start = from_date.isoformat()
-    end = to_date.isoformat()
-    params = [start, end]
+    params = [util.date_bucket(from_date), util.date_bucket(to_date + timedelta(days=1))]
     sql = """
-        SELECT date_str, hour, network, incoming_bytes, outgoing_bytes
-        FROM network_usage WHERE date_str BETWEEN ? AND ?
+        SELECT bucket, date_str, hour, network, incoming_bytes, outgoing_bytes
+        FROM network_usage WHERE bucket >= ? AND bucket < ?
     """
     if network:
         sql += " AND network LIKE ?"
         params.append(f"%{network}%")
-    sql += " ORDER BY date_str, hour, network"
+    sql += " ORDER BY bucket, network"
 
-    with get_connection() as conn:
+    with get_read_connection() as conn:
         conn.row_factory = sqlite3.Row
         cur = conn.cursor()
         cur.execute(sql, params)
@@ -65,8 +60,59 @@ def search(from_date: date, to_date: date, network: Optional[str]) -> list[Netwo
     result = []
     for r in rows:
         result.append(NetworkUsage(
-            date_str=r["date_str"], hour=int(r["hour"]), network=r["network"],
+            bucket=int(r["bucket"]), date_str=r["date_str"], hour=int(r["hour"]), network=r["network"],
             incoming_bytes=int(r["incoming_bytes"]) if r["incoming_bytes"] is not None else 0,
             outgoing_bytes=int(r["outgoing_bytes"]) if r["outgoing_bytes"] is not None else 0
         ))
     return result
+
+
+def _aggregate_query(level: Level, from_date: date, to_date: date, network: Optional[str]) -> tuple[str, list]:
+    if level != Level.HOUR:
+        return build_rollup_query("network_usage", "network", level, from_date, to_date,
+                                  "network LIKE ?" if network else None, (f"%{network}%",))
+
+    params = [util.date_bucket(from_date), util.date_bucket(to_date + timedelta(days=1))]
+    sql = """
+        SELECT date_str, hour, network, SUM(incoming_bytes), SUM(outgoing_bytes)
+        FROM network_usage WHERE bucket >= ? AND bucket < ?
+    """
+    if network:
+        sql += " AND network LIKE ?"
+        params.append(f"%{network}%")
+    sql += " GROUP BY bucket, network, date_str, hour ORDER BY bucket, network"
+    return sql, params
+
+
+def get_report_start(level: Level, from_date: date, to_date: date) -> Optional[date]:
+    """First day the totals of a month report start at when the daily retention cut its range, None otherwise."""
+    with get_read_connection() as conn:
+        return get_retention_cut(conn, "network_usage", level, from_date, to_date)
+
+
+def aggregate(level: Level, from_date: date, to_date: date, network: Optional[str],
+              conn: Optional[sqlite3.Connection] = None) -> list[NetworkUsage]:
+    """
+    Totals per network and hour, day, week or month in chronological order. For the coarser levels
+    date_str is the first date of the period. A given conn is read in the caller's transaction.
+    """
+    sql, params = _aggregate_query(level, from_date, to_date, network)
+    if conn is not None:
+        rows = conn.execute(sql, params).fetchall()
+    else:
+        with get_read_connection() as read_conn:
+            rows = read_conn.execute(sql, params).fetchall()
+    return [NetworkUsage(date_str=date_str, hour=hour, network=network_name,
+                         incoming_bytes=incoming_bytes, outgoing_bytes=outgoing_bytes)
+            for date_str, hour, network_name, incoming_bytes, outgoing_bytes in rows]
+
+
+def get_hour_totals(conn: sqlite3.Connection, buckets: set[int]) -> dict[tuple[int, str], tuple[int, int]]:
+    """Stored (incoming, outgoing) totals of the hours of the given buckets, per (bucket, network)."""
+    if not buckets:
+        return {}
+    rows = conn.execute(f"""
+        SELECT bucket, network, incoming_bytes, outgoing_bytes FROM network_usage
+        WHERE bucket IN ({",".join("?" * len(buckets))})
+    """, list(buckets)).fetchall()
+    return {(bucket, network): (incoming, outgoing) for bucket, network, incoming, outgoing in rows}
@@ -1,42 +1,34 @@
 import sqlite3
-from datetime import date
+from datetime import date, timedelta
 from typing import Optional
 
-from soursop.beans import ProcessUsage
-from soursop.db.connection import get_connection
+from soursop import util
+from soursop.beans import Level, ProcessUsage
+from soursop.db.aggregation import build_rollup_query, get_retention_cut
+from soursop.db.connection import get_read_connection
 
 
-def get_by_pid_name(pid: int, name: str) -> list[ProcessUsage]:
-    with get_connection() as conn:
-        conn.row_factory = sqlite3.Row
-        cur = conn.cursor()
-        cur.execute("SELECT * FROM process_usage WHERE pid = ? AND name = ?", (pid, name))
-        rows = cur.fetchall()
-
-        entries = []
-        for r in rows:
-            entries.append(ProcessUsage(
-                pid=r["pid"], name=r["name"], path=r["path"], date_str=r["date_str"], hour=r["hour"], id=r["id"],
-                network=r["network"], incoming_bytes=r["incoming_bytes"], outgoing_bytes=r["outgoing_bytes"],
-                packet_count=r["packet_count"]
-            ))
-        return entries
+# (name, path) -> process_identity id of every identity the writer has used, the writer thread owns it
+_IDENTITY_IDS: dict[tuple[str, str], int] = {}
+# name filter of the usage queries, matched against the small identity table before touching the usage rows
+_IDENTITY_FILTER = "identity_id IN (SELECT id FROM process_identity WHERE name LIKE ?)"
+# a period holds the highest sample rate of its rows, and the sum of their independent variances
+_SAMPLING_COLUMNS = (("sample_rate", "MAX"), ("byte_variance", "SUM"))
 
 
 def search(from_date: date, to_date: date, name: Optional[str]) -> list[ProcessUsage]:
-    start = from_date.isoformat()
-    end = to_date.isoformat()
-    params = [start, end]
+    params = [util.date_bucket(from_date), util.date_bucket(to_date + timedelta(days=1))]
     sql = """
-        SELECT pid, date_str, hour, name, path, incoming_bytes, outgoing_bytes
-        FROM process_usage WHERE date_str BETWEEN ? AND ?
+        SELECT u.bucket, u.pid, u.date_str, u.hour, i.name, i.path, u.incoming_bytes, u.outgoing_bytes
+        FROM process_usage u JOIN process_identity i ON i.id = u.identity_id
+        WHERE u.bucket >= ? AND u.bucket < ?
     """
     if name:
-        sql += " AND name LIKE ?"
+        sql += f" AND u.{_IDENTITY_FILTER}"
         params.append(f"%{name}%")
-    sql += " ORDER BY date_str, hour, pid"      # what is the most optimal order here??
+    sql += " ORDER BY u.bucket, u.pid"
 
-    with get_connection() as conn:
+    with get_read_connection() as conn:
         conn.row_factory = sqlite3.Row
         cur = conn.cursor()
         cur.execute(sql, params)
@@ -47,7 +39,7 @@ def search(from_date: date, to_date: date, name: Optional[str]) -> list[ProcessU
         result.append(ProcessUsage(
             pid=int(r["pid"]), name=r["name"],
             path=r["path"] if r["path"] is not None else "",
-            date_str=r["date_str"], hour=int(r["hour"]), id=0, network=None,
+            bucket=int(r["bucket"]), date_str=r["date_str"], hour=int(r["hour"]), id=0, network=None,
             incoming_bytes=int(r["incoming_bytes"]) if r["incoming_bytes"] is not None else 0,
             outgoing_bytes=int(r["outgoing_bytes"]) if r["outgoing_bytes"] is not None else 0,
             packet_count=0,
@@ -55,28 +47,119 @@ def search(from_date: date, to_date: date, name: Optional[str]) -> list[ProcessU
     return result
 
 
-def update(entries: list[ProcessUsage]) -> None:
+def _aggregate_query(level: Level, from_date: date, to_date: date, name: Optional[str]) -> tuple[str, list]:
+    if level != Level.HOUR:
+        rollup_sql, params = build_rollup_query("process_usage", "identity_id", level, from_date, to_date,
+                                                _IDENTITY_FILTER if name else None, (f"%{name}%",),
+                                                _SAMPLING_COLUMNS)
+        sql = f"""
+            SELECT r.period_start, r.hour, i.name, i.path, r.incoming_bytes, r.outgoing_bytes,
+                   r.sample_rate, r.byte_variance
+            FROM ({rollup_sql}) r JOIN process_identity i ON i.id = r.identity_id
+            ORDER BY r.period_start, i.name, i.path
+        """
+        return sql, params
+
+    params = [util.date_bucket(from_date), util.date_bucket(to_date + timedelta(days=1))]
+    sql = """
+        SELECT u.date_str, u.hour, i.name, i.path, SUM(u.incoming_bytes), SUM(u.outgoing_bytes),
+               MAX(u.sample_rate), SUM(u.byte_variance)
+        FROM process_usage u JOIN process_identity i ON i.id = u.identity_id
+        WHERE u.bucket >= ? AND u.bucket < ?
+    """
+    if name:
+        sql += f" AND u.{_IDENTITY_FILTER}"
+        params.append(f"%{name}%")
+    sql += " GROUP BY u.bucket, u.identity_id, u.date_str, u.hour ORDER BY u.bucket, i.name, i.path"
+    return sql, params
+
+
+def get_report_start(level: Level, from_date: date, to_date: date) -> Optional[date]:
+    """First day the totals of a month report start at when the daily retention cut its range, None otherwise."""
+    with get_read_connection() as conn:
+        return get_retention_cut(conn, "process_usage", level, from_date, to_date)
+
+
+def aggregate(level: Level, from_date: date, to_date: date, name: Optional[str],
+              conn: Optional[sqlite3.Connection] = None) -> list[ProcessUsage]:
+    """
+    Totals per process name and path and hour, day, week or month in chronological order. For the coarser
+    levels date_str is the first date of the period. A given conn is read in the caller's transaction.
+    """
+    sql, params = _aggregate_query(level, from_date, to_date, name)
+    if conn is not None:
+        rows = conn.execute(sql, params).fetchall()
+    else:
+        with get_read_connection() as read_conn:
+            rows = read_conn.execute(sql, params).fetchall()
+    return [ProcessUsage(pid=0, name=process_name, path=path, date_str=date_str, hour=hour,
+                         incoming_bytes=incoming_bytes, outgoing_bytes=outgoing_bytes,
+                         sample_rate=sample_rate, byte_variance=byte_variance)
+            for date_str, hour, process_name, path, incoming_bytes, outgoing_bytes, sample_rate, byte_variance
+            in rows]
+
+
+def aggregate_frame(level: Level, from_date: date, to_date: date, name: Optional[str]):
+    """
+    Columnar variant of aggregate for large result sets, needs pandas. SQLite does the grouping, the grouped
+    rows are read straight into columns without a ProcessUsage per row. Returns a DataFrame with the columns
+    period (start of the hour, day, week or month), name, path, incoming_bytes, outgoing_bytes, sample_rate
+    and byte_variance.
+    """
+    import pandas as pd
+
+    sql, params = _aggregate_query(level, from_date, to_date, name)
+    with get_read_connection() as conn:
+        frame = pd.read_sql_query(sql, conn, params=params)
+    frame.columns = ["date_str", "hour", "name", "path", "incoming_bytes", "outgoing_bytes",
+                     "sample_rate", "byte_variance"]
+
+    # few distinct dates, so they are parsed once each
+    codes, dates = pd.factorize(frame["date_str"])
+    frame["period"] = pd.to_datetime(dates, format=util.DB_DATE_FORMAT)[codes] + pd.to_timedelta(frame["hour"], unit="h")
+    return frame[["period", "name", "path", "incoming_bytes", "outgoing_bytes", "sample_rate", "byte_variance"]]
+
+
+def get_identity_ids(conn: sqlite3.Connection, identities: set[tuple[str, str]]) -> dict[tuple[str, str], int]:
+    """Ids of the (name, path) identities, the unknown ones are added to process_identity in the caller's transaction."""
+    missing = [identity for identity in identities if identity not in _IDENTITY_IDS]
+    if missing:
+        conn.executemany("INSERT OR IGNORE INTO process_identity (name, path) VALUES (?, ?)", missing)
+        for identity in missing:
+            row = conn.execute("SELECT id FROM process_identity WHERE name = ? AND path = ?", identity).fetchone()
+            _IDENTITY_IDS[identity] = row[0]
+    return _IDENTITY_IDS
+
+
+def forget_identity_ids() -> None:
+    """Drop the cached ids after a rolled back transaction, ids of identities added by it may be reused."""
+    _IDENTITY_IDS.clear()
+
+
+def add_usages(conn: sqlite3.Connection, entries: list[ProcessUsage]) -> None:
+    """Add the usage deltas of the current buckets to the stored rows, the caller owns the transaction."""
+    if not entries:
+        return
+    identity_ids = get_identity_ids(conn, {(e.name, e.path or "") for e in entries})
     insert_update_query = """
         INSERT INTO process_usage
-        (date_str, hour, pid, name, path, network, incoming_bytes, outgoing_bytes, packet_count)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ON CONFLICT (date_str, hour, pid, name)
+        (bucket, date_str, hour, pid, identity_id, network, incoming_bytes, outgoing_bytes, packet_count,
+         sample_rate, byte_variance)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (bucket, pid, identity_id)
         DO UPDATE SET
-            incoming_bytes = excluded.incoming_bytes,
-            outgoing_bytes = excluded.outgoing_bytes,
-            packet_count = excluded.packet_count
+            incoming_bytes = incoming_bytes + excluded.incoming_bytes,
+            outgoing_bytes = outgoing_bytes + excluded.outgoing_bytes,
+            packet_count = packet_count + excluded.packet_count,
+            sample_rate = MAX(sample_rate, excluded.sample_rate),
+            byte_variance = byte_variance + excluded.byte_variance
     """
     params = []
     for e in entries:
         params.append((
-            e.date_str, e.hour, e.pid, e.name, e.path,
+            e.bucket, e.date_str, e.hour, e.pid, identity_ids[(e.name, e.path or "")],
             e.network if e.network is not None else "",
             int(e.incoming_bytes or 0), int(e.outgoing_bytes or 0), int(e.packet_count or 0),
+            int(e.sample_rate or 1), float(e.byte_variance or 0.0),
         ))
-    if not params:
-        return
-
-    with get_connection() as conn:
-        cur = conn.cursor()
-        cur.executemany(insert_update_query, params)
-        conn.commit()
+    conn.executemany(insert_update_query, params)
@@ -0,0 +1,116 @@
+import logging
+import sqlite3
+import time
+from datetime import date, timedelta
+from typing import Callable
+
+from soursop import config, util
+from soursop.beans import Level
+from soursop.db.connection import open_writer_connection
+
+_BATCH_SIZE = 2000
+_BATCH_PAUSE = 0.05  # lets the writer take the write lock between two batches
+_VACUUM_PAGES = 512
+_AUTO_VACUUM_INCREMENTAL = 2
+
+# connection of the retention job, separate from the writer so batches only briefly hold the write lock
+_CONNECTION: sqlite3.Connection | None = None
+# called after a retention run deleted rows, e.g. to drop query results cached from them
+_DELETE_HOOKS: list[Callable[[], None]] = []
+
+
+def register_delete_hook(hook: Callable[[], None]) -> None:
+    _DELETE_HOOKS.append(hook)
+
+
+def delete_in_batches(conn: sqlite3.Connection, table: str, key: str, where: str, params: tuple) -> int:
+    """Delete the matching rows in short transactions of about _BATCH_SIZE rows each."""
+    deleted = 0
+    while util.RUNNING_FLAG:
+        cur = conn.execute(f"""
+            DELETE FROM {table} WHERE {key} IN (SELECT {key} FROM {table} WHERE {where} LIMIT {_BATCH_SIZE})
+        """, params)
+        conn.commit()
+        deleted += cur.rowcount
+        if cur.rowcount < _BATCH_SIZE:
+            break
+        time.sleep(_BATCH_PAUSE)
+    return deleted
+
+
+def reclaim_free_pages(conn: sqlite3.Connection) -> int:
+    """Give the pages freed by deletes back to the file system, a few at a time."""
+    if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != _AUTO_VACUUM_INCREMENTAL:
+        return 0
+    reclaimed = 0
+    while util.RUNNING_FLAG:
+        free_pages = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        if free_pages == 0:
+            break
+        # executescript steps the pragma to the end, a plain execute frees a single page
+        conn.executescript(f"PRAGMA incremental_vacuum({_VACUUM_PAGES})")
+        reclaimed += min(free_pages, _VACUUM_PAGES)
+        time.sleep(_BATCH_PAUSE)
+    return reclaimed
+
+
+def rebuild_for_incremental_vacuum(conn: sqlite3.Connection) -> bool:
+    """
+    Switch a database created before incremental vacuum with a full VACUUM, which rewrites the whole file and needs
+    as much free disk space again. Returns False when it was switched already.
+    """
+    if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == _AUTO_VACUUM_INCREMENTAL:
+        return False
+    conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+    conn.execute("VACUUM")
+    return True
+
+
+def apply_retention(conn: sqlite3.Connection, today: date) -> None:
+    """
+    Hourly rows older than the hourly retention are deleted, their totals stay in the day, week and month
+    rollups. With a daily retention, day and week rollups older than that are deleted as well, months are kept.
+    """
+    total_deleted = 0
+    if config.HOURLY_RETENTION_DAYS > 0:
+        cutoff = util.date_bucket(today - timedelta(days=config.HOURLY_RETENTION_DAYS))
+        for table in ("network_usage", "process_usage"):
+            deleted = delete_in_batches(conn, table, "id", "bucket < ?", (cutoff,))
+            total_deleted += deleted
+            if deleted:
+                logging.info(f"Retention deleted {deleted} hourly rows from {table}")
+
+    if config.DAILY_RETENTION_DAYS > 0:
+        cutoff = today - timedelta(days=config.DAILY_RETENTION_DAYS)
+        cutoffs = {Level.DAY: cutoff, Level.WEEK: util.period_start(cutoff, Level.WEEK)}
+        for table in ("network_usage", "process_usage"):
+            for level, level_cutoff in cutoffs.items():
+                deleted = delete_in_batches(conn, f"{table}_{level.value}", "period", "period < ?",
+                                            (level_cutoff.isoformat(),))
+                total_deleted += deleted
+                if deleted:
+                    logging.info(f"Retention deleted {deleted} rows from {table}_{level.value}")
+    if total_deleted:
+        for hook in _DELETE_HOOKS:
+            hook()
+
+    reclaimed = reclaim_free_pages(conn)
+    if reclaimed:
+        logging.info(f"Retention reclaimed {reclaimed} free database pages")
+
+
+def run_retention() -> None:
+    global _CONNECTION
+    if _CONNECTION is None:
+        _CONNECTION = open_writer_connection()
+    try:
+        apply_retention(_CONNECTION, date.today())
+    except sqlite3.Error as e:
+        logging.error(f"Error occurred while applying the retention policy: {e}")
+
+
+def close() -> None:
+    global _CONNECTION
+    if _CONNECTION is not None:
+        _CONNECTION.close()
+        _CONNECTION = None
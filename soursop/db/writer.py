@@ -0,0 +1,192 @@
+import logging
+import sqlite3
+import time
+from threading import Lock
+from typing import Callable
+
+import soursop.db.journal_repository as journal_repository
+import soursop.db.network_repository as network_repository
+import soursop.db.process_repository as process_repository
+from soursop import metrics
+from soursop.beans import NetworkUsage, ProcessUsage
+from soursop.db.connection import open_writer_connection
+from soursop.usage_journal import UsageJournal
+
+# writes waiting for the next tick, network rows hold totals so only the latest one per key is kept
+_PENDING_LOCK = Lock()
+_PENDING_NETWORK: dict[tuple[int, str], NetworkUsage] = {}
+_PENDING_PROCESS: list[ProcessUsage] = []
+
+# called at the start of every tick, so producers can hand over what they buffered
+_FLUSH_HOOKS: list[Callable[[], None]] = []
+# called once everything handed over so far is in the database, so producers can forget their journaled copy
+_COMMIT_HOOKS: list[Callable[[], None]] = []
+
+_FLUSH_LOCK = Lock()
+_CONNECTION: sqlite3.Connection | None = None
+# journal of the usage handed over so far, its last sealed region is marked committed along with the usage
+_JOURNAL: UsageJournal | None = None
+
+# transactions, failed transactions and rows written, only changed under the flush lock
+_WRITER_STATS = {"flushes": 0, "flush_errors": 0, "network_rows": 0, "process_rows": 0}
+_FLUSH_SECONDS = metrics.Histogram()
+
+
+def register_flush_hook(hook: Callable[[], None]) -> None:
+    _FLUSH_HOOKS.append(hook)
+
+
+def register_commit_hook(hook: Callable[[], None]) -> None:
+    _COMMIT_HOOKS.append(hook)
+
+
+# wakes the flush job of the scheduler ahead of its next tick
+_FLUSH_WAKEUP: Callable[[], None] | None = None
+
+
+def set_flush_wakeup(wakeup: Callable[[], None]) -> None:
+    global _FLUSH_WAKEUP
+    _FLUSH_WAKEUP = wakeup
+
+
+def request_flush() -> None:
+    """Flush before the next tick, e.g. when an in-memory buffer is filling up."""
+    if _FLUSH_WAKEUP is not None:
+        _FLUSH_WAKEUP()
+
+
+def submit_network_usages(entries: list[NetworkUsage]) -> None:
+    with _PENDING_LOCK:
+        for entry in entries:
+            _PENDING_NETWORK[(entry.bucket, entry.network)] = entry
+
+
+def submit_process_usages(entries: list[ProcessUsage]) -> None:
+    with _PENDING_LOCK:
+        _PENDING_PROCESS.extend(entries)
+
+
+def _take_pending() -> tuple[list[NetworkUsage], list[ProcessUsage]]:
+    global _PENDING_NETWORK, _PENDING_PROCESS
+    with _PENDING_LOCK:
+        network_entries = list(_PENDING_NETWORK.values())
+        process_entries = _PENDING_PROCESS
+        _PENDING_NETWORK = {}
+        _PENDING_PROCESS = []
+    return network_entries, process_entries
+
+
+def get_pending() -> tuple[list[NetworkUsage], list[ProcessUsage]]:
+    """Copies of the writes waiting for the next tick."""
+    with _PENDING_LOCK:
+        return list(_PENDING_NETWORK.values()), list(_PENDING_PROCESS)
+
+
+def hold_flushes() -> Lock:
+    """
+    While held no flush runs, so nothing moves from the producers and the pending writes into the database.
+    Readers that combine both hold it only to take their snapshots, never for a whole query.
+    """
+    return _FLUSH_LOCK
+
+
+def _restore_pending(network_entries: list[NetworkUsage], process_entries: list[ProcessUsage]) -> None:
+    """Put the writes of a failed transaction back, without overwriting newer network totals."""
+    with _PENDING_LOCK:
+        for entry in network_entries:
+            _PENDING_NETWORK.setdefault((entry.bucket, entry.network), entry)
+        _PENDING_PROCESS[:0] = process_entries
+
+
+def _get_connection() -> sqlite3.Connection:
+    global _CONNECTION
+    if _CONNECTION is None:
+        _CONNECTION = open_writer_connection()
+    return _CONNECTION
+
+
+def _run_commit_hooks() -> None:
+    for hook in _COMMIT_HOOKS:
+        hook()
+
+
+def flush() -> None:
+    """Write everything pending in one transaction."""
+    with _FLUSH_LOCK:
+        for hook in _FLUSH_HOOKS:
+            hook()
+
+        network_entries, process_entries = _take_pending()
+        if not network_entries and not process_entries:
+            _run_commit_hooks()
+            return
+
+        started = time.monotonic()
+        try:
+            conn = _get_connection()
+            with conn:
+                network_repository.update(conn, network_entries)
+                process_repository.add_usages(conn, process_entries)
+                if _JOURNAL is not None:
+                    journal_repository.mark_committed(conn, *_JOURNAL.committed_marker())
+        except sqlite3.Error:
+            _WRITER_STATS["flush_errors"] += 1
+            process_repository.forget_identity_ids()
+            _restore_pending(network_entries, process_entries)
+            raise
+        elapsed = time.monotonic() - started
+        _FLUSH_SECONDS.observe(elapsed)
+        _WRITER_STATS["flushes"] += 1
+        _WRITER_STATS["network_rows"] += len(network_entries)
+        _WRITER_STATS["process_rows"] += len(process_entries)
+        _run_commit_hooks()
+        logging.debug(f"Committed {len(network_entries)} network and {len(process_entries)} process rows "
+                      f"in {elapsed * 1000:.1f} ms")
+
+
+def get_stats() -> dict:
+    return {
+        "writer_pending_rows": len(_PENDING_NETWORK) + len(_PENDING_PROCESS),
+        "writer_flushes_total": _WRITER_STATS["flushes"],
+        "writer_flush_errors_total": _WRITER_STATS["flush_errors"],
+        "writer_network_rows_total": _WRITER_STATS["network_rows"],
+        "writer_process_rows_total": _WRITER_STATS["process_rows"],
+        "writer_flush_seconds": _FLUSH_SECONDS,
+    }
+
+
+def close() -> None:
+    global _CONNECTION
+    with _FLUSH_LOCK:
+        if _CONNECTION is not None:
+            _CONNECTION.close()
+            _CONNECTION = None
+
+
+def final_flush() -> None:
+    """Write whatever the trackers handed over before they stopped, then close the connection."""
+    try:
+        flush()
+    finally:
+        close()
+    logging.info("Stopped database writer.....")
+
+
+def replay_journal(journal: UsageJournal) -> None:
+    """
+    Write the usage a previous run left in the journal, then start the journal over. The replayed regions are
+    marked committed in the same transaction, so a crash before the journal is reset does not replay them again.
+    """
+    global _JOURNAL
+    with _FLUSH_LOCK:
+        conn = _get_connection()
+        process_entries, network_entries = journal.open(
+            lambda journal_id: journal_repository.get_committed_sequence(conn, journal_id))
+    _JOURNAL = journal
+    if process_entries or network_entries:
+        submit_process_usages(process_entries)
+        submit_network_usages(network_entries)
+        flush()
+        logging.info(f"Replayed {len(process_entries)} process and {len(network_entries)} network usage entries "
+                     f"from the journal")
+    journal.reset()
@@ -0,0 +1,119 @@
+import json
+import logging
+import os
+import resource
+import time
+from bisect import bisect_left
+from pathlib import Path
+from typing import Callable
+
+# upper bounds in seconds of the latency histograms, one more bucket counts everything above
+LATENCY_BOUNDS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5,
+                  5.0, 10.0)
+PROMETHEUS_PREFIX = "soursop_"
+
+
+class Histogram:
+    """
+    Latency histogram with fixed buckets. Every histogram has a single writing thread, so observe() only adds to
+    plain numbers without a lock, readers copy them for a snapshot.
+    """
+
+    def __init__(self, bounds: tuple[float, ...] = LATENCY_BOUNDS) -> None:
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+    def snapshot(self) -> dict:
+        return {"bounds": list(self.bounds), "counts": list(self.counts), "sum": self.sum}
+
+
+def quantile(histogram: dict, q: float) -> float:
+    """Estimate of the q quantile of a histogram snapshot, interpolated inside its bucket like Prometheus does."""
+    total = sum(histogram["counts"])
+    if not total:
+        return 0.0
+    rank = q * total
+    bounds = histogram["bounds"]
+    seen = 0
+    for index, count in enumerate(histogram["counts"]):
+        if count and seen + count >= rank:
+            if index == len(bounds):
+                return bounds[-1]  # above the highest bound, nothing better to report
+            lower = bounds[index - 1] if index else 0.0
+            return lower + (bounds[index] - lower) * (rank - seen) / count
+        seen += count
+    return bounds[-1]
+
+
+# functions returning the current metrics of a daemon stage, name -> number or Histogram. Names ending in
+# _total are counters, the other numbers are gauges
+_SOURCES: list[Callable[[], dict]] = []
+_STARTED = time.time()
+
+
+def register_source(source: Callable[[], dict]) -> None:
+    _SOURCES.append(source)
+
+
+def _daemon_metrics() -> dict:
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return {
+        "daemon_start_time_seconds": _STARTED,
+        "daemon_cpu_seconds_total": usage.ru_utime + usage.ru_stime,
+        "daemon_max_rss_bytes": usage.ru_maxrss * 1024,
+    }
+
+
+def collect() -> dict:
+    """
+    Snapshot of every registered source. The sources are read without locks, so the counters of different stages
+    may be a few packets apart.
+    """
+    values = _daemon_metrics()
+    for source in _SOURCES:
+        try:
+            values.update(source())
+        except Exception as e:
+            logging.error(f"Failed to collect metrics from {source.__qualname__}: {e}")
+    metrics = {name: value.snapshot() if isinstance(value, Histogram) else value
+               for name, value in sorted(values.items())}
+    return {"time": time.time(), "metrics": metrics}
+
+
+def write_stats(path: Path) -> None:
+    """Replace the stats file with a fresh snapshot, readers never see a partly written file."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temporary = path.with_name(f".{path.name}.tmp")
+    temporary.write_text(json.dumps(collect(), separators=(",", ":")))
+    os.replace(temporary, path)
+
+
+def read_stats(path: Path) -> dict | None:
+    try:
+        return json.loads(path.read_text())
+    except FileNotFoundError:
+        return None
+
+
+def format_prometheus(stats: dict) -> str:
+    """Prometheus text exposition format of a stats snapshot, e.g. for the node_exporter textfile collector."""
+    lines = []
+    for name, value in stats["metrics"].items():
+        full_name = PROMETHEUS_PREFIX + name
+        if isinstance(value, dict):
+            lines.append(f"# TYPE {full_name} histogram")
+            cumulative = 0
+            for bound, count in zip(value["bounds"] + ["+Inf"], value["counts"]):
+                cumulative += count
+                lines.append(f'{full_name}_bucket{{le="{bound}"}} {cumulative}')
+            lines.append(f"{full_name}_sum {value['sum']}")
+            lines.append(f"{full_name}_count {cumulative}")
+        else:
+            lines.append(f"# TYPE {full_name} {'counter' if name.endswith('_total') else 'gauge'}")
+            lines.append(f"{full_name} {value}")
+    return "\n".join(lines) + "\n"
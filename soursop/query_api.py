@@ -0,0 +1,61 @@
+import json
+from datetime import date
+from typing import Optional
+
+from soursop.beans import Level, NetworkUsage, ProcessUsage
+
+# One request per connection on the daemon's query socket, a JSON object ended by a newline:
+#   {"command": "network" | "process", "level": "hour" | "day" | "week" | "month",
+#    "from": "YYYY-MM-DD", "to": "YYYY-MM-DD", "filter": network or process name substring | null}
+# The daemon answers {"rows": [...]} or {"error": "..."} and closes the connection. Rows are plain arrays:
+#   network: [date_str, hour, network, incoming_bytes, outgoing_bytes]
+#   process: [date_str, hour, name, path, incoming_bytes, outgoing_bytes, sample_rate, byte_variance]
+COMMANDS = ("network", "process")
+MAX_REQUEST_SIZE = 4096
+
+
+def encode_request(command: str, level: Level, from_date: date, to_date: date, filter_value: Optional[str]) -> bytes:
+    request = {"command": command, "level": level.value, "from": from_date.isoformat(), "to": to_date.isoformat(),
+               "filter": filter_value}
+    return json.dumps(request).encode() + b"\n"
+
+
+def decode_request(data: bytes) -> tuple[str, Level, date, date, Optional[str]]:
+    """Raises ValueError, KeyError or TypeError for a malformed request."""
+    request = json.loads(data)
+    command = request["command"]
+    if command not in COMMANDS:
+        raise ValueError(f"unknown command {command!r}")
+    from_date, to_date = date.fromisoformat(request["from"]), date.fromisoformat(request["to"])
+    if from_date > to_date:
+        raise ValueError("from must be <= to")
+    filter_value = request.get("filter") or None
+    if filter_value is not None and not isinstance(filter_value, str):
+        raise TypeError("filter must be a string")
+    return command, Level(request["level"]), from_date, to_date, filter_value
+
+
+def encode_response(response: dict) -> bytes:
+    return json.dumps(response, separators=(",", ":")).encode()
+
+
+def network_row(entry: NetworkUsage) -> list:
+    return [entry.date_str, entry.hour, entry.network, entry.incoming_bytes, entry.outgoing_bytes]
+
+
+def network_entry(row: list) -> NetworkUsage:
+    date_str, hour, network, incoming_bytes, outgoing_bytes = row
+    return NetworkUsage(date_str=date_str, hour=hour, network=network,
+                        incoming_bytes=incoming_bytes, outgoing_bytes=outgoing_bytes)
+
+
+def process_row(entry: ProcessUsage) -> list:
+    return [entry.date_str, entry.hour, entry.name, entry.path, entry.incoming_bytes, entry.outgoing_bytes,
+            entry.sample_rate, entry.byte_variance]
+
+
+def process_entry(row: list) -> ProcessUsage:
+    date_str, hour, name, path, incoming_bytes, outgoing_bytes, sample_rate, byte_variance = row
+    return ProcessUsage(pid=0, name=name, path=path, date_str=date_str, hour=hour,
+                        incoming_bytes=incoming_bytes, outgoing_bytes=outgoing_bytes,
+                        sample_rate=sample_rate, byte_variance=byte_variance)
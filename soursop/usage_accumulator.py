@@ -0,0 +1,125 @@
+import time
+from datetime import datetime, timedelta
+from threading import Lock
+from typing import Callable
+
+from soursop import util
+from soursop.beans import ProcessInfo, ProcessUsage
+from soursop.usage_journal import NO_SLOT, UsageJournal
+
+
+class UsageAccumulator:
+    """
+    In-memory per-(pid, name, hour bucket) traffic counters.
+    Each packet only touches a dict entry of plain integers, the writer swaps the whole map out with drain().
+    """
+
+    def __init__(self, max_entries: int = util.MAX_USAGE_ENTRIES,
+                 request_flush: Callable[[], None] | None = None) -> None:
+        # (pid, name, bucket) -> [path, incoming_bytes, outgoing_bytes, packet_count, journal slot,
+        #                         sample_rate, byte_variance]
+        self._counters: dict[tuple[int, str, int], list] = {}
+        self._lock = Lock()
+        self._max_entries = max_entries
+        self._high_watermark = max(1, max_entries * 4 // 5)
+        self._request_flush = request_flush or (lambda: None)
+        self._bucket = 0
+        # bucket -> (date_str, hour), a bucket is not always a whole UTC hour away from the local hour start
+        self._hour_labels: dict[int, tuple[str, int]] = {}
+        self._next_hour_ts = 0.0
+        self._journal: UsageJournal | None = None
+        self.dropped_packets = 0
+        self.dropped_bytes = 0
+
+    def get_stats(self) -> dict:
+        return {
+            "attribution_usage_entries": len(self._counters),
+            "attribution_dropped_packets_total": self.dropped_packets,
+            "attribution_dropped_bytes_total": self.dropped_bytes,
+        }
+
+    def attach_journal(self, journal: UsageJournal) -> None:
+        """Mirror every counter into the journal, so the usage not drained yet survives a crash."""
+        self._journal = journal
+
+    def _roll_hour(self, now: float) -> None:
+        """Start counting in the hour holding now, called under the lock."""
+        current = datetime.fromtimestamp(now).replace(minute=0, second=0, microsecond=0)
+        bucket = util.hour_bucket(current)
+        self._hour_labels[bucket] = (current.strftime(util.DB_DATE_FORMAT), current.hour)
+        self._bucket = bucket
+        self._next_hour_ts = (current + timedelta(hours=1)).timestamp()
+
+    def add(self, process_info: ProcessInfo, incoming_bytes: int, outgoing_bytes: int, packet_count: int = 1,
+            sample_rate: int = 1) -> None:
+        """Add packets of a process, the bytes and packet count of sampled packets come scaled by sample_rate."""
+        now = time.time()
+        with self._lock:
+            if now >= self._next_hour_ts:
+                self._roll_hour(now)
+            key = (process_info.pid, process_info.name, self._bucket)
+            counters = self._counters.get(key)
+            if counters is None:
+                if len(self._counters) >= self._max_entries:
+                    # map is full, drop the packet and ask for an early flush
+                    self.dropped_packets += packet_count
+                    self.dropped_bytes += incoming_bytes + outgoing_bytes
+                    self._request_flush()
+                    return
+                slot = NO_SLOT
+                if self._journal is not None:
+                    date_str, hour = self._hour_labels[self._bucket]
+                    slot = self._journal.add_slot(process_info.pid, process_info.name, process_info.path,
+                                                  self._bucket, date_str, hour)
+                counters = self._counters[key] = [process_info.path, 0, 0, 0, slot, 1, 0.0]
+                if len(self._counters) == self._high_watermark or (slot == NO_SLOT and self._journal is not None):
+                    self._request_flush()
+            counters[1] += incoming_bytes
+            counters[2] += outgoing_bytes
+            counters[3] += packet_count
+            if sample_rate > 1:
+                # each of the packets stood for sample_rate packets, the estimate of their bytes
+                # has a variance of (rate - 1) * bytes^2, with bytes split evenly over the packets
+                scaled_bytes = incoming_bytes + outgoing_bytes
+                counters[5] = max(counters[5], sample_rate)
+                counters[6] += (sample_rate - 1) * scaled_bytes * scaled_bytes / packet_count
+            if counters[4] != NO_SLOT:
+                self._journal.update(counters[4], counters[1], counters[2], counters[3])
+                if sample_rate > 1:
+                    self._journal.update_sampling(counters[4], counters[5], counters[6])
+
+    def drain(self) -> list[ProcessUsage]:
+        """Atomically swap out the current counters and return them as usage entries."""
+        with self._lock:
+            if self._journal is not None:
+                if not self._journal.can_seal():
+                    return []  # the previous drain is not committed yet, keep counting until it is
+                self._journal.seal()
+            counters = self._counters
+            self._counters = {}
+            hour_labels = self._hour_labels
+            self._hour_labels = {self._bucket: hour_labels[self._bucket]} if self._bucket in hour_labels else {}
+        return self._to_entries(counters, hour_labels)
+
+    def peek(self) -> list[ProcessUsage]:
+        """The current counters as usage entries, without draining them."""
+        with self._lock:
+            counters = {key: list(counters_of_key) for key, counters_of_key in self._counters.items()}
+            hour_labels = dict(self._hour_labels)
+        return self._to_entries(counters, hour_labels)
+
+    @staticmethod
+    def _to_entries(counters: dict[tuple[int, str, int], list],
+                    hour_labels: dict[int, tuple[str, int]]) -> list[ProcessUsage]:
+        entries = []
+        for (pid, name, bucket), counters_of_key in counters.items():
+            path, incoming, outgoing, packet_count, _, sample_rate, variance = counters_of_key
+            date_str, hour = hour_labels[bucket]
+            entries.append(ProcessUsage(pid=pid, name=name, path=path, bucket=bucket, date_str=date_str, hour=hour,
+                                        network=None, incoming_bytes=incoming, outgoing_bytes=outgoing,
+                                        packet_count=packet_count, sample_rate=sample_rate,
+                                        byte_variance=variance))
+        return entries
+
+    def __len__(self) -> int:
+        return len(self._counters)
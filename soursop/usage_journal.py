@@ -0,0 +1,224 @@
+import mmap
+import os
+import struct
+from datetime import date
+from pathlib import Path
+from typing import Callable
+
+from soursop import util
+from soursop.beans import NetworkUsage, ProcessUsage
+
+_MAGIC = b"SOURSOPJ"
+_VERSION = 3
+
+# magic, version, slots per region, string bytes per region, network slots, journal id
+_HEADER = struct.Struct("=8sIIIIq")
+# state, used slots, used string bytes, sequence number of the region since the journal was reset
+_REGION_HEADER = struct.Struct("=IIIq")
+# bucket, pid, incoming_bytes, outgoing_bytes, packet_count, date ordinal, hour, string offset,
+# sample rate, byte variance
+_SLOT = struct.Struct("=qqqqqiiIId")
+_SLOT_COUNTERS = struct.Struct("=qqq")
+_SLOT_COUNTERS_OFFSET = 16
+_SLOT_SAMPLING = struct.Struct("=Id")
+_SLOT_SAMPLING_OFFSET = 52
+# name length, path length, followed by the utf-8 name and path
+_STRING_HEADER = struct.Struct("=HH")
+# interface name, bucket, date ordinal, hour, incoming_bytes, outgoing_bytes
+_NETWORK_SLOT = struct.Struct("=16sqiiqq")
+_NETWORK_SLOTS = 64
+
+_EMPTY, _ACTIVE, _SEALED = 0, 1, 2
+NO_SLOT = -1
+
+
+class UsageJournal:
+    """
+    Fixed-size memory mapped file, on tmpfs under /run/soursop, mirroring the usage that is not in the database yet,
+    so it survives a crash or restart of the daemon and is replayed on startup. It holds two regions of process
+    usage slots: counters are updated in the active region as packets are accounted, a drain seals it and switches
+    to the other one, and a sealed region is emptied once its usage is committed. The network interface totals of
+    the current hour are kept in a separate area. Only touched pages of the file take memory.
+    Sealed regions are numbered, and the writer stores the number of the last one it committed along with the usage,
+    so a region committed just before a crash is not replayed a second time.
+    """
+
+    def __init__(self, path: Path, slots: int = util.MAX_USAGE_ENTRIES, string_bytes: int = 0) -> None:
+        self._path = path
+        self._slots = slots
+        self._string_bytes = string_bytes or slots * 64
+        self._region_size = _REGION_HEADER.size + slots * _SLOT.size + self._string_bytes
+        self._network_offset = _HEADER.size + 2 * self._region_size
+        self._size = self._network_offset + _NETWORK_SLOTS * _NETWORK_SLOT.size
+        self._active = 0
+        # random id of the journal since its last reset, and the number of the active region
+        self._journal_id = 0
+        self._sequence = 0
+        # (name, path) -> string offset in the active region
+        self._strings: dict[tuple[str, str], int] = {}
+        self._mm: mmap.mmap | None = None
+        self.unjournaled_entries = 0
+
+    def open(self, committed_sequence: Callable[[int], int] = lambda journal_id: 0) \
+            -> tuple[list[ProcessUsage], list[NetworkUsage]]:
+        """
+        Map the journal file and return the usage it still holds from the previous run. Regions up to
+        committed_sequence(journal id) are skipped, they are in the database already.
+        """
+        self._path.parent.mkdir(parents=True, exist_ok=True)
+        fd = os.open(self._path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            recreate = os.fstat(fd).st_size != self._size
+            if recreate:
+                os.ftruncate(fd, 0)
+                os.ftruncate(fd, self._size)
+            self._mm = mmap.mmap(fd, self._size)
+        finally:
+            os.close(fd)
+
+        *header, journal_id = _HEADER.unpack_from(self._mm, 0)
+        if recreate or header != [_MAGIC, _VERSION, self._slots, self._string_bytes, _NETWORK_SLOTS]:
+            return [], []
+
+        # the replay commits every region left over, as if both were sealed
+        self._journal_id = journal_id
+        self._sequence = max(self._region_sequence(0), self._region_sequence(1)) + 1
+        committed = committed_sequence(journal_id)
+        process_entries = []
+        for region in (0, 1):
+            if self._region_sequence(region) > committed:
+                process_entries += self._read_region(region)
+        return process_entries, self._read_network()
+
+    def reset(self) -> None:
+        """
+        Forget the replayed usage and start with an empty active region, stale slots past the counts are ignored.
+        The journal gets a new id, so the committed number stored in the database never covers a new region.
+        """
+        self._journal_id = int.from_bytes(os.urandom(8), "little") >> 1
+        self._sequence = 1
+        _HEADER.pack_into(self._mm, 0, _MAGIC, _VERSION, self._slots, self._string_bytes, _NETWORK_SLOTS,
+                          self._journal_id)
+        self._active = 0
+        self._strings = {}
+        self._set_region(0, _ACTIVE, 0, 0, self._sequence)
+        self._set_region(1, _EMPTY, 0, 0)
+        self._mm[self._network_offset:self._size] = bytes(self._size - self._network_offset)
+
+    def close(self) -> None:
+        if self._mm is not None:
+            self._mm.close()
+            self._mm = None
+
+    def _region_offset(self, region: int) -> int:
+        return _HEADER.size + region * self._region_size
+
+    def _set_region(self, region: int, state: int, used_slots: int, used_strings: int, sequence: int = 0) -> None:
+        _REGION_HEADER.pack_into(self._mm, self._region_offset(region), state, used_slots, used_strings, sequence)
+
+    def _region_sequence(self, region: int) -> int:
+        return _REGION_HEADER.unpack_from(self._mm, self._region_offset(region))[3]
+
+    def _read_region(self, region: int) -> list[ProcessUsage]:
+        offset = self._region_offset(region)
+        state, used_slots, _, _ = _REGION_HEADER.unpack_from(self._mm, offset)
+        if state == _EMPTY:
+            return []
+        strings_offset = offset + _REGION_HEADER.size + self._slots * _SLOT.size
+        entries = []
+        for index in range(min(used_slots, self._slots)):
+            (bucket, pid, incoming, outgoing, packet_count, ordinal, hour, string_offset,
+             sample_rate, variance) = _SLOT.unpack_from(self._mm, offset + _REGION_HEADER.size + index * _SLOT.size)
+            if incoming == 0 and outgoing == 0:
+                continue
+            name_length, path_length = _STRING_HEADER.unpack_from(self._mm, strings_offset + string_offset)
+            start = strings_offset + string_offset + _STRING_HEADER.size
+            name = self._mm[start:start + name_length].decode()
+            path = self._mm[start + name_length:start + name_length + path_length].decode()
+            entries.append(ProcessUsage(pid=pid, name=name, path=path, bucket=bucket,
+                                        date_str=date.fromordinal(ordinal).strftime(util.DB_DATE_FORMAT), hour=hour,
+                                        network=None, incoming_bytes=incoming, outgoing_bytes=outgoing,
+                                        packet_count=packet_count, sample_rate=sample_rate,
+                                        byte_variance=variance))
+        return entries
+
+    def _read_network(self) -> list[NetworkUsage]:
+        entries = []
+        for index in range(_NETWORK_SLOTS):
+            name, bucket, ordinal, hour, incoming, outgoing = _NETWORK_SLOT.unpack_from(
+                self._mm, self._network_offset + index * _NETWORK_SLOT.size)
+            if not ordinal:
+                break
+            entries.append(NetworkUsage(network=name.rstrip(b"\0").decode(), bucket=bucket,
+                                        date_str=date.fromordinal(ordinal).strftime(util.DB_DATE_FORMAT), hour=hour,
+                                        incoming_bytes=incoming, outgoing_bytes=outgoing))
+        return entries
+
+    def add_slot(self, pid: int, name: str, path: str, bucket: int, date_str: str, hour: int) -> int:
+        """Reserve a slot of the active region for a new accumulator entry, NO_SLOT when the region is full."""
+        offset = self._region_offset(self._active)
+        _, used_slots, used_strings, _ = _REGION_HEADER.unpack_from(self._mm, offset)
+        string_offset = self._strings.get((name, path))
+        if string_offset is None:
+            encoded_name, encoded_path = name.encode(), path.encode()
+            length = _STRING_HEADER.size + len(encoded_name) + len(encoded_path)
+            if used_strings + length > self._string_bytes:
+                self.unjournaled_entries += 1
+                return NO_SLOT
+            start = offset + _REGION_HEADER.size + self._slots * _SLOT.size + used_strings
+            _STRING_HEADER.pack_into(self._mm, start, len(encoded_name), len(encoded_path))
+            self._mm[start + _STRING_HEADER.size:start + length] = encoded_name + encoded_path
+            string_offset = self._strings[(name, path)] = used_strings
+            used_strings += length
+        if used_slots >= self._slots:
+            self.unjournaled_entries += 1
+            return NO_SLOT
+
+        ordinal = date.fromisoformat(date_str).toordinal()
+        _SLOT.pack_into(self._mm, offset + _REGION_HEADER.size + used_slots * _SLOT.size,
+                        bucket, pid, 0, 0, 0, ordinal, hour, string_offset, 1, 0.0)
+        self._set_region(self._active, _ACTIVE, used_slots + 1, used_strings, self._sequence)
+        return used_slots
+
+    def update(self, slot: int, incoming_bytes: int, outgoing_bytes: int, packet_count: int) -> None:
+        """Store the current counters of an accumulator entry."""
+        _SLOT_COUNTERS.pack_into(self._mm, self._region_offset(self._active) + _REGION_HEADER.size
+                                 + slot * _SLOT.size + _SLOT_COUNTERS_OFFSET,
+                                 incoming_bytes, outgoing_bytes, packet_count)
+
+    def update_sampling(self, slot: int, sample_rate: int, byte_variance: float) -> None:
+        _SLOT_SAMPLING.pack_into(self._mm, self._region_offset(self._active) + _REGION_HEADER.size
+                                 + slot * _SLOT.size + _SLOT_SAMPLING_OFFSET, sample_rate, byte_variance)
+
+    def can_seal(self) -> bool:
+        """A drain needs the other region, which is only free once the previous drain was committed."""
+        return _REGION_HEADER.unpack_from(self._mm, self._region_offset(1 - self._active))[0] == _EMPTY
+
+    def seal(self) -> None:
+        """Keep the active region until its usage is committed, and continue in the other one."""
+        offset = self._region_offset(self._active)
+        _, used_slots, used_strings, _ = _REGION_HEADER.unpack_from(self._mm, offset)
+        self._set_region(self._active, _SEALED, used_slots, used_strings, self._sequence)
+        self._sequence += 1
+        self._active = 1 - self._active
+        self._strings = {}
+        self._set_region(self._active, _ACTIVE, 0, 0, self._sequence)
+
+    def committed_marker(self) -> tuple[int, int]:
+        """(journal id, number of the last sealed region), stored by the writer in the transaction of its usage."""
+        return self._journal_id, self._sequence - 1
+
+    def release_sealed(self) -> None:
+        """Called after a commit, the usage of the sealed region is in the database now."""
+        sealed = 1 - self._active
+        if _REGION_HEADER.unpack_from(self._mm, self._region_offset(sealed))[0] == _SEALED:
+            self._set_region(sealed, _EMPTY, 0, 0)
+
+    def set_network_totals(self, entries: list[NetworkUsage]) -> None:
+        """Replace the network area with the current hour totals of every interface."""
+        area = bytearray(_NETWORK_SLOTS * _NETWORK_SLOT.size)
+        for index, entry in enumerate(entries[:_NETWORK_SLOTS]):
+            _NETWORK_SLOT.pack_into(area, index * _NETWORK_SLOT.size, entry.network.encode()[:16], entry.bucket,
+                                    date.fromisoformat(entry.date_str).toordinal(), entry.hour,
+                                    entry.incoming_bytes, entry.outgoing_bytes)
+        self._mm[self._network_offset:self._network_offset + len(area)] = area
@@ -10,6 +10,25 @@ FIVE_SECONDS = 5
 FIFTEEN_SECONDS = 15
 ONE_MINUTE = 60
 
+# upper bound of distinct (pid, name, hour) entries held in memory between two flushes
+MAX_USAGE_ENTRIES = 50_000
+# closed sockets stay in the connection table this long, and the table never holds more than MAX_CONNECTIONS
+CONNECTION_TTL = 2 * ONE_MINUTE
+MAX_CONNECTIONS = 100_000
+# packets of unknown connections wait this long for an on-demand lookup of their owner
+PENDING_CONNECTION_TTL = FIVE_SECONDS
+MAX_PENDING_CONNECTIONS = 1024
+MAX_CONNECTION_LOOKUPS_PER_SECOND = 200
+# number of processes kept in the process metadata cache
+MAX_PROCESS_CACHE = 4096
+# interface totals are written once they grew by this many bytes, and always when the hour rolls over
+NETWORK_WRITE_THRESHOLD = 1024 * 1024
+# bytes of every packet copied from the kernel, enough for IPv4 options or IPv6 extension headers and the ports,
+# byte counts come from the IP header
+CAPTURE_SNAPLEN = 256
+# z-score of the two-sided 95% error bounds shown for sampled usage
+ERROR_BOUND_Z = 1.96
+
 BOLD_START = "\033[1m"
 BOLD_END = "\033[0m"
 DB_DATE_FORMAT = "%Y-%m-%d"
@@ -27,6 +46,14 @@ def convert_bytes_to_human_readable(bytes_count):
         return f"{bytes_count / (1024 ** 3):.2f} GB"
 
 
+def format_error_bound(incoming_bytes: int, outgoing_bytes: int, byte_variance: float) -> str:
+    """95% error bound of a sampled byte total relative to the total, empty for exact counts."""
+    total = incoming_bytes + outgoing_bytes
+    if not byte_variance or not total:
+        return ""
+    return f"±{min(99, round(ERROR_BOUND_Z * byte_variance ** 0.5 / total * 100))}%"
+
+
 def parse_level(argument: str) -> Level:
     mapping = {
         "hour": Level.HOUR, "h": Level.HOUR,
@@ -86,6 +113,59 @@ def compute_range_from_window(days: Optional[int] = None,
     return start, end
 
 
+def hour_bucket(hour_start: datetime) -> int:
+    """Epoch hour of the local hour starting at hour_start, the time key of the usage tables."""
+    return int(hour_start.timestamp()) // 3600
+
+
+def date_bucket(date_obj: date) -> int:
+    """Bucket of the first hour of a local date."""
+    return hour_bucket(datetime.combine(date_obj, datetime.min.time()))
+
+
+def period_start(date_obj: date, level: Level) -> date:
+    """First date of the day, ISO week or month holding date_obj."""
+    if level == Level.WEEK:
+        return date_obj - timedelta(days=date_obj.weekday())
+    if level == Level.MONTH:
+        return date_obj.replace(day=1)
+    return date_obj
+
+
+def next_period_start(date_obj: date, level: Level) -> date:
+    start = period_start(date_obj, level)
+    if level == Level.WEEK:
+        return start + timedelta(weeks=1)
+    if level == Level.MONTH:
+        return (start + timedelta(days=32)).replace(day=1)
+    return start + timedelta(days=1)
+
+
+def split_by_rollup(from_date: date, to_date: date, level: Level) -> list[tuple[Level, date, date]]:
+    """
+    Split a date range into (rollup level, from, to) parts: the whole weeks or months inside the range
+    are read from the rollup of the level, the partial ones at the edges from the day rollup.
+    """
+    if level in (Level.HOUR, Level.DAY):
+        return [(level, from_date, to_date)]
+
+    first = from_date if period_start(from_date, level) == from_date else next_period_start(from_date, level)
+    if next_period_start(to_date, level) - timedelta(days=1) == to_date:
+        last = to_date
+    else:
+        last = period_start(to_date, level) - timedelta(days=1)
+    if first > last:
+        return [(Level.DAY, from_date, to_date)]
+
+    parts = []
+    if from_date < first:
+        parts.append((Level.DAY, from_date, first - timedelta(days=1)))
+    parts.append((level, first, last))
+    if last < to_date:
+        parts.append((Level.DAY, last + timedelta(days=1), to_date))
+    return parts
+
+
 def derive_time_range(date_str: str, hour: int, level: Level) -> str:
     date_obj = datetime.strptime(date_str, DB_DATE_FORMAT).date()
     formatted_date = date_obj.strftime(CONSOLE_DATE_FORMAT)
@@ -95,7 +175,7 @@ def derive_time_range(date_str: str, hour: int, level: Level) -> str:
     elif level == Level.DAY:
         return formatted_date
     elif level == Level.MONTH:
-        return date_obj.strftime("%B")
+        return date_obj.strftime("%B %Y")
     else:
-        week_num = date_obj.isocalendar().week
-        return f"{week_num:02d}"
+        iso_year, week_num, _ = date_obj.isocalendar()
+        return f"Week {week_num:02d} {iso_year}"
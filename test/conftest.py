@@ -0,0 +1,18 @@
+import pytest
+
+import soursop.db.connection as connection
+import soursop.db.process_repository as process_repository
+import soursop.db.writer as writer
+
+
+@pytest.fixture
+def database(tmp_path, monkeypatch):
+    """A fresh, fully migrated database the repositories and the writer use instead of the system one."""
+    monkeypatch.setattr(connection, "DB_PATH", tmp_path / "soursop.db")
+    monkeypatch.setattr(writer, "_PENDING_NETWORK", {})
+    monkeypatch.setattr(writer, "_PENDING_PROCESS", [])
+    monkeypatch.setattr(writer, "_JOURNAL", None)
+    connection.init_db()
+    yield connection.DB_PATH
+    writer.close()
+    process_repository.forget_identity_ids()
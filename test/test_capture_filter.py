@@ -0,0 +1,101 @@
+import socket
+import struct
+
+import pytest
+
+from soursop.daemon import capture_filter
+
+LOOPBACK_INDEX = 1
+WIFI_INDEX = 3
+IPV4_ADDRESSES = [f"192.168.1.{host}" for host in range(10, 26)]
+IPV6_ADDRESSES = [f"2001:db8::{host:x}" for host in range(1, 17)]
+FOREIGN_IPV4, FOREIGN_IPV6 = "10.0.0.1", "2001:db8:1::1"
+HEADERS = capture_filter._ACCEPT_HEADERS
+WHOLE = capture_filter._ACCEPT_WHOLE
+
+
+def run_filter(program: bytes, packet: bytes, ifindex: int = WIFI_INDEX) -> int:
+    """Interpret the classic BPF instructions the filter uses, loads past the packet end drop it like the kernel."""
+    instructions = [capture_filter._INSTRUCTION.unpack_from(program, offset)
+                    for offset in range(0, len(program), capture_filter._INSTRUCTION.size)]
+    accumulator, pc = 0, 0
+    while True:
+        assert 0 <= pc < len(instructions), f"jump out of the program to {pc}"
+        code, jt, jf, k = instructions[pc]
+        if code in (capture_filter._BPF_LD_W_ABS, capture_filter._BPF_LD_H_ABS, capture_filter._BPF_LD_B_ABS):
+            if k == capture_filter._SKF_AD_IFINDEX:
+                accumulator = ifindex
+            else:
+                size = {capture_filter._BPF_LD_W_ABS: 4, capture_filter._BPF_LD_H_ABS: 2}.get(code, 1)
+                if k + size > len(packet):
+                    return 0
+                accumulator = int.from_bytes(packet[k:k + size], "big")
+        elif code == capture_filter._BPF_RSH_K:
+            accumulator >>= k
+        elif code == capture_filter._BPF_JA:
+            pc += k
+        elif code == capture_filter._BPF_JEQ_K:
+            pc += jt if accumulator == k else jf
+        elif code == capture_filter._BPF_RET_K:
+            return k
+        else:
+            pytest.fail(f"unexpected opcode {code:#x}")
+        pc += 1
+
+
+def ipv4_packet(source: str, destination: str, protocol: int = socket.IPPROTO_TCP, length: int = 60) -> bytes:
+    return (struct.pack("!BBHHHBBH", 0x45, 0, length, 0, 0, 64, protocol, 0)
+            + socket.inet_aton(source) + socket.inet_aton(destination) + bytes(20))
+
+
+def ipv6_packet(source: str, destination: str, length: int = 20) -> bytes:
+    return (struct.pack("!IHBB", 6 << 28, length, socket.IPPROTO_TCP, 64)
+            + socket.inet_pton(socket.AF_INET6, source) + socket.inet_pton(socket.AF_INET6, destination) + bytes(20))
+
+
+@pytest.fixture(scope="module")
+def program() -> bytes:
+    """The largest program: as many addresses as the filter takes, half of them IPv4 and half IPv6."""
+    return capture_filter.compile_filter(IPV4_ADDRESSES + IPV6_ADDRESSES, LOOPBACK_INDEX)
+
+
+@pytest.mark.parametrize("address", IPV4_ADDRESSES)
+def test_every_ipv4_address_is_matched_as_source_and_destination(program, address):
+    assert run_filter(program, ipv4_packet(address, FOREIGN_IPV4)) == HEADERS
+    assert run_filter(program, ipv4_packet(FOREIGN_IPV4, address, socket.IPPROTO_UDP)) == HEADERS
+
+
+@pytest.mark.parametrize("address", IPV6_ADDRESSES)
+def test_every_ipv6_address_is_matched_as_source_and_destination(program, address):
+    assert run_filter(program, ipv6_packet(address, FOREIGN_IPV6)) == HEADERS
+    assert run_filter(program, ipv6_packet(FOREIGN_IPV6, address)) == HEADERS
+
+
+def test_other_packets_are_dropped(program):
+    assert run_filter(program, ipv4_packet(FOREIGN_IPV4, "10.0.0.2")) == 0
+    assert run_filter(program, ipv4_packet(IPV4_ADDRESSES[0], FOREIGN_IPV4, socket.IPPROTO_ICMP)) == 0
+    assert run_filter(program, ipv6_packet(FOREIGN_IPV6, "2001:db8:1::2")) == 0
+    # an address differing from a monitored one only in its last word
+    assert run_filter(program, ipv6_packet("2001:db8::ffff", FOREIGN_IPV6)) == 0
+    assert run_filter(program, ipv4_packet(IPV4_ADDRESSES[0], FOREIGN_IPV4), ifindex=LOOPBACK_INDEX) == 0
+
+
+def test_packets_without_an_ip_length_are_kept_whole(program):
+    assert run_filter(program, ipv4_packet(IPV4_ADDRESSES[-1], FOREIGN_IPV4, length=0)) == WHOLE
+    assert run_filter(program, ipv6_packet(FOREIGN_IPV6, IPV6_ADDRESSES[-1], length=0)) == WHOLE
+
+
+def test_too_many_addresses_fall_back_to_the_protocol_filter():
+    program = capture_filter.compile_filter(IPV4_ADDRESSES + IPV6_ADDRESSES + ["192.168.2.1"], LOOPBACK_INDEX)
+
+    assert program == capture_filter.compile_protocol_filter(LOOPBACK_INDEX)
+    assert run_filter(program, ipv4_packet(FOREIGN_IPV4, "10.0.0.2")) == HEADERS
+    assert run_filter(program, ipv4_packet(FOREIGN_IPV4, "10.0.0.2", socket.IPPROTO_ICMP)) == 0
+    assert run_filter(program, ipv6_packet(FOREIGN_IPV6, "2001:db8:1::2")) == HEADERS
+
+
+@pytest.mark.parametrize("addresses", [[], IPV4_ADDRESSES[:1], IPV6_ADDRESSES[:1], IPV4_ADDRESSES + IPV6_ADDRESSES])
+def test_the_kernel_accepts_the_program(addresses):
+    """The kernel checks every jump target when a filter is attached, any socket will do."""
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        capture_filter.attach_filter(sock, capture_filter.compile_filter(addresses, LOOPBACK_INDEX))
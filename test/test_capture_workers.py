@@ -0,0 +1,79 @@
+import queue
+import threading
+
+from soursop import util
+from soursop.daemon import capture_filter, capture_workers
+from soursop.daemon.capture_workers import FlowAccumulator, merge_deltas
+from soursop.daemon.packet_parser import IPPROTO_TCP, IPPROTO_UDP
+
+OUTGOING = (IPPROTO_TCP, 51000, 443, "192.168.1.10", "93.184.216.34")
+INCOMING = (IPPROTO_TCP, 443, 51000, "93.184.216.34", "192.168.1.10")
+DNS = (IPPROTO_UDP, 5353, 53, "192.168.1.10", "192.168.1.1")
+
+
+def test_packets_of_a_flow_are_merged():
+    accumulator = FlowAccumulator()
+    accumulator.add(*OUTGOING, 1500)
+    accumulator.add(*INCOMING, 60)
+    accumulator.add(*OUTGOING, 500)
+    accumulator.add(*DNS, 80)
+
+    assert accumulator.drain() == {OUTGOING: [2000, 2], INCOMING: [60, 1], DNS: [80, 1]}
+
+
+def test_drain_starts_a_new_batch():
+    accumulator = FlowAccumulator()
+    accumulator.add(*OUTGOING, 1500)
+    accumulator.drain()
+    accumulator.add(*OUTGOING, 40)
+
+    assert accumulator.drain() == {OUTGOING: [40, 1]}
+    assert accumulator.drain() == {}
+
+
+def test_merged_flows_reach_the_handler_with_their_packet_count():
+    calls = []
+    merge_deltas({OUTGOING: [2000, 2], DNS: [80, 1]}, lambda *flow: calls.append(flow))
+
+    assert sorted(calls) == sorted([(*OUTGOING, 2000, 2), (*DNS, 80, 1)])
+
+
+def test_adds_from_several_threads_are_not_lost():
+    accumulator = FlowAccumulator()
+
+    def add_packets():
+        for _ in range(10000):
+            accumulator.add(*OUTGOING, 100)
+
+    threads = [threading.Thread(target=add_packets) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert accumulator.drain() == {OUTGOING: [4000000, 40000]}
+
+
+def test_sender_ships_batches_and_forwards_addresses(monkeypatch):
+    monkeypatch.setattr(capture_workers, "_MERGE_INTERVAL", 0.01)
+    monkeypatch.setattr(util, "RUNNING_FLAG", True)
+    monkeypatch.setattr(capture_filter, "_ADDRESSES", frozenset())
+    monkeypatch.setattr(capture_filter, "_PROGRAM", b"")
+    accumulator = FlowAccumulator()
+    output_queue, address_queue = queue.Queue(), queue.Queue()
+    stop_event = threading.Event()
+    accumulator.add(*OUTGOING, 1500)
+    address_queue.put(frozenset({"192.168.1.10"}))
+
+    sender = threading.Thread(target=capture_workers.send_deltas,
+                              args=(accumulator, output_queue, address_queue, stop_event))
+    sender.start()
+    try:
+        assert output_queue.get(timeout=5) == {OUTGOING: [1500, 1]}
+    finally:
+        stop_event.set()
+        sender.join()
+
+    assert capture_filter.get_addresses() == frozenset({"192.168.1.10"})
+    assert output_queue.empty()  # empty batches are not shipped
+    assert util.RUNNING_FLAG is False
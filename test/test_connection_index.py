@@ -0,0 +1,95 @@
+import os
+import socket
+import subprocess
+import sys
+
+import pytest
+
+from soursop.daemon import connection_index
+from soursop.daemon.connection_index import ConnectionIndex
+
+
+def listening_socket() -> socket.socket:
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.bind(("127.0.0.1", 0))
+    sock.listen()
+    return sock
+
+
+def owners(index: ConnectionIndex) -> dict[int, int]:
+    """Local port -> pid of the indexed TCP sockets."""
+    return {connection[2]: pid for connection, pid in index.refresh() if connection[0] == socket.IPPROTO_TCP}
+
+
+@pytest.fixture
+def index(monkeypatch):
+    # only the test process, so the refreshes stay fast and independent of the machine
+    own_pid = str(os.getpid())
+    real_listdir = os.listdir
+    monkeypatch.setattr(connection_index.os, "listdir",
+                        lambda path: [own_pid] if path == "/proc" else real_listdir(path))
+    return ConnectionIndex()
+
+
+def test_new_socket_is_indexed(index):
+    owners(index)
+    with listening_socket() as sock:
+        assert owners(index).get(sock.getsockname()[1]) == os.getpid()
+
+
+def test_socket_reopened_on_the_same_fd_is_indexed(index):
+    with listening_socket() as first:
+        fd = first.fileno()
+        assert owners(index).get(first.getsockname()[1]) == os.getpid()  # the one full walk of the first minute
+
+        with listening_socket() as second:
+            port = second.getsockname()[1]
+            os.dup2(second.fileno(), fd)  # the first socket is closed, the fd count stays the same after the with
+        assert owners(index).get(port) == os.getpid()
+
+
+def test_find_owner_walks_every_process_for_a_socket_on_a_reused_fd(index):
+    with open(os.devnull) as placeholder:
+        owners(index)
+        with listening_socket() as sock:
+            os.dup2(sock.fileno(), placeholder.fileno())  # a file fd turned into a socket, nothing else changed
+        inode = os.fstat(placeholder.fileno()).st_ino
+
+        assert index.find_owner(inode) == os.getpid()
+
+
+@pytest.fixture
+def foreign_socket():
+    """A listening socket of a child process, which the index does not walk, so it has no owner for it."""
+    child = subprocess.Popen([sys.executable, "-c", "import socket, sys, time\n"
+                              "sock = socket.create_server(('127.0.0.1', 0))\n"
+                              "print(sock.getsockname()[1], flush=True)\n"
+                              "time.sleep(60)"], stdout=subprocess.PIPE, text=True)
+    try:
+        yield int(child.stdout.readline())
+    finally:
+        child.kill()
+        child.wait()
+
+
+def test_sockets_without_an_owner_do_not_trigger_full_walks(index, foreign_socket):
+    owners(index)
+    assert index.get_stats()["orphan_sockets"] >= 1
+
+    index._next_full_scan = 0.0  # a minute later
+    owners(index)
+
+    assert index.last_scanned_pids == 0
+
+
+def test_failed_owner_lookups_are_not_repeated(index, monkeypatch):
+    owners(index)
+    walked = []
+    scan_pid = index._scan_pid
+    monkeypatch.setattr(index, "_scan_pid", lambda pid: walked.append(pid) or scan_pid(pid))
+
+    assert index.find_owner(1) is None
+    index._next_owner_walk = 0.0
+    assert index.find_owner(1) is None
+
+    assert walked == [os.getpid()]
@@ -0,0 +1,109 @@
+from collections import defaultdict
+from datetime import date, datetime
+
+import pytest
+
+import soursop.db.connection as connection
+import soursop.db.migrations as migrations
+import soursop.db.network_repository as network_repository
+import soursop.db.process_repository as process_repository
+import soursop.db.writer as writer
+from soursop import util
+from soursop.beans import Level, ProcessUsage
+from soursop.db import retention
+
+# (date_str, hour, network, incoming_bytes, outgoing_bytes), across a week and a month edge
+NETWORK_ROWS = [
+    ("2026-01-30", 10, "wlan0", 1000, 100),
+    ("2026-01-30", 11, "eth0", 2000, 200),
+    ("2026-01-31", 23, "wlan0", 3000, 300),
+    ("2026-02-02", 0, "wlan0", 4000, 400),
+    ("2026-02-02", 1, "eth0", 5000, 500),
+]
+# (date_str, hour, pid, name, path, incoming_bytes, outgoing_bytes), two pids of one process share its totals
+PROCESS_ROWS = [
+    ("2026-01-30", 10, 100, "browser", "/usr/bin/browser", 700, 70),
+    ("2026-01-30", 10, 101, "browser", "/usr/bin/browser", 300, 30),
+    ("2026-01-31", 23, 200, "ntpd", None, 50, 5),
+    ("2026-02-02", 0, 100, "browser", "/usr/bin/browser", 900, 90),
+]
+FROM_DATE, TO_DATE = date(2026, 1, 1), date(2026, 2, 28)
+
+
+def expected_totals(rows: list[tuple], key_of, level: Level) -> dict:
+    totals = defaultdict(lambda: [0, 0])
+    for row in rows:
+        date_str, hour = row[0], row[1]
+        if level != Level.HOUR:
+            day = datetime.strptime(date_str, util.DB_DATE_FORMAT).date()
+            date_str, hour = util.period_start(day, level).strftime(util.DB_DATE_FORMAT), 0
+        total = totals[(date_str, hour, *key_of(row))]
+        total[0] += row[-2]
+        total[1] += row[-1]
+    return {key: tuple(total) for key, total in totals.items()}
+
+
+@pytest.fixture
+def migrated_database(tmp_path, monkeypatch):
+    """A database created with the version 1 tables and rows, then migrated in batches of two rows."""
+    monkeypatch.setattr(connection, "DB_PATH", tmp_path / "soursop.db")
+    monkeypatch.setattr(migrations, "_BATCH_SIZE", 2)
+    with monkeypatch.context() as version_1:
+        version_1.setattr(migrations, "migrate", lambda conn: None)
+        connection.init_db()
+
+    with connection.get_connection() as conn:
+        conn.executemany("INSERT INTO network_usage (date_str, hour, network, incoming_bytes, outgoing_bytes) "
+                         "VALUES (?, ?, ?, ?, ?)", NETWORK_ROWS)
+        conn.executemany("INSERT INTO process_usage (date_str, hour, pid, name, path, network, incoming_bytes, "
+                         "outgoing_bytes, packet_count) VALUES (?, ?, ?, ?, ?, 'wlan0', ?, ?, 1)", PROCESS_ROWS)
+        conn.commit()
+        migrations.migrate(conn)
+    yield connection.DB_PATH
+    writer.close()
+    process_repository.forget_identity_ids()
+
+
+def test_migration_reaches_the_latest_schema_version_without_rebuilding_the_file(migrated_database):
+    with connection.get_connection() as conn:
+        assert migrations.get_schema_version(conn) == migrations.SCHEMA_VERSION
+        assert conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 0  # left to the one-off rebuild
+
+        assert retention.rebuild_for_incremental_vacuum(conn)
+        assert conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2  # incremental
+        assert not retention.rebuild_for_incremental_vacuum(conn)
+
+
+def test_new_database_starts_with_incremental_vacuum(database):
+    with connection.get_connection() as conn:
+        assert conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2
+
+
+@pytest.mark.parametrize("level", list(Level))
+def test_network_totals_are_preserved_per_level(migrated_database, level):
+    stored = network_repository.aggregate(level, FROM_DATE, TO_DATE, None)
+
+    assert {(e.date_str, e.hour, e.network): (e.incoming_bytes, e.outgoing_bytes) for e in stored} == \
+        expected_totals(NETWORK_ROWS, lambda row: (row[2],), level)
+
+
+@pytest.mark.parametrize("level", list(Level))
+def test_process_totals_are_preserved_per_level(migrated_database, level):
+    stored = process_repository.aggregate(level, FROM_DATE, TO_DATE, None)
+
+    assert {(e.date_str, e.hour, e.name, e.path): (e.incoming_bytes, e.outgoing_bytes) for e in stored} == \
+        expected_totals(PROCESS_ROWS, lambda row: (row[3], row[4] or ""), level)
+    assert {(e.sample_rate, e.byte_variance) for e in stored} == {(1, 0)}
+
+
+def test_rollup_triggers_keep_working_after_the_migration(migrated_database):
+    hour_start = datetime(2026, 2, 2, 0)
+    sampled = ProcessUsage(pid=100, name="browser", path="/usr/bin/browser", bucket=util.hour_bucket(hour_start),
+                           date_str="2026-02-02", hour=0, network="wlan0", incoming_bytes=100, outgoing_bytes=0,
+                           packet_count=10, sample_rate=10, byte_variance=900.0)
+    writer.submit_process_usages([sampled])
+    writer.flush()
+
+    for level in (Level.DAY, Level.WEEK, Level.MONTH):
+        [entry] = process_repository.aggregate(level, date(2026, 2, 1), TO_DATE, "browser")
+        assert (entry.incoming_bytes, entry.sample_rate, entry.byte_variance) == (1000, 10, 900.0)
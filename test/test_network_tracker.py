@@ -0,0 +1,109 @@
+import types
+from datetime import date, datetime
+
+import pytest
+
+import soursop.db.network_repository as network_repository
+import soursop.db.writer as writer
+from soursop.beans import Level
+from soursop.daemon import network_tracker, query_server
+from soursop.daemon.scheduler import Scheduler
+
+
+@pytest.fixture
+def tracker(database, monkeypatch):
+    """The network tracker without a journal, on a fake wlan0 whose counters and clock the test sets."""
+    state = {"counters": {"wlan0": (1000, 100)}, "now": datetime(2026, 1, 1, 10)}
+    monkeypatch.setattr(writer, "_FLUSH_HOOKS", [])
+    monkeypatch.setattr(writer, "_COMMIT_HOOKS", [])
+    monkeypatch.setattr(query_server, "_LIVE_SOURCES", {})
+    monkeypatch.setattr(network_tracker, "_INTERFACES", {})
+    monkeypatch.setattr(network_tracker, "_HOUR_START", None)
+    monkeypatch.setattr(network_tracker, "_UNCOMMITTED_HOURS", [])
+    monkeypatch.setattr(network_tracker, "_JOURNAL", None)
+    monkeypatch.setattr(network_tracker, "read_interface_counters", lambda: dict(state["counters"]))
+    monkeypatch.setattr(network_tracker, "is_physical_interface", lambda name: True)
+    monkeypatch.setattr(network_tracker, "get_time_now", lambda: (state["now"], state["now"].hour))
+    network_tracker.start_network_tracking(Scheduler(), journal=None)
+    return state
+
+
+def test_finished_hours_are_forgotten_once_written_without_a_journal(tracker):
+    tracker["counters"]["wlan0"] = (6000, 600)
+    network_tracker.track_network_usage()
+    tracker["now"] = datetime(2026, 1, 1, 11)
+    network_tracker.track_network_usage()
+
+    assert [(usage.hour, usage.incoming_bytes) for usage in network_tracker._UNCOMMITTED_HOURS] == [(10, 5000)]
+    writer.flush()
+
+    assert network_tracker._UNCOMMITTED_HOURS == []
+    stored = network_repository.aggregate(Level.HOUR, date(2026, 1, 1), date(2026, 1, 1), None)
+    assert [(entry.hour, entry.incoming_bytes, entry.outgoing_bytes) for entry in stored] == [(10, 5000, 500)]
+
+
+def test_hours_finished_during_a_flush_wait_for_the_next_one(tracker):
+    tracker["counters"]["wlan0"] = (6000, 600)
+    network_tracker.mark_uncommitted_hours()
+    tracker["now"] = datetime(2026, 1, 1, 11)
+    network_tracker.track_network_usage()
+    network_tracker.forget_uncommitted_hours()
+
+    assert len(network_tracker._UNCOMMITTED_HOURS) == 1
+
+
+def test_counter_delta_handles_wraps_and_resets():
+    assert network_tracker.counter_delta(1000, 1500) == 500
+    assert network_tracker.counter_delta(2 ** 32 - 100, 50) == 150  # a 32 bit counter wrapped
+    assert network_tracker.counter_delta(5000, 200) == 200  # the interface was re-created
+
+
+def test_read_interface_counters_parses_one_read_of_proc_net_dev(tmp_path, monkeypatch):
+    dev = tmp_path / "dev"
+    dev.write_text(
+        "Inter-|   Receive                                                |  Transmit\n"
+        " face |bytes    packets errs drop fifo frame compressed multicast|bytes    packets errs drop fifo colls "
+        "carrier compressed\n"
+        "    lo:    4200      42    0    0    0     0          0         0     4200      42    0    0    0     0 "
+        "      0          0\n"
+        " wlan0:12345678   9000    0    0    0     0          0         0   654321    5000    0    0    0     0 "
+        "      0          0\n")
+    monkeypatch.setattr(network_tracker, "_PROC_NET_DEV", str(dev))
+
+    assert network_tracker.read_interface_counters() == {"lo": (4200, 4200), "wlan0": (12345678, 654321)}
+
+
+def test_totals_are_written_once_they_cross_the_threshold(tracker, monkeypatch):
+    monkeypatch.setattr(network_tracker.util, "NETWORK_WRITE_THRESHOLD", 1000)
+    tracker["counters"]["wlan0"] = (1500, 200)
+    network_tracker.track_network_usage()
+    assert writer.get_pending()[0] == []
+
+    tracker["counters"]["wlan0"] = (1900, 250)
+    network_tracker.track_network_usage()
+    assert [(usage.incoming_bytes, usage.outgoing_bytes) for usage in writer.get_pending()[0]] == [(900, 150)]
+
+
+def test_hot_plugged_interfaces_are_tracked_and_counter_wraps_keep_the_total(tracker):
+    tracker["counters"]["wlan0"] = (2 ** 32 - 100, 100)
+    tracker["counters"]["eth0"] = (700, 70)
+    network_tracker.track_network_usage()
+    tracker["counters"]["wlan0"] = (400, 100)
+    tracker["counters"]["eth0"] = (1700, 70)
+    network_tracker.track_network_usage()
+
+    totals = {name: info.saved_incoming for name, info in network_tracker._INTERFACES.items()}
+    assert totals == {"wlan0": 2 ** 32 - 1100 + 500, "eth0": 1000}
+
+
+def test_every_journal_write_holds_the_current_totals(tracker, monkeypatch):
+    snapshots = []
+    journal = types.SimpleNamespace(set_network_totals=lambda entries: snapshots.append(
+        sorted((entry.hour, entry.incoming_bytes) for entry in entries)))
+    monkeypatch.setattr(network_tracker, "_JOURNAL", journal)
+    tracker["counters"]["wlan0"] = (1500, 150)
+    network_tracker.track_network_usage()
+    tracker["counters"]["wlan0"] = (1700, 170)
+    network_tracker.track_network_usage()
+
+    assert snapshots == [[(10, 500)], [(10, 700)]]
@@ -0,0 +1,63 @@
+import socket
+
+import pytest
+
+from soursop import util
+from soursop.daemon import capture_filter, packet_capture
+from soursop.daemon.packet_parser import IPPROTO_TCP, IPPROTO_UDP
+from test_packet_parser import ipv4_packet, ipv6_packet
+from test_packet_ring import build_block, read
+
+
+def padded(packet: bytes, length: int) -> bytes:
+    return packet + bytes(length - len(packet))
+
+
+@pytest.fixture
+def capture(monkeypatch):
+    """Runs capture_packets over a datagram socket pair, returns the send side and a function reading n packets."""
+    receiver, sender = socket.socketpair(socket.AF_UNIX, socket.SOCK_DGRAM)
+    monkeypatch.setattr(packet_capture, "open_packet_socket", lambda: receiver)
+    monkeypatch.setattr(packet_capture, "update_kernel_statistics", lambda sock: None)
+    monkeypatch.setattr(capture_filter, "register_socket", lambda sock: None)
+    monkeypatch.setattr(capture_filter, "unregister_socket", lambda sock: None)
+    monkeypatch.setattr(util, "RUNNING_FLAG", True)
+
+    def read_packets(count: int) -> list[tuple]:
+        packets = []
+
+        def handler(*connection):
+            packets.append(connection)
+            if len(packets) == count:
+                util.RUNNING_FLAG = False
+
+        packet_capture.capture_packets(handler)
+        return packets
+
+    yield sender, read_packets
+    sender.close()
+
+
+def test_truncated_reads_count_the_ip_length(capture):
+    sender, read_packets = capture
+    sender.send(padded(ipv4_packet(length=9000), 9000))
+    sender.send(padded(ipv6_packet(payload_length=1460), 1500))
+
+    assert read_packets(2) == [
+        (IPPROTO_TCP, 51000, 443, "192.168.1.10", "93.184.216.34", 9000),
+        (IPPROTO_UDP, 5353, 53, "2001:db8::1", "2001:db8::2", 1500),
+    ]
+
+
+def test_super_frames_without_an_ip_length_count_their_real_size(capture):
+    sender, read_packets = capture
+    sender.send(padded(ipv4_packet(length=0), 70000))
+    sender.send(padded(ipv6_packet(payload_length=0), 90000))
+
+    assert [packet[5] for packet in read_packets(2)] == [70000, 90000]
+
+
+def test_ring_frames_count_the_ip_length_or_the_frame_length():
+    block = build_block(0, [(ipv4_packet(length=9000), 9000), (ipv4_packet(length=0), 70000)])
+
+    assert [packet[5] for packet in read(block)] == [9000, 70000]
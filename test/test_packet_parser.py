@@ -0,0 +1,70 @@
+import socket
+import struct
+
+from soursop.daemon.packet_parser import IPPROTO_TCP, IPPROTO_UDP, parse_ip_packet
+
+
+def ipv4_packet(protocol: int = IPPROTO_TCP, length: int = 1500, fragment: int = 0, options: bytes = b"") -> bytes:
+    header = struct.pack("!BBHHHBBH4s4s", 0x45 + len(options) // 4, 0, length, 0, fragment, 64, protocol, 0,
+                         socket.inet_aton("192.168.1.10"), socket.inet_aton("93.184.216.34"))
+    return header + options + struct.pack("!HH", 51000, 443) + bytes(16)
+
+
+def ipv6_packet(next_header: int = IPPROTO_UDP, payload_length: int = 100, extensions: bytes = b"") -> bytes:
+    header = struct.pack("!IHBB16s16s", 6 << 28, payload_length, next_header, 64,
+                         socket.inet_pton(socket.AF_INET6, "2001:db8::1"),
+                         socket.inet_pton(socket.AF_INET6, "2001:db8::2"))
+    return header + extensions + struct.pack("!HH", 5353, 53) + bytes(4)
+
+
+def parse(packet: bytes, wire_length: int = 0):
+    return parse_ip_packet(memoryview(packet), 0, len(packet), wire_length)
+
+
+def test_ipv4_tcp_headers():
+    assert parse(ipv4_packet()) == (IPPROTO_TCP, 51000, 443, "192.168.1.10", "93.184.216.34", 1500)
+
+
+def test_ipv4_options_move_the_ports():
+    assert parse(ipv4_packet(options=bytes(8)))[1:3] == (51000, 443)
+
+
+def test_non_first_ipv4_fragment_has_no_ports():
+    assert parse(ipv4_packet(fragment=185)) is None
+    assert parse(ipv4_packet(fragment=0x2000)) is not None  # more fragments flag on the first fragment
+
+
+def test_other_protocols_and_truncated_headers_are_skipped():
+    assert parse(ipv4_packet(protocol=1)) is None
+    assert parse(ipv4_packet()[:22]) is None
+    assert parse(bytes(19)) is None
+
+
+def test_zero_ip_length_falls_back_to_the_wire_length():
+    assert parse(ipv4_packet(length=0), wire_length=65000)[5] == 65000
+    assert parse(ipv6_packet(payload_length=0), wire_length=70000)[5] == 70000
+
+
+def test_ipv6_udp_headers():
+    assert parse(ipv6_packet()) == (IPPROTO_UDP, 5353, 53, "2001:db8::1", "2001:db8::2", 140)
+
+
+def test_ipv6_extension_headers_are_skipped():
+    hop_by_hop = struct.pack("!BB", 60, 0) + bytes(6)  # 8 bytes, followed by destination options
+    destination_options = struct.pack("!BB", 44, 1) + bytes(14)  # 16 bytes, followed by a fragment header
+    first_fragment = struct.pack("!BBHI", IPPROTO_UDP, 0, 0x0001, 7)
+    packet = ipv6_packet(next_header=0, extensions=hop_by_hop + destination_options + first_fragment)
+
+    assert parse(packet)[:3] == (IPPROTO_UDP, 5353, 53)
+
+
+def test_non_first_ipv6_fragment_has_no_ports():
+    fragment = struct.pack("!BBHI", IPPROTO_UDP, 0, 1480 | 0x0001, 7)
+    assert parse(ipv6_packet(next_header=44, extensions=fragment)) is None
+
+
+def test_packet_at_an_offset_of_a_larger_buffer():
+    packet = ipv4_packet()
+    buffer = memoryview(bytes(14) + packet + bytes(10))
+
+    assert parse_ip_packet(buffer, 14, 14 + len(packet)) == parse(packet)
@@ -0,0 +1,61 @@
+import struct
+
+from soursop.daemon import packet_ring
+from soursop.daemon.packet_parser import IPPROTO_TCP, IPPROTO_UDP
+from test_packet_parser import ipv4_packet, ipv6_packet
+
+# TPACKET_ALIGN(sizeof(tpacket3_hdr)) + TPACKET_ALIGN(sizeof(sockaddr_ll)), the SOCK_DGRAM ring has no link
+# layer header, so tp_mac and tp_net both point at the IP header and tp_len is the IP packet length
+NET_OFFSET = 80
+
+
+def build_block(block_offset: int, frames: list[tuple[bytes, int]]) -> bytearray:
+    """A block as the kernel hands it over: the block header, then frames of (captured bytes, wire length)."""
+    first_frame = 48
+    block = bytearray(block_offset + first_frame + 256 * len(frames))
+    struct.pack_into("=IIIII", block, block_offset, 1, 0, packet_ring.TP_STATUS_USER, len(frames), first_frame)
+    frame_offset = block_offset + first_frame
+    for index, (captured, wire_length) in enumerate(frames):
+        next_offset = 256 if index < len(frames) - 1 else 0
+        struct.pack_into("=IIIIIIHH", block, frame_offset, next_offset, 0, 0, len(captured), wire_length, 1,
+                         NET_OFFSET, NET_OFFSET)
+        packet_start = frame_offset + NET_OFFSET
+        block[packet_start:packet_start + len(captured)] = captured
+        # garbage past the snap length must never be read as part of the packet
+        block[packet_start + len(captured):frame_offset + 256] = b"\xff" * (256 - NET_OFFSET - len(captured))
+        frame_offset += next_offset
+    return block
+
+
+def read(block: bytearray, block_offset: int = 0) -> list[tuple]:
+    packets = []
+    packet_ring.read_block(memoryview(block), block_offset, lambda *connection: packets.append(connection))
+    return packets
+
+
+def test_every_frame_of_a_block_is_handed_over():
+    block = build_block(0, [(ipv4_packet(), 1500), (ipv6_packet(), 140), (ipv4_packet(length=60), 60)])
+
+    assert read(block) == [
+        (IPPROTO_TCP, 51000, 443, "192.168.1.10", "93.184.216.34", 1500),
+        (IPPROTO_UDP, 5353, 53, "2001:db8::1", "2001:db8::2", 140),
+        (IPPROTO_TCP, 51000, 443, "192.168.1.10", "93.184.216.34", 60),
+    ]
+
+
+def test_frame_offsets_are_relative_to_the_block():
+    block_offset = 4096
+    block = build_block(block_offset, [(ipv6_packet(), 140), (ipv4_packet(), 1500)])
+    block[:block_offset] = b"\xff" * block_offset
+
+    assert [packet[0] for packet in read(block, block_offset)] == [IPPROTO_UDP, IPPROTO_TCP]
+
+
+def test_frames_without_tcp_udp_headers_are_skipped():
+    block = build_block(0, [(ipv4_packet(protocol=1), 1500), (ipv4_packet()[:22], 1500), (ipv6_packet(), 140)])
+
+    assert read(block) == [(IPPROTO_UDP, 5353, 53, "2001:db8::1", "2001:db8::2", 140)]
+
+
+def test_empty_block_hands_over_nothing():
+    assert read(build_block(0, [])) == []
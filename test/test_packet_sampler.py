@@ -0,0 +1,37 @@
+from soursop.daemon.packet_sampler import PacketSampler
+
+CONNECTION = (6, "192.168.1.10", 51000, "93.184.216.34", 443)
+
+
+def sampler(mode: str, rate: int) -> PacketSampler:
+    return PacketSampler(mode, rate, max_rate=rate, packet_budget=1, cpu_budget=1)
+
+
+def test_count_mode_keeps_every_nth_packet_of_single_packets():
+    count_sampler = sampler("count", 4)
+
+    assert [count_sampler.sample(CONNECTION) for _ in range(8)] == [(0, 4), (0, 4), (0, 4), (1, 4)] * 2
+
+
+def test_count_mode_thins_per_flow_deltas_packet_by_packet():
+    count_sampler = sampler("count", 4)
+    kept = [count_sampler.sample(CONNECTION, packet_count)[0] for packet_count in (3, 3, 10, 1, 2, 5)]
+
+    assert kept == [0, 1, 3, 0, 0, 2]
+    assert (count_sampler.seen_packets, count_sampler.sampled_packets) == (24, 6)  # exactly 1 in 4
+
+
+def test_flow_mode_keeps_or_skips_whole_deltas():
+    flow_sampler = sampler("flow", 2)
+    flows = [(6, "192.168.1.10", port, "93.184.216.34", 443) for port in range(51000, 51064)]
+    results = {flow_sampler.sample(flow, 7) for flow in flows}
+
+    assert results == {(0, 2), (7, 2)}
+    assert all(bool(flow_sampler.sample(flow, 7)[0]) == bool(flow_sampler.sample(flow, 1)[0]) for flow in flows)
+
+
+def test_rate_one_keeps_everything():
+    off_sampler = sampler("count", 1)
+
+    assert off_sampler.sample(CONNECTION, 5) == (5, 1)
+    assert off_sampler.sampled_packets == 5
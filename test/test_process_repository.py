@@ -0,0 +1,118 @@
+from datetime import date, datetime
+
+import pytest
+
+import soursop.db.process_repository as process_repository
+from soursop import util
+from soursop.beans import ProcessUsage
+from soursop.db.connection import open_writer_connection
+
+HOUR_START = datetime(2026, 3, 2, 9)
+
+
+def usage(pid: int = 100, name: str = "firefox", path: str = "/usr/lib/firefox/firefox", incoming: int = 1000,
+          outgoing: int = 100, packets: int = 10, sample_rate: int = 1, variance: float = 0.0) -> ProcessUsage:
+    return ProcessUsage(pid=pid, name=name, path=path, date_str=HOUR_START.strftime(util.DB_DATE_FORMAT),
+                        hour=HOUR_START.hour, bucket=util.hour_bucket(HOUR_START), network="wlan0",
+                        incoming_bytes=incoming, outgoing_bytes=outgoing, packet_count=packets,
+                        sample_rate=sample_rate, byte_variance=variance)
+
+
+@pytest.fixture
+def conn(database):
+    conn = open_writer_connection()
+    yield conn
+    conn.close()
+
+
+def stored_rows(conn) -> list[tuple]:
+    return conn.execute("""
+        SELECT u.pid, i.name, u.incoming_bytes, u.outgoing_bytes, u.packet_count, u.sample_rate, u.byte_variance
+        FROM process_usage u JOIN process_identity i ON i.id = u.identity_id ORDER BY u.pid, i.name
+    """).fetchall()
+
+
+def test_deltas_of_a_bucket_are_added_to_the_stored_row(conn):
+    with conn:
+        process_repository.add_usages(conn, [usage()])
+    with conn:
+        process_repository.add_usages(conn, [usage(incoming=500, outgoing=50, packets=5)])
+
+    assert stored_rows(conn) == [(100, "firefox", 1500, 150, 15, 1, 0.0)]
+
+
+def test_sampled_deltas_keep_the_highest_rate_and_the_summed_variance(conn):
+    with conn:
+        process_repository.add_usages(conn, [usage(sample_rate=4, variance=300.0)])
+    with conn:
+        process_repository.add_usages(conn, [usage(sample_rate=2, variance=200.0)])
+
+    assert stored_rows(conn) == [(100, "firefox", 2000, 200, 20, 4, 500.0)]
+
+
+def test_other_pids_and_processes_get_rows_of_their_own(conn):
+    with conn:
+        process_repository.add_usages(conn, [usage(), usage(pid=200), usage(name="curl", path="/usr/bin/curl")])
+
+    assert [row[:2] for row in stored_rows(conn)] == [(100, "curl"), (100, "firefox"), (200, "firefox")]
+
+
+def test_rows_of_other_hours_are_untouched(conn):
+    with conn:
+        process_repository.add_usages(conn, [usage()])
+        next_hour = usage()
+        next_hour.bucket += 1
+        next_hour.hour += 1
+        process_repository.add_usages(conn, [next_hour])
+
+    assert [row[2] for row in stored_rows(conn)] == [1000, 1000]
+    assert process_repository.search(date(2026, 3, 2), date(2026, 3, 2), "fire")[1].hour == 10
+
+
+def identities(conn) -> list[tuple[str, str]]:
+    return sorted(conn.execute("SELECT name, path FROM process_identity").fetchall())
+
+
+def test_identities_are_stored_once_and_cached(conn):
+    with conn:
+        process_repository.add_usages(conn, [usage(), usage(pid=200), usage(name="curl", path="/usr/bin/curl")])
+    statements = []
+    conn.set_trace_callback(statements.append)
+    with conn:
+        process_repository.add_usages(conn, [usage(pid=300)])
+    conn.set_trace_callback(None)
+
+    assert identities(conn) == [("curl", "/usr/bin/curl"), ("firefox", "/usr/lib/firefox/firefox")]
+    assert not any("process_identity" in statement for statement in statements)
+
+
+def test_missing_path_and_empty_path_are_one_identity(conn):
+    with conn:
+        process_repository.add_usages(conn, [usage(name="kworker", path=None), usage(name="kworker", path="")])
+
+    assert identities(conn) == [("kworker", "")]
+    assert [row[2] for row in stored_rows(conn)] == [2000]
+
+
+def test_forgotten_ids_are_looked_up_again(conn):
+    with conn:
+        ids = dict(process_repository.get_identity_ids(conn, {("firefox", "/usr/lib/firefox/firefox")}))
+    process_repository.forget_identity_ids()
+    with conn:
+        conn.execute("INSERT INTO process_identity (name, path) VALUES ('curl', '/usr/bin/curl')")
+        looked_up = process_repository.get_identity_ids(conn, {("firefox", "/usr/lib/firefox/firefox"),
+                                                               ("curl", "/usr/bin/curl")})
+
+    assert looked_up[("firefox", "/usr/lib/firefox/firefox")] == ids[("firefox", "/usr/lib/firefox/firefox")]
+    assert looked_up[("curl", "/usr/bin/curl")] == conn.execute(
+        "SELECT id FROM process_identity WHERE name = 'curl'").fetchone()[0]
+
+
+def test_name_search_matches_the_identity(conn):
+    with conn:
+        process_repository.add_usages(conn, [usage(), usage(name="curl", path="/usr/bin/curl")])
+
+    assert [entry.name for entry in process_repository.search(date(2026, 3, 2), date(2026, 3, 2), "url")] == \
+        ["curl"]
+    assert sorted(entry.path for entry in process_repository.search(date(2026, 3, 2), date(2026, 3, 2), None)) == \
+        ["/usr/bin/curl", "/usr/lib/firefox/firefox"]
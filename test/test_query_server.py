@@ -0,0 +1,115 @@
+import json
+import socket
+import threading
+import time
+from datetime import date, datetime, timedelta
+
+import pytest
+
+import soursop.db.writer as writer
+from soursop import config, query_api, util
+from soursop.beans import Level, NetworkUsage, ProcessUsage
+from soursop.cli import query_client
+from soursop.daemon import query_server
+
+FIRST_DAY = date(2026, 1, 1)
+
+
+@pytest.fixture
+def stored_days(database):
+    """60 closed days with one network row of 100/10 bytes at noon."""
+    for offset in range(60):
+        hour_start = datetime.combine(FIRST_DAY + timedelta(days=offset), datetime.min.time()).replace(hour=12)
+        writer.submit_network_usages([NetworkUsage(network="wlan0", date_str=hour_start.strftime(util.DB_DATE_FORMAT),
+                                                   hour=12, bucket=util.hour_bucket(hour_start),
+                                                   incoming_bytes=100, outgoing_bytes=10)])
+    writer.flush()
+    query_server.clear_cache()
+    yield
+    if query_server._CONNECTION is not None:
+        query_server._CONNECTION.close()
+        query_server._CONNECTION = None
+
+
+def test_cached_ranges_are_keyed_by_their_end(stored_days):
+    short = query_server.run_query("network", Level.DAY, FIRST_DAY, date(2026, 1, 3), None)
+    full = query_server.run_query("network", Level.DAY, FIRST_DAY, date(2026, 3, 1), None)
+
+    assert [row[0] for row in short] == ["2026-01-01", "2026-01-02", "2026-01-03"]
+    assert len(full) == 60
+    assert sum(row[3] for row in full) == 6000
+
+
+def test_repeated_query_is_answered_from_the_cache(stored_days):
+    hits = query_server.get_stats()["query_cache_hits_total"]
+    first = query_server.run_query("network", Level.MONTH, FIRST_DAY, date(2026, 3, 1), None)
+    second = query_server.run_query("network", Level.MONTH, FIRST_DAY, date(2026, 3, 1), None)
+
+    assert first == second == [["2026-01-01", 0, "wlan0", 3100, 310], ["2026-02-01", 0, "wlan0", 2800, 280],
+                               ["2026-03-01", 0, "wlan0", 100, 10]]
+    assert query_server.get_stats()["query_cache_hits_total"] == hits + 1
+
+
+
+def exchange(request: bytes) -> dict:
+    """Send one request to handle_client over a socket pair, like the CLI does, and decode the answer."""
+    client, server = socket.socketpair()
+    with client, server:
+        client.sendall(request)
+        query_server.handle_client(server)
+        server.shutdown(socket.SHUT_WR)
+        return json.loads(client.makefile("rb").read())
+
+
+def test_request_is_answered_with_rows(stored_days):
+    response = exchange(query_api.encode_request("network", Level.WEEK, date(2026, 1, 5), date(2026, 1, 18), "wlan"))
+
+    assert response == {"rows": [["2026-01-05", 0, "wlan0", 700, 70], ["2026-01-12", 0, "wlan0", 700, 70]]}
+
+
+@pytest.mark.parametrize("request_line", [
+    b"not json\n",
+    b'{"command": "disk", "level": "day", "from": "2026-01-01", "to": "2026-01-02"}\n',
+    b'{"command": "network", "level": "year", "from": "2026-01-01", "to": "2026-01-02"}\n',
+    b'{"command": "network", "level": "day", "from": "2026-01-02", "to": "2026-01-01"}\n',
+    b'{"command": "network", "level": "day", "from": "2026-01-01"}\n',
+])
+def test_bad_requests_are_answered_with_an_error(stored_days, request_line):
+    errors = query_server.get_stats()["query_errors_total"]
+
+    assert exchange(request_line)["error"].startswith("Bad request")
+    assert query_server.get_stats()["query_errors_total"] == errors + 1
+
+
+def test_cli_query_includes_the_usage_not_written_yet(stored_days, tmp_path, monkeypatch):
+    now = datetime.now().replace(minute=0, second=0, microsecond=0)
+    today = now.date()
+    date_str = now.strftime(util.DB_DATE_FORMAT)
+    stored = NetworkUsage(network="wlan0", date_str=date_str, hour=now.hour, bucket=util.hour_bucket(now),
+                          incoming_bytes=100, outgoing_bytes=10)
+    writer.submit_network_usages([stored])
+    writer.flush()
+    live_network = NetworkUsage(network="wlan0", date_str=date_str, hour=now.hour, bucket=util.hour_bucket(now),
+                                incoming_bytes=150, outgoing_bytes=30)
+    live_process = ProcessUsage(pid=100, name="curl", path="/usr/bin/curl", date_str=date_str, hour=now.hour,
+                                bucket=util.hour_bucket(now), incoming_bytes=40, outgoing_bytes=4)
+    monkeypatch.setattr(query_server, "_LIVE_SOURCES", {"network": lambda: [live_network],
+                                                         "process": lambda: [live_process]})
+    monkeypatch.setattr(config, "QUERY_SOCKET_PATH", str(tmp_path / "query.sock"))
+    monkeypatch.setattr(util, "RUNNING_FLAG", True)
+
+    server = threading.Thread(target=query_server.serve)
+    server.start()
+    try:
+        deadline = time.monotonic() + 5
+        while not (tmp_path / "query.sock").exists() and time.monotonic() < deadline:
+            time.sleep(0.01)
+        network = query_client.query("network", Level.DAY, today, today, None)
+        process = query_client.query("process", Level.DAY, today, today, "CURL")
+    finally:
+        util.RUNNING_FLAG = False
+        server.join()
+
+    assert network == [[date_str, 0, "wlan0", 150, 30]]
+    assert process == [[date_str, 0, "curl", "/usr/bin/curl", 40, 4, 1, 0.0]]
+    assert not (tmp_path / "query.sock").exists()
@@ -0,0 +1,74 @@
+from datetime import date, datetime, timedelta
+
+import pytest
+
+import soursop.db.network_repository as network_repository
+import soursop.db.writer as writer
+from soursop import config, util
+from soursop.beans import Level, NetworkUsage
+from soursop.db import retention
+from soursop.db.connection import open_writer_connection
+
+FIRST_DAY = date(2026, 1, 1)
+TODAY = date(2026, 4, 30)
+
+
+@pytest.fixture
+def retained(database, monkeypatch):
+    """One network row of 100/10 bytes at noon of every day of Q1 2026, then a retention run on TODAY."""
+    for offset in range((date(2026, 4, 1) - FIRST_DAY).days):
+        hour_start = datetime.combine(FIRST_DAY + timedelta(days=offset), datetime.min.time()).replace(hour=12)
+        writer.submit_network_usages([NetworkUsage(network="wlan0", date_str=hour_start.strftime(util.DB_DATE_FORMAT),
+                                                   hour=12, bucket=util.hour_bucket(hour_start),
+                                                   incoming_bytes=100, outgoing_bytes=10)])
+    writer.flush()
+
+    monkeypatch.setattr(config, "HOURLY_RETENTION_DAYS", 60)
+    monkeypatch.setattr(config, "DAILY_RETENTION_DAYS", 75)
+    deletes = []
+    monkeypatch.setattr(retention, "_DELETE_HOOKS", [lambda: deletes.append(True)])
+    conn = open_writer_connection()
+    try:
+        retention.apply_retention(conn, TODAY)
+    finally:
+        conn.close()
+    return deletes
+
+
+def incoming(level: Level, from_date: date, to_date: date) -> list[tuple[str, int]]:
+    return [(entry.date_str, entry.incoming_bytes)
+            for entry in network_repository.aggregate(level, from_date, to_date, None)]
+
+
+def test_hourly_rows_past_the_retention_are_deleted(retained):
+    hours = incoming(Level.HOUR, FIRST_DAY, date(2026, 3, 31))
+
+    assert hours[0][0] == "2026-03-01"
+    assert len(hours) == 31
+    assert retained == [True]
+
+
+def test_day_totals_outlive_the_hourly_rows(retained):
+    days = incoming(Level.DAY, date(2026, 2, 14), date(2026, 2, 20))
+
+    assert days == [(f"2026-02-{day}", 100) for day in range(14, 21)]
+
+
+def test_month_edges_past_the_daily_retention_are_cut_and_reported(retained):
+    months = incoming(Level.MONTH, date(2026, 1, 15), date(2026, 3, 10))
+
+    assert months == [("2026-02-01", 2800), ("2026-03-01", 1000)]
+    assert network_repository.get_report_start(Level.MONTH, date(2026, 1, 15), date(2026, 3, 10)) == \
+        date(2026, 2, 14)
+    assert network_repository.get_report_start(Level.MONTH, date(2026, 1, 1), date(2026, 3, 10)) is None
+
+
+def test_usage_starting_within_a_month_is_not_reported_as_cut(database):
+    hour_start = datetime(2026, 1, 20, 12)
+    writer.submit_network_usages([NetworkUsage(network="wlan0", date_str="2026-01-20", hour=12,
+                                               bucket=util.hour_bucket(hour_start),
+                                               incoming_bytes=100, outgoing_bytes=10)])
+    writer.flush()
+
+    assert incoming(Level.MONTH, date(2026, 1, 15), date(2026, 1, 31)) == [("2026-01-01", 100)]
+    assert network_repository.get_report_start(Level.MONTH, date(2026, 1, 15), date(2026, 1, 31)) is None
@@ -0,0 +1,79 @@
+from datetime import datetime
+
+import pytest
+
+import soursop.db.network_repository as network_repository
+import soursop.db.process_repository as process_repository
+from soursop import util
+from soursop.beans import NetworkUsage, ProcessUsage
+from soursop.db.connection import open_writer_connection
+
+SUNDAY = datetime(2026, 3, 1, 23)  # the last day of the ISO week starting on 2026-02-23
+MONDAY = datetime(2026, 3, 2, 0)
+
+
+def network_usage(hour_start: datetime, incoming: int, outgoing: int) -> NetworkUsage:
+    return NetworkUsage(network="wlan0", date_str=hour_start.strftime(util.DB_DATE_FORMAT), hour=hour_start.hour,
+                        bucket=util.hour_bucket(hour_start), incoming_bytes=incoming, outgoing_bytes=outgoing)
+
+
+def process_usage(hour_start: datetime, incoming: int, sample_rate: int = 1, variance: float = 0.0) -> ProcessUsage:
+    return ProcessUsage(pid=100, name="firefox", path="/usr/lib/firefox/firefox",
+                        date_str=hour_start.strftime(util.DB_DATE_FORMAT), hour=hour_start.hour,
+                        bucket=util.hour_bucket(hour_start), network="wlan0", incoming_bytes=incoming,
+                        outgoing_bytes=0, packet_count=1, sample_rate=sample_rate, byte_variance=variance)
+
+
+@pytest.fixture
+def conn(database):
+    conn = open_writer_connection()
+    yield conn
+    conn.close()
+
+
+def rollup(conn, table: str, level: str, columns: str = "incoming_bytes, outgoing_bytes") -> dict[str, tuple]:
+    return {period: values
+            for period, *values in conn.execute(f"SELECT period, {columns} FROM {table}_{level} ORDER BY period")}
+
+
+def test_inserted_hours_are_added_to_their_periods(conn):
+    with conn:
+        network_repository.update(conn, [network_usage(SUNDAY, 100, 10), network_usage(MONDAY, 200, 20)])
+
+    assert rollup(conn, "network_usage", "day") == {"2026-03-01": [100, 10], "2026-03-02": [200, 20]}
+    assert rollup(conn, "network_usage", "week") == {"2026-02-23": [100, 10], "2026-03-02": [200, 20]}
+    assert rollup(conn, "network_usage", "month") == {"2026-03-01": [300, 30]}
+
+
+def test_updated_hours_add_only_their_change(conn):
+    with conn:
+        network_repository.update(conn, [network_usage(SUNDAY, 100, 10), network_usage(MONDAY, 200, 20)])
+    with conn:
+        network_repository.update(conn, [network_usage(SUNDAY, 150, 10)])
+
+    assert rollup(conn, "network_usage", "day")["2026-03-01"] == [150, 10]
+    assert rollup(conn, "network_usage", "week")["2026-02-23"] == [150, 10]
+    assert rollup(conn, "network_usage", "month")["2026-03-01"] == [350, 30]
+
+
+def test_process_rollups_follow_the_upserts(conn):
+    with conn:
+        process_repository.add_usages(conn, [process_usage(SUNDAY, 100), process_usage(MONDAY, 200)])
+    with conn:
+        process_repository.add_usages(conn, [process_usage(SUNDAY, 400, sample_rate=4, variance=50.0)])
+
+    columns = "incoming_bytes, sample_rate, byte_variance"
+    assert rollup(conn, "process_usage", "day", columns) == {"2026-03-01": [500, 4, 50.0],
+                                                             "2026-03-02": [200, 1, 0.0]}
+    assert rollup(conn, "process_usage", "week", columns) == {"2026-02-23": [500, 4, 50.0],
+                                                              "2026-03-02": [200, 1, 0.0]}
+    assert rollup(conn, "process_usage", "month", columns) == {"2026-03-01": [700, 4, 50.0]}
+
+
+def test_deleted_hours_stay_in_the_rollups(conn):
+    with conn:
+        network_repository.update(conn, [network_usage(SUNDAY, 100, 10)])
+    with conn:
+        conn.execute("DELETE FROM network_usage")
+
+    assert rollup(conn, "network_usage", "month") == {"2026-03-01": [100, 10]}
@@ -0,0 +1,68 @@
+import os
+import socket
+
+import pytest
+
+from soursop.daemon.sock_diag import SockDiag
+
+
+@pytest.fixture
+def diag():
+    try:
+        diag = SockDiag()
+    except OSError as e:
+        pytest.skip(f"no sock_diag netlink socket: {e}")
+    yield diag
+    diag.close()
+
+
+def inode(sock: socket.socket) -> int:
+    return os.fstat(sock.fileno()).st_ino
+
+
+def lookup(diag: SockDiag, protocol: int, sock: socket.socket) -> int:
+    local_ip, local_port = sock.getsockname()[:2]
+    remote_ip, remote_port = sock.getpeername()[:2]
+    return diag.find_socket_inode(protocol, local_ip, local_port, remote_ip, remote_port)
+
+
+def test_tcp_connection_resolves_both_ends(diag):
+    with socket.create_server(("127.0.0.1", 0)) as server, \
+            socket.create_connection(server.getsockname()) as client:
+        accepted, _ = server.accept()
+        with accepted:
+            assert lookup(diag, socket.IPPROTO_TCP, client) == inode(client)
+            assert lookup(diag, socket.IPPROTO_TCP, accepted) == inode(accepted)
+
+
+def test_connected_udp_socket(diag):
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as first, \
+            socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as second:
+        first.bind(("127.0.0.1", 0))
+        second.bind(("127.0.0.1", 0))
+        first.connect(second.getsockname())
+        second.connect(first.getsockname())
+
+        assert lookup(diag, socket.IPPROTO_UDP, first) == inode(first)
+        assert lookup(diag, socket.IPPROTO_UDP, second) == inode(second)
+
+
+def test_ipv4_traffic_of_a_dual_stack_socket(diag):
+    if not socket.has_dualstack_ipv6():
+        pytest.skip("no dual stack IPv6 sockets")
+    with socket.create_server(("::", 0), family=socket.AF_INET6, dualstack_ipv6=True) as server, \
+            socket.create_connection(("127.0.0.1", server.getsockname()[1])) as client:
+        accepted, _ = server.accept()
+        with accepted:
+            local_ip, local_port = client.getpeername()
+            remote_ip, remote_port = client.getsockname()
+
+            assert diag.find_socket_inode(socket.IPPROTO_TCP, local_ip, local_port,
+                                          remote_ip, remote_port) == inode(accepted)
+
+
+def test_unknown_tuple(diag):
+    with socket.socket() as unused:
+        unused.bind(("127.0.0.1", 0))
+        port = unused.getsockname()[1]  # bound but not listening, so the lookup cannot fall back to a listener
+    assert diag.find_socket_inode(socket.IPPROTO_TCP, "127.0.0.1", port, "127.0.0.1", 1) == 0
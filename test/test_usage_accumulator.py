@@ -0,0 +1,87 @@
+import sys
+import threading
+import types
+from datetime import datetime
+from itertools import count
+
+import pytest
+
+from soursop import usage_accumulator
+from soursop.beans import ProcessInfo
+from soursop.usage_accumulator import UsageAccumulator
+
+BROWSER = ProcessInfo(pid=42, name="browser", path="/usr/bin/browser", timestamp=0)
+START = datetime(2026, 1, 1, 10, 59).timestamp()
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Time of the accumulator, starting a minute before 11:00."""
+    now = [START]
+    monkeypatch.setattr(usage_accumulator, "time", types.SimpleNamespace(time=lambda: now[0]))
+    return now
+
+
+def test_usage_is_labelled_with_its_hour(clock):
+    accumulator = UsageAccumulator()
+    accumulator.add(BROWSER, 100, 10)
+    clock[0] += 120
+    accumulator.add(BROWSER, 200, 20)
+
+    entries = sorted(accumulator.drain(), key=lambda entry: entry.hour)
+    assert [(entry.date_str, entry.hour, entry.incoming_bytes) for entry in entries] == [
+        ("2026-01-01", 10, 100), ("2026-01-01", 11, 200)]
+
+
+def test_concurrent_adds_and_drains_across_hours_keep_every_byte(monkeypatch):
+    ticks = count()
+    # every add moves the clock by a second, so the adders roll over several hours while the drains run
+    monkeypatch.setattr(usage_accumulator, "time", types.SimpleNamespace(time=lambda: START + next(ticks)))
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)  # switch threads as often as possible, between any two statements of add
+    accumulator = UsageAccumulator()
+    drained = []
+    stop = threading.Event()
+
+    def drain():
+        while not stop.is_set():
+            drained.extend(accumulator.drain())
+
+    def add():
+        for _ in range(5000):
+            accumulator.add(BROWSER, 1, 0)
+
+    drainer = threading.Thread(target=drain)
+    drainer.start()
+    adders = [threading.Thread(target=add) for _ in range(4)]
+    for adder in adders:
+        adder.start()
+    for adder in adders:
+        adder.join()
+    stop.set()
+    drainer.join()
+    sys.setswitchinterval(interval)
+    drained.extend(accumulator.drain())
+
+    assert sum(entry.incoming_bytes for entry in drained) == 20000
+    assert {entry.hour for entry in drained} >= {10, 11, 12, 13, 14, 15}
+
+
+def test_sampled_packets_carry_their_rate_and_byte_variance(clock):
+    accumulator = UsageAccumulator()
+    accumulator.add(BROWSER, 1000, 0, packet_count=10, sample_rate=10)  # 1 sampled packet of 100 bytes
+    accumulator.add(BROWSER, 0, 400, packet_count=4, sample_rate=4)
+    accumulator.add(BROWSER, 50, 0)
+
+    [entry] = accumulator.drain()
+    assert (entry.incoming_bytes, entry.outgoing_bytes, entry.packet_count) == (1050, 400, 15)
+    assert entry.sample_rate == 10
+    assert entry.byte_variance == pytest.approx(9 * 1000 ** 2 / 10 + 3 * 400 ** 2 / 4)
+
+
+def test_unsampled_packets_have_no_variance(clock):
+    accumulator = UsageAccumulator()
+    accumulator.add(BROWSER, 1000, 100, packet_count=3)
+
+    [entry] = accumulator.drain()
+    assert (entry.sample_rate, entry.byte_variance) == (1, 0.0)
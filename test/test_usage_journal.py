@@ -0,0 +1,110 @@
+from datetime import date, datetime
+
+import pytest
+
+import soursop.db.network_repository as network_repository
+import soursop.db.process_repository as process_repository
+import soursop.db.writer as writer
+from soursop import util
+from soursop.beans import Level, NetworkUsage, ProcessInfo
+from soursop.usage_accumulator import UsageAccumulator
+from soursop.usage_journal import UsageJournal
+
+SLOTS = 16
+BROWSER = ProcessInfo(pid=42, name="browser", path="/usr/bin/browser", timestamp=0)
+
+
+@pytest.fixture
+def journal_path(database, tmp_path):
+    return tmp_path / "usage.journal"
+
+
+def start_daemon(path) -> tuple[UsageJournal, UsageAccumulator]:
+    """What the daemon does on startup: replay the journal of the previous run, then journal the new usage."""
+    journal = UsageJournal(path, slots=SLOTS)
+    writer.replay_journal(journal)
+    accumulator = UsageAccumulator()
+    accumulator.attach_journal(journal)
+    return journal, accumulator
+
+
+def stored_process_bytes() -> tuple[int, int]:
+    entries = process_repository.aggregate(Level.DAY, date.today(), date.today(), None)
+    return sum(entry.incoming_bytes for entry in entries), sum(entry.outgoing_bytes for entry in entries)
+
+
+def test_replay_writes_the_usage_of_a_crashed_run(journal_path):
+    journal, accumulator = start_daemon(journal_path)
+    accumulator.add(BROWSER, 1000, 200, packet_count=3)
+    accumulator.add(BROWSER, 500, 0)
+    hour_start = datetime(2026, 1, 1, 10)
+    journal.set_network_totals([NetworkUsage(network="wlan0", date_str="2026-01-01", hour=10,
+                                             bucket=util.hour_bucket(hour_start),
+                                             incoming_bytes=7000, outgoing_bytes=700)])
+    journal.close()  # the daemon dies without a final flush
+
+    start_daemon(journal_path)[0].close()
+
+    assert stored_process_bytes() == (1500, 200)
+    stored = network_repository.aggregate(Level.HOUR, date(2026, 1, 1), date(2026, 1, 1), None)
+    assert [(entry.network, entry.incoming_bytes, entry.outgoing_bytes) for entry in stored] == [("wlan0", 7000, 700)]
+
+
+def test_committed_usage_is_not_replayed_again(journal_path):
+    journal, accumulator = start_daemon(journal_path)
+    accumulator.add(BROWSER, 1000, 200)
+    writer.submit_process_usages(accumulator.drain())
+    writer.flush()
+    journal.release_sealed()  # the writer's commit hook
+    accumulator.add(BROWSER, 50, 5)
+    journal.close()
+
+    start_daemon(journal_path)[0].close()
+
+    assert stored_process_bytes() == (1050, 205)
+
+
+def test_drained_usage_is_replayed_when_the_commit_never_happened(journal_path):
+    journal, accumulator = start_daemon(journal_path)
+    accumulator.add(BROWSER, 1000, 200)
+    accumulator.drain()  # sealed, but the daemon dies before the writer commits it
+    accumulator.add(BROWSER, 50, 5)
+    journal.close()
+
+    start_daemon(journal_path)[0].close()
+
+    assert stored_process_bytes() == (1050, 205)
+
+
+def test_replay_is_not_repeated_after_a_crash_before_the_reset(journal_path, monkeypatch):
+    journal, accumulator = start_daemon(journal_path)
+    accumulator.add(BROWSER, 1000, 200)
+    accumulator.drain()  # sealed, but the daemon dies before the writer commits it
+    accumulator.add(BROWSER, 50, 5)
+    journal.close()
+
+    def crash() -> None:
+        raise SystemExit("crashed between the commit of the replay and the reset of the journal")
+
+    with monkeypatch.context() as crashing:
+        crashing.setattr(UsageJournal, "reset", lambda self: crash())
+        with pytest.raises(SystemExit):
+            start_daemon(journal_path)
+    assert stored_process_bytes() == (1050, 205)
+
+    start_daemon(journal_path)[0].close()
+
+    assert stored_process_bytes() == (1050, 205)
+
+
+def test_committed_region_is_not_replayed_after_a_crash_before_its_release(journal_path):
+    journal, accumulator = start_daemon(journal_path)
+    accumulator.add(BROWSER, 1000, 200)
+    writer.submit_process_usages(accumulator.drain())
+    writer.flush()  # the daemon dies before the commit hook releases the sealed region
+    accumulator.add(BROWSER, 50, 5)
+    journal.close()
+
+    start_daemon(journal_path)[0].close()
+
+    assert stored_process_bytes() == (1050, 205)